@@ -1,8 +1,14 @@
+import sys
+import time
 import click
 import unittest
-from scraping import TypeScrap, run as run_scraping
+from scraping import TypeScrap, run as run_scraping, enqueue as enqueue_scraping, work as work_scraping
 
-from project import app
+from project import app, db, transfer
+from project.columnar import column_store
+from project.metrics import metrics
+from project.analytics import FORWARD_HORIZONS
+from project.models import Ticker, Trade, PriceStats, InsiderActivity
 
 
 @click.option(
@@ -18,10 +24,113 @@ from project import app
     help='Type of the scraping on trades|prices, default all',
     default=TypeScrap.ALL
 )
-@click.option('--threads', '-t', type=int, help='Scraping threads count, between 1 and 10', default=5)
+@click.option('--threads', '-t', type=int, help='Max of the pages in flight, the scheduler adapts below it', default=5)
+@click.option('--rate', type=float, help='Requests per second to the host, SCRAPER_HOST_RATE by default')
+@click.option('--force', is_flag=True, help='Load the pages unchanged since the last run too')
+@click.option('--full', is_flag=True, help='Walk all pages of trades, for the backfill behind the known ones')
+@click.option('--parse-workers', type=int, help='Processes parsing the pages, CPU count by default, 0 for none')
+@click.option('--enqueue', is_flag=True, help='Queue the tickers of the file for the workers instead of scraping')
+@click.option('--worker', is_flag=True, help='Scrap the jobs of the queue until none is left, instead of the file')
 @app.cli.command()
-def scraping(file, restrict, threads):
-    run_scraping(file, threads, types_scrubs=restrict)
+def scraping(file, restrict, threads, rate, force, full, parse_workers, enqueue, worker):
+    if enqueue and worker:
+        raise click.UsageError('--enqueue and --worker are exclusive')
+    if enqueue:
+        print('{} jobs queued'.format(enqueue_scraping(file, types_scrubs=restrict)))
+    elif worker:
+        work_scraping(threads, force=force, full=full, parse_workers=parse_workers, rate=rate)
+    else:
+        run_scraping(
+            file, threads, types_scrubs=restrict, force=force, full=full, parse_workers=parse_workers, rate=rate
+        )
+
+
+@click.option('--ticker', '-t', multiple=True, help='Name of the ticker, all tickers by default')
+@click.option(
+    '--check', is_flag=True, help='Compare the stored stats with the computation from scratch, nothing is written'
+)
+@app.cli.command()
+def stats(ticker, check):
+    """Rebuilds the rolling stats of the prices."""
+    tickers = Ticker.query.order_by(Ticker.name)
+    if ticker:
+        tickers = tickers.filter(Ticker.name.in_(ticker))
+    differ_count = 0
+    for ticker_id, ticker_name in tickers.with_entities(Ticker.id, Ticker.name).all():
+        if check:
+            differ = PriceStats.check(ticker_id)
+            differ_count += len(differ)
+            print('{}: {} rows differ{}'.format(
+                ticker_name, len(differ), ', first {} {}'.format(*differ[0]) if differ else ''
+            ))
+            continue
+        written = PriceStats.refresh(ticker_id)
+        version = Ticker.bump_version(ticker_id)
+        db.session.commit()
+        column_store.advance(ticker_name, version)
+        print('{}: {} rows'.format(ticker_name, written))
+    if differ_count:
+        sys.exit(1)
+
+
+@click.option('--ticker', '-t', multiple=True, help='Name of the ticker, all tickers by default')
+@app.cli.command()
+def activity(ticker):
+    """Rebuilds the monthly aggregates of the insider trades."""
+    tickers = Ticker.query.order_by(Ticker.name)
+    if ticker:
+        tickers = tickers.filter(Ticker.name.in_(ticker))
+    for ticker_id, ticker_name in tickers.with_entities(Ticker.id, Ticker.name).all():
+        written = InsiderActivity.refresh(ticker_id)
+        version = Ticker.bump_version(ticker_id)
+        db.session.commit()
+        column_store.advance(ticker_name, version)
+        print('{}: {} rows'.format(ticker_name, written))
+
+
+@click.option('--ticker', '-t', multiple=True, help='Name of the ticker, all tickers by default')
+@click.option('--horizon', '-n', type=int, multiple=True, help='Trading days after the trade, 5, 20 and 60 by default')
+@click.option('--by', type=click.Choice(['insider', 'transaction_type']), default='transaction_type',
+              help='Group of the trades, transaction_type by default')
+@app.cli.command()
+def returns(ticker, horizon, by):
+    """Prints the returns of the close after the insider trades."""
+    tickers = Ticker.query.order_by(Ticker.name)
+    if ticker:
+        tickers = tickers.filter(Ticker.name.in_(ticker))
+    for ticker_name, in tickers.with_entities(Ticker.name).all():
+        for row in Trade.get_forward_returns(ticker_name, horizon or FORWARD_HORIZONS)[by]:
+            print('{} {} {}d: {} trades, {} returns, mean {}, positive {}'.format(
+                ticker_name, row.group, row.horizon, row.trades_count, row.returns_count,
+                'n/a' if row.mean_return is None else '{:+.2%}'.format(row.mean_return),
+                'n/a' if row.positive_share is None else '{:.0%}'.format(row.positive_share),
+            ))
+
+
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.argument('kind', type=click.Choice(transfer.KINDS))
+@app.cli.command('import')
+def import_csv(kind, path):
+    """Merges the prices or trades of the CSV file written by export."""
+    started = time.perf_counter()
+    with open(path, newline='') as csv_file:
+        try:
+            count = transfer.import_csv(kind, csv_file)
+        except ValueError as error:
+            raise click.ClickException(str(error))
+    print('{}: {} rows in {:.1f} s'.format(kind, count, time.perf_counter() - started))
+    metrics.report('db_rows_')
+
+
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.argument('kind', type=click.Choice(transfer.KINDS))
+@app.cli.command('export')
+def export_csv(kind, path):
+    """Writes the prices or trades with the names of the tickers and insiders to the CSV file."""
+    started = time.perf_counter()
+    with open(path, 'w', newline='') as csv_file:
+        count = transfer.export_csv(kind, csv_file)
+    print('{}: {} rows in {:.1f} s'.format(kind, count, time.perf_counter() - started))
 
 
 @app.cli.command()
@@ -0,0 +1,101 @@
+"""Scaling of PriceHistory.get_delta over the years of the daily bars
+
+    python -m benchmarks.bench_delta --years 1 2 5 10 20
+    FLASK_CONFIGURATION=testing python -m benchmarks.bench_delta --sql --years 1 2 4
+
+--sql also times the former DELTA_SELECT self-join on the configured database.
+"""
+import time
+import argparse
+
+from sqlalchemy import text
+
+from project.analytics import PriceColumns, delta_rows
+from benchmarks.generators import TRADING_DAYS, price_bars
+
+LEGACY_DELTA_SELECT = '''
+    WITH tab_diff AS (
+        SELECT
+        price_history_1.date as history_begin, price_history_2.date as history_end,
+        abs(price_history_1.{type_price} - price_history_2.{type_price}) as diff,
+        ticker.id as ticker_id
+        FROM ticker JOIN price_history AS price_history_1 ON price_history_1.ticker_id = ticker.id
+        JOIN price_history AS price_history_2
+            ON price_history_2.ticker_id = ticker.id
+            AND price_history_2.date  > price_history_1.date
+        WHERE ticker.name = '{ticker_name}'
+    ),
+    end_group AS (
+        SELECT
+        tab_diff.history_begin,
+        MIN(tab_diff.history_end) OVER (PARTITION BY tab_diff.history_begin) as end_date
+        FROM tab_diff WHERE diff > {value_delta}
+    ),
+    begin_group AS (
+        SELECT
+        end_group.end_date,
+        MAX(end_group.history_begin) OVER (PARTITION BY end_group.end_date) as begin_date
+        FROM end_group
+    ),
+    period_groups AS (
+        SELECT
+        row_number() OVER () as g_num,
+        begin_date AS begin, end_date AS end
+        FROM begin_group GROUP BY end_date, begin_date
+    )
+    SELECT * FROM price_history as ph
+    JOIN ticker AS tk ON ph.ticker_id = tk.id and tk.name = '{ticker_name}'
+    JOIN period_groups AS gp ON ph.date BETWEEN gp.begin and gp.end
+    JOIN tab_diff AS td ON td.history_begin = gp.begin AND td.history_end = gp.end AND  td.ticker_id = tk.id
+    ORDER BY g_num, date;
+'''
+
+
+def timing(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def legacy_timing(series, value):
+    from project import app, db
+    from project.models import Ticker, PriceHistory
+
+    with app.app_context():
+        created = not db.engine.has_table(Ticker.__tablename__)
+        db.create_all()
+        ticker = Ticker(name='benchdelta')
+        db.session.add(ticker)
+        db.session.flush()
+        PriceHistory.bulk_upsert([dict(bar._asdict(), ticker_id=ticker.id) for bar in series])
+        db.session.commit()
+        try:
+            sql = text(LEGACY_DELTA_SELECT.format(ticker_name='benchdelta', type_price='close', value_delta=value))
+            return timing(lambda: db.session.execute(sql).fetchall())
+        finally:
+            PriceHistory.query.filter_by(ticker_id=ticker.id).delete()
+            db.session.delete(ticker)
+            db.session.commit()
+            if created:
+                db.drop_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 2, 5, 10, 20])
+    parser.add_argument('--value', type=float, default=10, help='delta of the close price')
+    parser.add_argument('--sql', action='store_true', help='time the former self-join too')
+    args = parser.parse_args()
+
+    for years in args.years:
+        series = price_bars(years * TRADING_DAYS)
+        seconds, rows = timing(delta_rows, PriceColumns.from_rows(series), 'close', args.value)
+        line = '{:>3} years {:>6} bars   engine {:8.4f}s {:>7} rows'.format(years, len(series), seconds, len(rows))
+        if args.sql:
+            sql_seconds, sql_rows = legacy_timing(series, args.value)
+            line += '   self-join {:8.3f}s {:>7} rows'.format(sql_seconds, len(sql_rows))
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
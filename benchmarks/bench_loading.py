@@ -0,0 +1,158 @@
+"""Loading of the scraped pages: per-row get_or_create against the bulk upsert
+
+    FLASK_CONFIGURATION=testing python -m benchmarks.bench_loading --rows 100000
+
+Writes into the configured database, synthetic tickers, insiders and transaction types are removed at the end.
+"""
+import time
+import argparse
+from datetime import datetime
+from collections import OrderedDict
+from sqlalchemy import exists
+
+from project import app, db, dimensions
+from project.models import Ticker, Insider, TransactionType, PriceHistory, PriceStats, Trade, InsiderActivity
+from project.utils import get_or_create
+from project.parsing import STR_DATE, parse_prices, parse_trades
+from scraping import WriteBatch, prices_loading, trades_loading
+from benchmarks.generators import (
+    TICKER_PREFIX, INSIDER_NAME, INSIDER_CODES, TRANSACTION_TYPES, price_pages, trade_pages, changed_pages
+)
+
+
+def bulk_prices_loading(trick_name, prices):
+    prices_loading(trick_name, parse_prices(prices))
+
+
+def bulk_trades_loading(trick_name, trades):
+    trades_loading(trick_name, parse_trades(trades))
+
+
+def batch_prices_loading(trick_name, pages):
+    """Pages of the ticker by one commit, like the writer loading the queued pages"""
+    batch = WriteBatch()
+    for prices in pages:
+        batch.prices(trick_name, parse_prices(prices))
+    batch.commit()
+
+
+def batch_trades_loading(trick_name, pages):
+    """Pages of the ticker by one commit, like the writer loading the queued pages"""
+    batch = WriteBatch()
+    for trades in pages:
+        batch.trades(trick_name, parse_trades(trades))
+    batch.commit()
+
+
+def ticker_batches(pages):
+    """:return: list of (ticker name, its pages)"""
+    batches = OrderedDict()
+    for trick_name, page in pages:
+        batches.setdefault(trick_name, []).append(page)
+    return list(batches.items())
+
+
+def legacy_prices_loading(trick_name, prices):
+    """Per-row path of the loader before the bulk upsert"""
+    ticker = get_or_create(Ticker, name=trick_name)
+    order_params = {'date': 0, 'open': 1, 'high': 2, 'low': 3, 'close': 4, 'volume': 5}
+    for row in prices:
+        params = dict((key, row[index]) for key, index in order_params.items())
+        write_date = datetime.strptime(params.pop('date'), STR_DATE).date()
+        price_record, created = PriceHistory.get_or_create(ticker=ticker, date=write_date, **params)
+        if not created:
+            price_record.update(**params)
+    db.session.commit()
+
+
+def legacy_trades_loading(trick_name, trades):
+    """Per-row path of the loader before the bulk upsert"""
+    order_params = {
+        'code': 0, 'insider': 1, 'last_price': 2, 'last_date': 4,
+        'transaction_type': 5, 'shares_traded': 7, 'shares_held': 8
+    }
+    ticker = get_or_create(Ticker, name=trick_name)
+    for row in trades:
+        params = dict((key, row[index]) for key, index in order_params.items())
+        last_date = datetime.strptime(params.pop('last_date'), STR_DATE).date()
+        insider_code = params.pop('code', '').split('-')[-1]
+        insider = get_or_create(Insider, name=params.pop('insider'), code=insider_code)
+        transaction_type = get_or_create(TransactionType, name=params.pop('transaction_type'))
+        trade_record, created = Trade.get_or_create(
+            ticker=ticker, insider=insider, last_date=last_date, transaction_type=transaction_type, **params
+        )
+        if not created:
+            trade_record.update(**params)
+    db.session.commit()
+
+
+def cleanup():
+    tickers = db.session.query(Ticker.id).filter(Ticker.name.like(TICKER_PREFIX + '%'))
+    for model in (PriceStats, InsiderActivity, PriceHistory, Trade):
+        model.query.filter(model.ticker_id.in_(tickers.subquery())).delete(synchronize_session=False)
+    Ticker.query.filter(Ticker.name.like(TICKER_PREFIX + '%')).delete(synchronize_session=False)
+    # synthetic insiders and transaction types, unless trades of other tickers have them
+    Insider.query.filter(
+        Insider.name.like(INSIDER_NAME + ' %'), Insider.code > INSIDER_CODES,
+        ~exists().where(Trade.insider_id == Insider.id)
+    ).delete(synchronize_session=False)
+    TransactionType.query.filter(
+        TransactionType.name.in_(TRANSACTION_TYPES), ~exists().where(Trade.transaction_type_id == TransactionType.id)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    dimensions.clear()
+
+
+def timing(loader, pages):
+    started = time.perf_counter()
+    for trick_name, page in pages:
+        loader(trick_name, page)
+    return time.perf_counter() - started
+
+
+def bench(name, loader, pages, changed, rows):
+    """Insert of the pages, the same pages again and the pages changing every stored row"""
+    cleanup()
+    inserted = timing(loader, pages)
+    updated = timing(loader, pages)
+    changed = timing(loader, changed)
+    print('{:<16} {}'.format(name, '   '.join(
+        '{} {:8.2f}s {:10.0f} rows/s'.format(path, seconds, rows / seconds)
+        for path, seconds in (('insert', inserted), ('same', updated), ('change', changed))
+    )))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help='synthetic rows of each kind')
+    parser.add_argument('--skip-legacy', action='store_true', help='time only the bulk loaders')
+    args = parser.parse_args()
+
+    prices = price_pages(args.rows)
+    trades = trade_pages(args.rows)
+    changed_prices = changed_pages(prices, 4)
+    changed_trades = changed_pages(trades, 2)
+    price_rows = sum(len(page) for _, page in prices)
+    trade_rows = sum(len(page) for _, page in trades)
+
+    with app.app_context():
+        created = not db.engine.has_table(Ticker.__tablename__)
+        db.create_all()
+        try:
+            bench('prices bulk', bulk_prices_loading, prices, changed_prices, price_rows)
+            bench('prices batch', batch_prices_loading,
+                  ticker_batches(prices), ticker_batches(changed_prices), price_rows)
+            bench('trades bulk', bulk_trades_loading, trades, changed_trades, trade_rows)
+            bench('trades batch', batch_trades_loading,
+                  ticker_batches(trades), ticker_batches(changed_trades), trade_rows)
+            if not args.skip_legacy:
+                bench('prices per-row', legacy_prices_loading, prices, changed_prices, price_rows)
+                bench('trades per-row', legacy_trades_loading, trades, changed_trades, trade_rows)
+        finally:
+            cleanup()
+            if created:
+                db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Parsing of the scraped tables: babel listeners per row against the batch parsing stage
+
+    python -m benchmarks.bench_parsing --rows 100000
+
+No database is needed, listeners are called on plain targets.
+"""
+import time
+import argparse
+from types import SimpleNamespace
+from datetime import datetime
+
+from project.models import serialize_prices_before_puts, serialize_trade_before_puts
+from project.parsing import STR_DATE, parse_prices, parse_trades
+from benchmarks.generators import price_pages, trade_pages
+
+
+def listeners_prices(rows):
+    for row in rows:
+        target = SimpleNamespace(
+            date=datetime.strptime(row[0], STR_DATE).date(),
+            open=row[1], high=row[2], low=row[3], close=row[4], volume=row[5]
+        )
+        serialize_prices_before_puts(None, None, target)
+
+
+def listeners_trades(rows):
+    for row in rows:
+        target = SimpleNamespace(
+            last_date=datetime.strptime(row[4], STR_DATE).date(),
+            last_price=row[2], shares_traded=row[7], shares_held=row[8]
+        )
+        serialize_trade_before_puts(None, None, target)
+
+
+def best_of(repeat, function, rows):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(rows)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help='synthetic rows of each kind')
+    parser.add_argument('--repeat', type=int, default=3, help='best of the repeats is reported')
+    args = parser.parse_args()
+
+    prices = [row for _, page in price_pages(args.rows) for row in page]
+    trades = [row for _, page in trade_pages(args.rows) for row in page]
+
+    for name, rows, legacy, batch in (
+        ('prices', prices, listeners_prices, parse_prices),
+        ('trades', trades, listeners_trades, parse_trades),
+    ):
+        legacy_time = best_of(args.repeat, legacy, rows)
+        batch_time = best_of(args.repeat, batch, rows)
+        print('{:<8} listeners {:7.3f}s   parsing stage {:7.3f}s   x{:.1f}'.format(
+            name, legacy_time, batch_time, legacy_time / batch_time
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Deterministic synthetic market data of configurable size for the benchmarks
+
+The same size and seed give the same data on every run, so timings of different commits
+are taken on the same input.
+"""
+import random
+from html import escape
+from datetime import date, timedelta
+from collections import namedtuple
+
+from project.analytics import PriceColumns
+from project.parsing import STR_DATE
+
+TICKER_PREFIX = 'bench'
+TRADING_DAYS = 252
+PRICES_PAGE = 63
+TRADES_PAGE = 40
+# names of the synthetic dimensions, the cleanup removes them by these
+INSIDER_NAME = 'BENCH INSIDER'
+INSIDER_CODES = 900000
+TRANSACTION_TYPES = ('Bench Sell', 'Bench Buy', 'Bench Automatic Sell', 'Bench Option Execute')
+RELATIONS = ('Director', 'Chief Executive Officer', 'Vice President', 'Officer')
+
+Bar = namedtuple('Bar', ('date', 'open', 'high', 'low', 'close', 'volume'))
+
+
+def ticker_name(index, prefix=TICKER_PREFIX):
+    return '{}{}'.format(prefix, index)
+
+
+def price_bars(days, seed=3, start=date(2000, 1, 3)):
+    """Random walk of the daily bars on the trading days
+    :param days: count of the bars
+    :return: list of Bar ordered by date
+    """
+    rnd = random.Random(seed)
+    price = 100.0
+    day = start
+    bars = []
+    for _ in range(days):
+        close = max(1.0, price + rnd.gauss(0, 1.5))
+        bars.append(Bar(
+            day, round(price, 2), round(max(price, close) + rnd.random(), 2),
+            round(min(price, close) - rnd.random(), 2), round(close, 2), rnd.randint(10 ** 5, 10 ** 7)
+        ))
+        price = close
+        day += timedelta(days=1 if day.weekday() < 4 else 3)
+    return bars
+
+
+def price_columns(days, seed=3):
+    return PriceColumns.from_rows(price_bars(days, seed))
+
+
+def scraped_price(bar):
+    """Bar as the row of strings scraped from the historical prices table"""
+    return [
+        bar.date.strftime(STR_DATE),
+        '{:.2f}'.format(bar.open),
+        '{:.2f}'.format(bar.high),
+        '{:.2f}'.format(bar.low),
+        '{:.2f}'.format(bar.close),
+        '{:,}'.format(bar.volume),
+    ]
+
+
+def _pages(rows, size):
+    return [rows[index:index + size] for index in range(0, len(rows), size)]
+
+
+def price_pages(rows, seed=1, per_ticker=10 * TRADING_DAYS, page_size=PRICES_PAGE):
+    """Pages of the scraped price rows, per_ticker bars for every synthetic ticker
+    :return: list of (ticker name, page rows)
+    """
+    pages = []
+    for ticker_index in range(max(1, rows // per_ticker)):
+        bars = price_bars(min(per_ticker, rows), seed=seed + ticker_index)
+        pages.extend(
+            (ticker_name(ticker_index), page)
+            for page in _pages([scraped_price(bar) for bar in bars], page_size)
+        )
+    return pages
+
+
+def scraped_trades(rows, seed=2, insiders=200):
+    """Rows of strings scraped from the insider trades table
+    :return: list of [code, insider, last price, relation, last date,
+        transaction type, owner type, shares traded, shares held]
+    """
+    rnd = random.Random(seed)
+    trades = []
+    for row_index in range(rows):
+        insider = rnd.randint(1, insiders)
+        trades.append([
+            'bench-insider-{}-{}'.format(insider, INSIDER_CODES + insider),
+            '{} {}'.format(INSIDER_NAME, insider),
+            '{:.2f}'.format(rnd.uniform(20, 200)),
+            RELATIONS[insider % len(RELATIONS)],
+            (date(2008, 1, 1) + timedelta(days=row_index)).strftime(STR_DATE),
+            TRANSACTION_TYPES[row_index % len(TRANSACTION_TYPES)],
+            'direct',
+            '{:,}'.format(rnd.randint(100, 10 ** 5)),
+            '{:,}'.format(rnd.randint(10 ** 5, 10 ** 7)),
+        ])
+    return trades
+
+
+def trade_pages(rows, seed=2, per_ticker=2000, page_size=TRADES_PAGE):
+    """Pages of the scraped insider trades rows
+    :return: list of (ticker name, page rows)
+    """
+    pages = []
+    for ticker_index in range(max(1, rows // per_ticker)):
+        trades = scraped_trades(min(per_ticker, rows), seed=seed + ticker_index)
+        pages.extend((ticker_name(ticker_index), page) for page in _pages(trades, page_size))
+    return pages
+
+
+def changed_pages(pages, column):
+    """Pages with the value of the column one cent up, every row of them changes the stored one
+    :param column: index of the price in the scraped rows
+    """
+    return [
+        (trick_name, [
+            row[:column] + ['{:.2f}'.format(float(row[column]) + 0.01)] + row[column + 1:] for row in page
+        ])
+        for trick_name, page in pages
+    ]
+
+
+def prices_html(rows):
+    """Historical prices page of nasdaq.com with the rows of strings
+    :return: raw body of the page
+    """
+    lines = ['<html><body><table><thead><tr><th>Date</th></tr></thead><tbody>']
+    for row in rows:
+        lines.append('<tr>' + ''.join(
+            '<td>\r\n                {}\r\n            </td>'.format(value) for value in row
+        ) + '</tr>')
+    lines.append('</tbody></table></body></html>')
+    return '\n'.join(lines).encode()
+
+
+def trades_html(rows, ticker='bench0', last_page=10):
+    """Insider trades page of nasdaq.com with the scraped rows, see scraped_trades
+    :return: raw body of the page
+    """
+    lines = [
+        '<html><body><div id="content_main">',
+        '<div class="genTable"></div>' * 7,
+        '<div class="genTable"><div></div><div></div><div></div><div></div><div><table>',
+        '<thead><tr><th>Insider</th></tr></thead>',
+    ]
+    for code, insider, price, relation, last_date, transaction_type, owner, traded, held in rows:
+        lines.append(
+            '<tr><td><a href="https://www.nasdaq.com/quotes/insiders/{}">{}</a></td>'.format(code, escape(insider)) +
+            ''.join('<td>{}</td>'.format(escape(value)) for value in (
+                relation, last_date, transaction_type, owner, traded, price, held
+            )) + '</tr>'
+        )
+    lines.append('</table></div></div>')
+    lines.append(
+        '<div id="pagerContainer"><a id="quotes_content_left_lb_LastPage" '
+        'href="https://www.nasdaq.com/symbol/{}/insider-trades?page={}">last</a></div>'.format(ticker, last_page)
+    )
+    lines.append('</div></body></html>')
+    return '\n'.join(lines).encode()
@@ -0,0 +1,363 @@
+"""Timings of the hot paths on the synthetic data, recorded as JSON to compare the commits
+
+    FLASK_CONFIGURATION=testing python -m benchmarks.run --output before.json
+    FLASK_CONFIGURATION=testing python -m benchmarks.run --compare before.json --threshold 0.2
+
+Cases of the database run against the configured one, synthetic tickers are removed at the end.
+With --compare the run fails when some case is slower than the baseline by more than the threshold.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+from types import SimpleNamespace
+from collections import OrderedDict
+
+import numpy as np
+
+from project import app, db
+from project.models import Ticker, PriceHistory, serialize_prices_before_puts, serialize_trade_before_puts
+from project.analytics import delta_rows, align_closes, return_matrices
+from project.parsing import parse_prices, parse_trades
+from scraping import TradingScraper, prices_loading, trades_loading
+from benchmarks.bench_loading import cleanup, batch_prices_loading, batch_trades_loading, ticker_batches
+from benchmarks.generators import (
+    PRICES_PAGE,
+    price_bars,
+    price_columns,
+    price_pages,
+    trade_pages,
+    changed_pages,
+    scraped_price,
+    scraped_trades,
+    ticker_name,
+    prices_html,
+    trades_html,
+)
+
+CASES = OrderedDict()
+ANALYTICS_CALLS = 200
+CORRELATION_TICKERS = 300
+
+
+class Case:
+    """Function timed on the data prepared once, reset goes untimed before every repeat
+    :param units: count of the rows or calls processed by one run
+    """
+    def __init__(self, run, units, reset=None):
+        self.run = run
+        self.units = units
+        self.reset = reset
+
+
+def case(name, database=False):
+    """Register the function preparing the Case for the size of the data"""
+    def register(prepare):
+        CASES[name] = (prepare, database)
+        return prepare
+    return register
+
+
+def _rows(pages):
+    return [row for _, page in pages for row in page]
+
+
+def _load_pages(loader, parse, pages):
+    for trick_name, page in pages:
+        loader(trick_name, parse(page))
+
+
+def _load_batches(loader, batches):
+    for trick_name, pages in batches:
+        loader(trick_name, pages)
+
+
+@case('listeners.prices')
+def listeners_prices(size):
+    rows = [scraped_price(bar) for bar in price_bars(size)]
+
+    def run():
+        for row in rows:
+            serialize_prices_before_puts(None, None, SimpleNamespace(volume=row[5]))
+    return Case(run, len(rows))
+
+
+@case('listeners.trades')
+def listeners_trades(size):
+    rows = scraped_trades(size)
+
+    def run():
+        for row in rows:
+            target = SimpleNamespace(last_price=row[2], shares_traded=row[7], shares_held=row[8])
+            serialize_trade_before_puts(None, None, target)
+    return Case(run, len(rows))
+
+
+@case('parsing.prices')
+def parsing_prices(size):
+    rows = _rows(price_pages(size))
+    return Case(lambda: parse_prices(rows), len(rows))
+
+
+@case('parsing.trades')
+def parsing_trades(size):
+    rows = _rows(trade_pages(size))
+    return Case(lambda: parse_trades(rows), len(rows))
+
+
+@case('extract.prices')
+def extract_prices(size):
+    pages = [prices_html(page) for _, page in price_pages(size)]
+
+    def run():
+        for content in pages:
+            TradingScraper.extract_prices(content)
+    return Case(run, size)
+
+
+@case('extract.trades')
+def extract_trades(size):
+    pages = [trades_html(page, ticker=trick_name) for trick_name, page in trade_pages(size)]
+
+    def run():
+        for content in pages:
+            TradingScraper.extract_trades(content)
+    return Case(run, size)
+
+
+@case('loading.prices.insert', database=True)
+def loading_prices_insert(size):
+    pages = price_pages(size)
+    return Case(lambda: _load_pages(prices_loading, parse_prices, pages), size, reset=cleanup)
+
+
+@case('loading.prices.update', database=True)
+def loading_prices_update(size):
+    pages = price_pages(size)
+    cleanup()
+    _load_pages(prices_loading, parse_prices, pages)
+    return Case(lambda: _load_pages(prices_loading, parse_prices, pages), size)
+
+
+@case('loading.prices.change', database=True)
+def loading_prices_change(size):
+    # the pages of the ticker go by one commit like in the writer, every row of them changes the stored one
+    batches = ticker_batches(price_pages(size))
+    changed = ticker_batches(changed_pages(price_pages(size), 4))
+    cleanup()
+    return Case(
+        lambda: _load_batches(batch_prices_loading, changed), size,
+        reset=lambda: _load_batches(batch_prices_loading, batches)
+    )
+
+
+@case('loading.trades.insert', database=True)
+def loading_trades_insert(size):
+    pages = trade_pages(size)
+    return Case(lambda: _load_pages(trades_loading, parse_trades, pages), size, reset=cleanup)
+
+
+@case('loading.trades.update', database=True)
+def loading_trades_update(size):
+    pages = trade_pages(size)
+    cleanup()
+    _load_pages(trades_loading, parse_trades, pages)
+    return Case(lambda: _load_pages(trades_loading, parse_trades, pages), size)
+
+
+@case('loading.trades.change', database=True)
+def loading_trades_change(size):
+    batches = ticker_batches(trade_pages(size))
+    changed = ticker_batches(changed_pages(trade_pages(size), 2))
+    cleanup()
+    return Case(
+        lambda: _load_batches(batch_trades_loading, changed), size,
+        reset=lambda: _load_batches(batch_trades_loading, batches)
+    )
+
+
+@case('delta.engine')
+def delta_engine(size):
+    columns = price_columns(size)
+    return Case(lambda: delta_rows(columns, 'close', 10), size)
+
+
+@case('correlation.engine')
+def correlation_engine(size):
+    # every ticker misses some days, the alignment drops them
+    series = []
+    for seed in range(CORRELATION_TICKERS):
+        columns = price_columns(size, seed=seed)
+        keep = np.random.RandomState(seed).rand(size) > 0.001
+        series.append((columns.date[keep], columns.close[keep]))
+    return Case(lambda: return_matrices(align_closes(series)[1]), CORRELATION_TICKERS)
+
+
+def _load_series(size):
+    """One synthetic ticker with size bars in the database
+    :return: name of the ticker and the bars
+    """
+    cleanup()
+    trick_name = ticker_name(0)
+    bars = price_bars(size)
+    for index in range(0, len(bars), PRICES_PAGE):
+        prices_loading(trick_name, bars[index:index + PRICES_PAGE])
+    return trick_name, bars
+
+
+@case('delta.get_delta', database=True)
+def delta_get_delta(size):
+    trick_name, _ = _load_series(size)
+    return Case(lambda: PriceHistory.get_delta(trick_name, 'close', 10), size)
+
+
+def _prices_response(size, accept):
+    """Whole history of the ticker from the prices endpoint, body read by the client"""
+    trick_name, _ = _load_series(size)
+    client = app.test_client()
+    url = '/api/{}/'.format(trick_name)
+    return Case(lambda: client.get(url, headers={'Accept': accept}).data, size)
+
+
+@case('prices.json', database=True)
+def prices_json(size):
+    return _prices_response(size, 'application/json')
+
+
+@case('prices.msgpack', database=True)
+def prices_msgpack(size):
+    return _prices_response(size, 'application/x-msgpack')
+
+
+@case('analytics.get_analytics', database=True)
+def analytics_get_analytics(size):
+    trick_name, bars = _load_series(size)
+    rnd = random.Random(4)
+    periods = [sorted((rnd.choice(bars).date, rnd.choice(bars).date)) for _ in range(ANALYTICS_CALLS)]
+
+    def run():
+        for date_from, date_to in periods:
+            PriceHistory.get_analytics(trick_name, date_from, date_to)
+    return Case(run, len(periods))
+
+
+@case('analytics.get_analytics_batch', database=True)
+def analytics_get_analytics_batch(size):
+    trick_name, bars = _load_series(size)
+    rnd = random.Random(4)
+    periods = [tuple(sorted((rnd.choice(bars).date, rnd.choice(bars).date))) for _ in range(ANALYTICS_CALLS)]
+    return Case(lambda: PriceHistory.get_analytics_batch([trick_name], periods), len(periods))
+
+
+def measure(bench_case, repeat):
+    timings = []
+    for _ in range(repeat):
+        if bench_case.reset is not None:
+            bench_case.reset()
+        started = time.perf_counter()
+        bench_case.run()
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    return OrderedDict((
+        ('seconds', best),
+        ('median', statistics.median(timings)),
+        ('units', bench_case.units),
+        ('per_second', bench_case.units / best if best else None),
+    ))
+
+
+def run_cases(names, size, repeat):
+    results = OrderedDict()
+    database = any(CASES[name][1] for name in names)
+    if database:
+        created = not db.engine.has_table(Ticker.__tablename__)
+        db.create_all()
+    try:
+        for name in names:
+            prepare, _ = CASES[name]
+            results[name] = measure(prepare(size), repeat)
+            print('{:<26} {:9.4f}s  median {:9.4f}s  {:>12.0f} units/s'.format(
+                name, results[name]['seconds'], results[name]['median'], results[name]['per_second'] or 0
+            ))
+    finally:
+        if database:
+            cleanup()
+            if created:
+                db.drop_all()
+    return results
+
+
+def current_commit():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print the ratio of every case to the baseline
+    :return: names of the cases slower than the baseline by more than the threshold
+    """
+    regressed = []
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['seconds'] / base['seconds']
+        mark = ''
+        if ratio > 1 + threshold:
+            regressed.append(name)
+            mark = 'REGRESSED'
+        print('{:<26} {:9.4f}s -> {:9.4f}s  x{:5.2f} {}'.format(name, base['seconds'], result['seconds'], ratio, mark))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=20000, help='synthetic rows of every case')
+    parser.add_argument('--repeat', type=int, default=3, help='best of the repeats is compared')
+    parser.add_argument('--only', nargs='+', default=[], help='prefixes of the case names')
+    parser.add_argument('--no-db', action='store_true', help='skip the cases of the database')
+    parser.add_argument('--output', help='file of the JSON results')
+    parser.add_argument('--compare', help='JSON results of the baseline run')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    names = [
+        name for name, (_, database) in CASES.items()
+        if (not args.only or name.startswith(tuple(args.only))) and not (database and args.no_db)
+    ]
+    with app.app_context():
+        results = run_cases(names, args.size, args.repeat)
+
+    report = OrderedDict((
+        ('meta', OrderedDict((
+            ('commit', current_commit()),
+            ('created', datetime.now().isoformat()),
+            ('python', platform.python_version()),
+            ('size', args.size),
+            ('repeat', args.repeat),
+        ))),
+        ('results', results),
+    ))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressed = compare(results, baseline, args.threshold)
+        if regressed:
+            print('Slower than the baseline by more than {:.0%}: {}'.format(args.threshold, ', '.join(regressed)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""data version and unique transaction types
+
+Revision ID: 70bd87098536
+Revises: f9ee677a9cb4
+Create Date: 2026-10-18 09:41:12.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '70bd87098536'
+down_revision = 'f9ee677a9cb4'
+branch_labels = None
+depends_on = None
+
+# the first id of every name of the transaction type
+KEPT_TRANSACTION_TYPES = '''
+    SELECT id, MIN(id) OVER (PARTITION BY name) AS kept_id
+    FROM transaction_type
+'''
+
+# trades of the same key once the types are merged, the last loaded one stays
+DUPLICATE_TRADES_DELETE = '''
+    DELETE FROM trade
+    WHERE id IN (
+        SELECT id FROM (
+            SELECT tr.id, ROW_NUMBER() OVER (
+                PARTITION BY tr.ticker_id, tr.insider_id, tt.kept_id, tr.last_date ORDER BY tr.id DESC
+            ) AS position
+            FROM trade AS tr
+            JOIN ({kept}) AS tt ON tt.id = tr.transaction_type_id
+        ) AS ranked
+        WHERE position > 1
+    )
+'''.format(kept=KEPT_TRANSACTION_TYPES)
+
+TRADES_TRANSACTION_TYPE_UPDATE = '''
+    UPDATE trade AS tr SET transaction_type_id = tt.kept_id
+    FROM ({kept}) AS tt
+    WHERE tt.id = tr.transaction_type_id AND tt.kept_id <> tt.id
+'''.format(kept=KEPT_TRANSACTION_TYPES)
+
+DUPLICATE_TRANSACTION_TYPES_DELETE = '''
+    DELETE FROM transaction_type
+    WHERE id NOT IN (SELECT MIN(id) FROM transaction_type GROUP BY name)
+'''
+
+
+def upgrade():
+    op.add_column('ticker', sa.Column('data_version', sa.Integer(), server_default='0', nullable=False))
+
+    # the scraper created the transaction type of every page, the names must be unique for ON CONFLICT (name)
+    op.execute(DUPLICATE_TRADES_DELETE)
+    op.execute(TRADES_TRANSACTION_TYPE_UPDATE)
+    op.execute(DUPLICATE_TRANSACTION_TYPES_DELETE)
+    op.create_unique_constraint('transaction_type_name_key', 'transaction_type', ['name'])
+
+
+def downgrade():
+    # the merged transaction types stay merged
+    op.drop_constraint('transaction_type_name_key', 'transaction_type', type_='unique')
+    op.drop_column('ticker', 'data_version')
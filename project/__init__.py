@@ -27,6 +27,9 @@ migrate = Migrate(app, db)
 
 from project.api.routes import mod_api  # noqa E402
 from project.site.routes import mod_site  # noqa E402
+from project.metrics import metrics  # noqa E402
+
+metrics.init_app(app)
 
 
 app.register_blueprint(mod_api, url_prefix='/api')
@@ -0,0 +1,278 @@
+# project/analytics.py
+# Computations over the price series of the ticker, loaded ordered by date
+
+from collections import namedtuple
+
+import numpy as np
+
+PRICE_TYPES = ('open', 'high', 'low', 'close')
+COLUMN_TYPES = (
+    ('date', 'datetime64[D]'),
+    ('open', 'float64'),
+    ('high', 'float64'),
+    ('low', 'float64'),
+    ('close', 'float64'),
+    ('volume', 'int64'),
+)
+STATS_COLUMNS = ('daily_return', 'sma', 'ema', 'volatility')
+# trading days after the trade of the forward returns
+FORWARD_HORIZONS = (5, 20, 60)
+
+DeltaRow = namedtuple('DeltaRow', ('date', 'open', 'high', 'low', 'close', 'volume', 'g_num', 'diff'))
+DeltaColumns = namedtuple('DeltaColumns', DeltaRow._fields)
+AnalyticsRow = namedtuple('AnalyticsRow', ('open', 'close', 'low', 'high'))
+ReturnsRow = namedtuple(
+    'ReturnsRow', ('group', 'horizon', 'trades_count', 'returns_count', 'mean_return', 'positive_share')
+)
+
+
+class PriceColumns(namedtuple('PriceColumns', [name for name, _ in COLUMN_TYPES])):
+    """Price series of the ticker as the arrays ordered by date
+
+    """
+    @classmethod
+    def from_rows(cls, rows):
+        values = list(zip(*rows)) or [()] * len(cls._fields)
+        return cls(*(
+            np.array(column, dtype=dtype) for column, (_, dtype) in zip(values, COLUMN_TYPES)
+        ))
+
+    def __len__(self):
+        return len(self.date)
+
+    def index_of(self, day):
+        """Position of the date in the series or None"""
+        day = np.datetime64(day, 'D')
+        index = int(np.searchsorted(self.date, day))
+        if index < len(self.date) and self.date[index] == day:
+            return index
+        return None
+
+
+def _nearest(stack, prices, exceeds):
+    """Nearest index on the monotonic stack for which exceeds(price) is true
+    Prices on the stack are monotonic, the predicate holds for the bottom part only.
+    """
+    low, high = 0, len(stack)
+    while low < high:
+        middle = (low + high) // 2
+        if exceeds(prices[stack[middle]]):
+            low = middle + 1
+        else:
+            high = middle
+    return stack[low - 1] if low else None
+
+
+def delta_ends(prices, value):
+    """For every begin index the first later index with |price_begin - price_end| > value
+    One pass from the end with the monotonic stacks of the next greater and next lower prices,
+    O(n log n) against the pairwise self-join.
+    :param prices: 1-d sequence ordered by date
+    :return: array of the end indexes, -1 when the difference is never exceeded
+    """
+    ends = np.full(len(prices), -1, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64).tolist()
+    greater, lower = [], []
+    for index in range(len(prices) - 1, -1, -1):
+        price = prices[index]
+        up = _nearest(greater, prices, lambda end_price: end_price - price > value)
+        down = _nearest(lower, prices, lambda end_price: price - end_price > value)
+        found = [end for end in (up, down) if end is not None]
+        if found:
+            ends[index] = min(found)
+
+        while greater and prices[greater[-1]] <= price:
+            greater.pop()
+        greater.append(index)
+        while lower and prices[lower[-1]] >= price:
+            lower.pop()
+        lower.append(index)
+    return ends
+
+
+def delta_periods(prices, value):
+    """Minimal periods where the price moved more than value
+    Every end date is paired with the latest begin date reaching it first.
+    :return: list of (begin index, end index) ordered by begin
+    """
+    begins = {}
+    for begin, end in enumerate(delta_ends(prices, value)):
+        if end >= 0:
+            begins[end] = begin
+    return sorted((begin, end) for end, begin in begins.items())
+
+
+def delta_columns(columns, type_price, value):
+    """Prices of the ticker within every minimal period as the columns, numbered by the period
+    :param columns: PriceColumns of the ticker
+    :param type_price: one of PRICE_TYPES
+    :return: DeltaColumns ordered by g_num and date
+    """
+    prices = getattr(columns, type_price)
+    periods = np.array(delta_periods(prices, value), dtype=np.int64).reshape(-1, 2)
+    begins, ends = periods[:, 0], periods[:, 1]
+    lengths = ends - begins + 1
+    # positions of the days of all periods, the overlapping ones are repeated
+    starts = np.repeat(begins - np.cumsum(lengths) + lengths, lengths)
+    index = starts + np.arange(lengths.sum())
+    return DeltaColumns(*([column[index] for column in columns] + [
+        np.repeat(np.arange(1, len(periods) + 1), lengths),
+        np.repeat(np.abs(prices[begins] - prices[ends]).astype(np.float64), lengths),
+    ]))
+
+
+def delta_rows(columns, type_price, value):
+    """Prices of the ticker within every minimal period, numbered by the period
+    :param columns: PriceColumns of the ticker
+    :param type_price: one of PRICE_TYPES
+    :return: list of DeltaRow ordered by g_num and date
+    """
+    return [DeltaRow(*values) for values in zip(*(
+        column.tolist() for column in delta_columns(columns, type_price, value)
+    ))]
+
+
+def analytics_row(columns, date_from, date_to):
+    """Differences of the prices between two dates, the way PriceHistory.get_analytics computes them
+    (high is measured from the close of date_from)
+    :return: list with AnalyticsRow, empty when some of the dates is absent
+    """
+    begin, end = columns.index_of(date_from), columns.index_of(date_to)
+    if begin is None or end is None:
+        return []
+    return [AnalyticsRow(
+        float(abs(columns.open[begin] - columns.open[end])),
+        float(abs(columns.close[begin] - columns.close[end])),
+        float(abs(columns.low[begin] - columns.low[end])),
+        float(abs(columns.close[begin] - columns.high[end])),
+    )]
+
+
+def _rolling(values, window):
+    """Complete windows of the values as the 2-d view without copying, one row per window end"""
+    count = len(values) - window + 1
+    if count <= 0:
+        return np.empty((0, window))
+    stride = values.strides[0]
+    return np.lib.stride_tricks.as_strided(values, shape=(count, window), strides=(stride, stride), writeable=False)
+
+
+def rolling_stats(close, window, offset=0, ema_before=None):
+    """Daily return, SMA and EMA of the close and the volatility of the daily returns over the window
+    The closes before the offset are the context of the computed tail only. EMA is seeded by the SMA
+    of the first complete window, the closes start from the beginning of the series then.
+    :param close: 1-d sequence of the closes ordered by date
+    :param offset: index of the first computed close
+    :param ema_before: EMA of the close before the offset, continued instead of the seed
+    :return: tuple of arrays of STATS_COLUMNS from the offset, NaN where the window isn't complete
+    """
+    close = np.asarray(close, dtype=np.float64)
+    size = len(close)
+    daily_return = np.full(size, np.nan)
+    sma = np.full(size, np.nan)
+    ema = np.full(size, np.nan)
+    volatility = np.full(size, np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_return[1:] = close[1:] / close[:-1] - 1
+    sma[window - 1:] = _rolling(close, window).mean(axis=1)
+    volatility[window:] = _rolling(daily_return[1:], window).std(axis=1, ddof=1)
+
+    alpha = 2.0 / (window + 1)
+    start, previous = offset, ema_before
+    if previous is None:
+        start = window
+        if size >= window:
+            ema[window - 1] = previous = sma[window - 1]
+    values = close.tolist()
+    for index in range(start, size):
+        previous = alpha * values[index] + (1 - alpha) * previous
+        ema[index] = previous
+    return tuple(column[offset:] for column in (daily_return, sma, ema, volatility))
+
+
+def forward_returns(dates, close, trade_dates, horizons):
+    """Returns of the close after the trades, the as-of join of all trades by one binary search
+    The trade enters at the first close on or after its date and exits the horizon of trading days later.
+    :param dates: datetime64[D] array of the price series ordered by date
+    :param close: closes of the series
+    :param trade_dates: dates of the trades in any order
+    :param horizons: trading days after the entry
+    :return: 2-d array, row per trade and column per horizon, NaN where the series doesn't reach the exit
+    """
+    close = np.asarray(close, dtype=np.float64)
+    trade_dates = np.asarray(trade_dates, dtype='datetime64[D]')
+    if not len(close):
+        return np.full((len(trade_dates), len(horizons)), np.nan)
+    entry = np.searchsorted(dates, trade_dates, side='left')
+    exits = entry[:, np.newaxis] + np.asarray(horizons, dtype=np.int64)[np.newaxis, :]
+    reached = exits < len(close)
+    # clipped indexes keep the gather in bounds, the unreached returns are masked after it
+    last = len(close) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = close[np.minimum(exits, last)] / close[np.minimum(entry, last)][:, np.newaxis] - 1
+    returns[~reached | ~np.isfinite(returns)] = np.nan
+    return returns
+
+
+def group_returns(keys, returns, horizons):
+    """Count, mean and share of the positive forward returns of the trades per group
+    :param keys: group of every trade, like the insider name
+    :param returns: array from forward_returns
+    :return: list of ReturnsRow ordered by group and horizon, None for the mean and share without returns
+    """
+    if not len(keys):
+        return []
+    groups, inverse = np.unique(np.asarray(keys), return_inverse=True)
+    known = ~np.isnan(returns)
+    shape = (len(groups), len(horizons))
+    counts, sums, positive = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    np.add.at(counts, inverse, known)
+    np.add.at(sums, inverse, np.where(known, returns, 0.0))
+    np.add.at(positive, inverse, np.where(known, returns, 0.0) > 0)
+    trades = np.bincount(inverse, minlength=len(groups))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means, shares = sums / counts, positive / counts
+
+    return [
+        ReturnsRow(
+            group.item(), horizon, int(trades[index]), int(counts[index, column]),
+            float(means[index, column]) if counts[index, column] else None,
+            float(shares[index, column]) if counts[index, column] else None,
+        )
+        for index, group in enumerate(groups)
+        for column, horizon in enumerate(horizons)
+    ]
+
+
+def align_closes(series):
+    """Closes of the tickers on the dates all of them have, the inner join of the series
+    :param series: list of (dates, closes) of the tickers, datetime64[D] dates ordered
+    :return: aligned dates and 2-d array of the closes, row per date and column per ticker
+    """
+    if not series:
+        return np.array([], dtype='datetime64[D]'), np.empty((0, 0))
+    dates = np.asarray(series[0][0], dtype='datetime64[D]')
+    for ticker_dates, _ in series[1:]:
+        dates = np.intersect1d(dates, ticker_dates, assume_unique=True)
+    closes = np.empty((len(dates), len(series)))
+    for column, (ticker_dates, close) in enumerate(series):
+        closes[:, column] = np.asarray(close, dtype=np.float64)[np.searchsorted(ticker_dates, dates)]
+    return dates, closes
+
+
+def return_matrices(closes):
+    """Correlation and covariance of the daily returns of the aligned closes by one pass over the matrix
+    The correlation is scaled from the covariance, the same as np.corrcoef gives.
+    :param closes: array from align_closes
+    :return: correlation and covariance, tickers by tickers, NaN where less than two returns or no variance
+    """
+    size = closes.shape[1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = closes[1:] / closes[:-1] - 1
+        if len(returns) < 2:
+            return np.full((size, size), np.nan), np.full((size, size), np.nan)
+        covariance = np.atleast_2d(np.cov(returns, rowvar=False))
+        deviation = np.sqrt(np.diag(covariance))
+        correlation = np.clip(covariance / np.outer(deviation, deviation), -1, 1)
+    return correlation, covariance
@@ -2,41 +2,120 @@
 # This file need for storing sql queries, so as not to litter another space
 
 
-DELTA_SELECT = '''
-    WITH tab_diff AS (
-        SELECT
-        price_history_1.date as history_begin, price_history_2.date as history_end,
-        abs(price_history_1.{type_price} - price_history_2.{type_price}) as diff,
-        price_history_1.open as value,
-        price_history_2.open as value2,
-        ticker.id as ticker_id
-        FROM ticker JOIN price_history AS price_history_1 ON price_history_1.ticker_id = ticker.id
-        JOIN price_history AS price_history_2
-            ON price_history_2.ticker_id = ticker.id
-            AND price_history_2.date  > price_history_1.date
-        WHERE ticker.name = '{ticker_name}'
-    ),
-    end_group AS (
-        SELECT
-        tab_diff.history_begin,
-        MIN(tab_diff.history_end) OVER (PARTITION BY tab_diff.history_begin) as end_date
-        FROM tab_diff WHERE diff > {value_delta}
-    ),
-    begin_group AS (
-        SELECT
-        end_group.end_date,
-        MAX(end_group.history_begin) OVER (PARTITION BY end_group.end_date) as begin_date
-        FROM end_group
-    ),
-    period_groups AS (
-        SELECT
-        row_number() OVER () as g_num,
-        begin_date AS begin, end_date AS end
-        FROM begin_group GROUP BY end_date, begin_date
+PRICES_SERIES_SELECT = '''
+    SELECT ph.date, ph.open, ph.high, ph.low, ph.close, ph.volume
+    FROM price_history AS ph
+    JOIN ticker AS tk ON ph.ticker_id = tk.id
+    WHERE tk.name = :ticker_name
+    ORDER BY ph.date;
+'''
+
+PRICES_SERIES_SINCE_SELECT = '''
+    SELECT ph.date, ph.open, ph.high, ph.low, ph.close, ph.volume
+    FROM price_history AS ph
+    JOIN ticker AS tk ON ph.ticker_id = tk.id
+    WHERE tk.name = :ticker_name AND ph.date >= :since
+    ORDER BY ph.date;
+'''
+
+PRICES_DATES_SELECT = '''
+    SELECT tk.name, ph.date, ph.open, ph.high, ph.low, ph.close, ph.volume
+    FROM price_history AS ph
+    JOIN ticker AS tk ON ph.ticker_id = tk.id
+    WHERE tk.name IN :ticker_names AND ph.date IN :dates
+    ORDER BY tk.name, ph.date;
+'''
+
+PRICES_CLOSES_SELECT = '''
+    SELECT tk.name, ph.date, ph.close
+    FROM price_history AS ph
+    JOIN ticker AS tk ON ph.ticker_id = tk.id
+    WHERE tk.name IN :ticker_names AND ph.date BETWEEN :date_from AND :date_to
+    ORDER BY tk.name, ph.date;
+'''
+
+TICKER_VERSIONS_SELECT = '''
+    SELECT name, data_version FROM ticker;
+'''
+
+PRICES_EXPORT_SELECT = '''
+    SELECT tk.name AS ticker, ph.date, ph.open, ph.high, ph.low, ph.close, ph.volume
+    FROM price_history AS ph
+    JOIN ticker AS tk ON ph.ticker_id = tk.id
+    ORDER BY tk.name, ph.date
+'''
+
+TRADES_EXPORT_SELECT = '''
+    SELECT tk.name AS ticker, ins.code AS insider_code, ins.name AS insider, tt.name AS transaction_type,
+        tr.last_date, tr.last_price, tr.shares_traded, tr.shares_held
+    FROM trade AS tr
+    JOIN ticker AS tk ON tr.ticker_id = tk.id
+    JOIN insider AS ins ON tr.insider_id = ins.id
+    JOIN transaction_type AS tt ON tr.transaction_type_id = tt.id
+    ORDER BY tk.name, tr.last_date, ins.code, tt.name
+'''
+
+# staging tables of the import live until the commit, line keeps the order of the file for the last one to win
+PRICES_STAGING_CREATE = '''
+    CREATE TEMP TABLE import_prices (
+        line serial, ticker text, date date, open float8, high float8, low float8, close float8, volume bigint
+    ) ON COMMIT DROP;
+'''
+
+TRADES_STAGING_CREATE = '''
+    CREATE TEMP TABLE import_trades (
+        line serial, ticker text, insider_code integer, insider text, transaction_type text,
+        last_date date, last_price float8, shares_traded float8, shares_held float8
+    ) ON COMMIT DROP;
+'''
+
+STAGING_TICKERS_INSERT = '''
+    INSERT INTO ticker (name) SELECT DISTINCT ticker FROM {staging} ON CONFLICT (name) DO NOTHING;
+'''
+
+STAGING_TICKERS_SELECT = '''
+    SELECT tk.id, tk.name FROM ticker AS tk WHERE tk.name IN (SELECT ticker FROM {staging}) ORDER BY tk.name;
+'''
+
+PRICES_MERGE = '''
+    WITH merged AS (
+        INSERT INTO price_history (ticker_id, date, open, high, low, close, volume)
+        SELECT DISTINCT ON (tk.id, s.date) tk.id, s.date, s.open, s.high, s.low, s.close, s.volume
+        FROM import_prices AS s
+        JOIN ticker AS tk ON tk.name = s.ticker
+        ORDER BY tk.id, s.date, s.line DESC
+        ON CONFLICT ON CONSTRAINT _ticker__date DO UPDATE SET
+            open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+            close = EXCLUDED.close, volume = EXCLUDED.volume
+        RETURNING xmax = 0 AS inserted
+    )
+    SELECT count(*) FILTER (WHERE inserted), count(*) FROM merged;
+'''
+
+TRADES_DIMENSIONS_INSERT = '''
+    INSERT INTO insider (code, name)
+    SELECT DISTINCT ON (insider_code) insider_code, insider FROM import_trades ORDER BY insider_code, line DESC
+    ON CONFLICT (code) DO NOTHING;
+    INSERT INTO transaction_type (name) SELECT DISTINCT transaction_type FROM import_trades
+    ON CONFLICT (name) DO NOTHING;
+'''
+
+TRADES_MERGE = '''
+    WITH merged AS (
+        INSERT INTO trade (
+            ticker_id, insider_id, transaction_type_id, last_date, last_price, shares_traded, shares_held
+        )
+        SELECT DISTINCT ON (tk.id, ins.id, tt.id, s.last_date)
+            tk.id, ins.id, tt.id, s.last_date, s.last_price, s.shares_traded, s.shares_held
+        FROM import_trades AS s
+        JOIN ticker AS tk ON tk.name = s.ticker
+        JOIN insider AS ins ON ins.code = s.insider_code
+        JOIN transaction_type AS tt ON tt.name = s.transaction_type
+        ORDER BY tk.id, ins.id, tt.id, s.last_date, s.line DESC
+        ON CONFLICT ON CONSTRAINT _insider__last_date DO UPDATE SET
+            last_price = EXCLUDED.last_price, shares_traded = EXCLUDED.shares_traded,
+            shares_held = EXCLUDED.shares_held
+        RETURNING xmax = 0 AS inserted
     )
-    SELECT * FROM price_history as ph
-    JOIN ticker AS tk ON ph.ticker_id = tk.id and tk.name = '{ticker_name}'
-    JOIN period_groups AS gp ON ph.date BETWEEN gp.begin and gp.end
-    JOIN tab_diff AS td ON td.history_begin = gp.begin AND td.history_end = gp.end AND  td.ticker_id = tk.id
-    ORDER BY g_num, date;
+    SELECT count(*) FILTER (WHERE inserted), count(*) FROM merged;
 '''
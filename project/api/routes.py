@@ -1,17 +1,39 @@
 # project/api/routes.py
 
-from flask import Blueprint, request
-from project.models import Ticker, PriceHistory, Insider, Trade
+from flask import Blueprint, jsonify, request, url_for
+from project import db
+from project.models import Ticker, PriceHistory, PriceStats, Insider, InsiderActivity, Trade, TransactionType
+from project.analytics import PriceColumns
 from project.api.serializers import (
     TickSchema,
     PricesTickSchema,
-    InsiderSchema,
-    InsiderTradeSchema,
     AnalyticsPriceSchema,
+    AnalyticsBatchSchema,
     DeltaPriceSchema,
     DeltaListSchema,
+    PricesPageSchema,
+    PriceStatsSchema,
+    InsiderActivitySchema,
+    ForwardReturnsSchema,
+    CorrelationSchema,
+    CORRELATION_TICKERS_MAX,
+    ACTIVITY_ROWS,
+    RETURNS_ROWS,
+    STATS_ROWS,
+    PRICE_ROWS,
+    TRADE_ROWS,
+)
+from project.api.exceptions import InvalidUsage
+from project.cache import cached_response, cached_tickers_response
+from project.utils import (
+    MSGPACK_MIMETYPE,
+    get_object_or_404,
+    stream_json,
+    url_builder,
+    json_matrix,
+    response_mimetype,
+    msgpack_columns,
 )
-from project.utils import get_object_or_404
 
 mod_api = Blueprint('api', __name__,)
 
@@ -25,23 +47,60 @@ def get_tickers():
 
 @mod_api.route('/<ticker_name>/insider/')
 def get_insiders(ticker_name):
-    insiders = Insider.query.join(Insider.trades, aliased=True).filter(Ticker.name == ticker_name)
-    insider_schema = InsiderSchema(many=True, context={'ticker_name': ticker_name})
-    return insider_schema.jsonify(insiders)
+    names = db.session.execute(Insider.get_by_ticker(ticker_name).with_entities(Insider.name).statement)
+    insider_url = url_builder('api.get_insider_trades', 'insider_name', ticker_name=ticker_name)
+    return jsonify([{'name': name, 'url': insider_url(name)} for name, in names])
 
 
 @mod_api.route('/<ticker_name>/insider/<insider_name>/')
 def get_insider_trades(ticker_name, insider_name):
-    trade_list = Trade.query.join(Trade.insider).join(Trade.ticker).filter(
-        Ticker.name == ticker_name,
-        Insider.name == insider_name
+    trade_list = Trade.get_insider_trades(ticker_name, insider_name).join(TransactionType).with_entities(
+        Trade.id,
+        Trade.insider_id,
+        Trade.last_date,
+        Trade.last_price,
+        Trade.shares_held,
+        Trade.shares_traded,
+        Trade.ticker_id,
+        TransactionType.name,
+    )
+    return jsonify(TRADE_ROWS.dump_many(db.session.execute(trade_list.statement)))
+
+
+@mod_api.route('/<ticker_name>/activity/')
+@cached_response
+def get_insider_activity(ticker_name):
+    activity_scheme = InsiderActivitySchema()
+    result = activity_scheme.load(request.args.to_dict())
+    if result.errors:
+        raise InvalidUsage('Wrong parameters of the activity', payload={'errors': result.errors})
+    activity_list = InsiderActivity.get_activity(ticker_name, **result.data).with_entities(
+        InsiderActivity.month,
+        Insider.name,
+        TransactionType.name,
+        InsiderActivity.trades_count,
+        InsiderActivity.net_shares,
+        InsiderActivity.vwap,
     )
+    return jsonify(ACTIVITY_ROWS.dump_many(db.session.execute(activity_list.statement)))
+
 
-    trade_schema = InsiderTradeSchema(many=True)
-    return trade_schema.jsonify(trade_list)
+@mod_api.route('/<ticker_name>/returns/')
+@cached_response
+def get_forward_returns(ticker_name):
+    returns_scheme = ForwardReturnsSchema()
+    result = returns_scheme.load(request.args.to_dict())
+    if result.errors:
+        raise InvalidUsage('Wrong parameters of the returns', payload={'errors': result.errors})
+    returns = Trade.get_forward_returns(ticker_name, **result.data)
+    return jsonify(dict(
+        (group, [dict(RETURNS_ROWS.dump(row[1:]), **{group: row.group}) for row in rows])
+        for group, rows in returns.items()
+    ))
 
 
 @mod_api.route('/<ticker_name>/analytics/')
+@cached_response
 def get_analytics_prices(ticker_name):
     params = request.args.to_dict()
     params.update({'ticker_name': ticker_name})
@@ -53,7 +112,52 @@ def get_analytics_prices(ticker_name):
     return prices_schema.jsonify(prices_list)
 
 
+@mod_api.route('/analytics/', methods=['POST'])
+def get_analytics_batch():
+    batch_scheme = AnalyticsBatchSchema()
+    result = batch_scheme.load(request.get_json(silent=True) or {})
+    if result.errors:
+        raise InvalidUsage('Wrong parameters of the analytics', payload={'errors': result.errors})
+    periods = [(period['date_from'], period['date_to']) for period in result.data['periods']]
+
+    analytics = PriceHistory.get_analytics_batch(result.data['tickers'], periods)
+    return jsonify(dict(
+        (ticker_name, dict(
+            ('{}:{}'.format(date_from.isoformat(), date_to.isoformat()), [row._asdict() for row in rows])
+            for (date_from, date_to), rows in ticker_analytics.items()
+        ))
+        for ticker_name, ticker_analytics in analytics.items()
+    ))
+
+
+@mod_api.route('/correlation/')
+@cached_tickers_response
+def get_correlation():
+    correlation_scheme = CorrelationSchema()
+    result = correlation_scheme.load(request.args.to_dict())
+    if result.errors:
+        raise InvalidUsage('Wrong parameters of the correlation', payload={'errors': result.errors})
+    tickers = result.data.get('tickers')
+    if tickers is None:
+        tickers = [name for name, in db.session.query(Ticker.name)]
+        if len(tickers) > CORRELATION_TICKERS_MAX:
+            raise InvalidUsage('Choose up to {} tickers of the correlation'.format(CORRELATION_TICKERS_MAX))
+
+    matrices = PriceHistory.get_correlation(tickers, result.data.get('date_from'), result.data.get('date_to'))
+    dates = matrices['dates']
+    return jsonify({
+        'tickers': matrices['tickers'],
+        'missing': matrices['missing'],
+        'dates_count': len(dates),
+        'date_from': str(dates[0]) if len(dates) else None,
+        'date_to': str(dates[-1]) if len(dates) else None,
+        'correlation': json_matrix(matrices['correlation']),
+        'covariance': json_matrix(matrices['covariance']),
+    })
+
+
 @mod_api.route('/<ticker_name>/delta/')
+@cached_response
 def get_delta_prices(ticker_name):
     get_object_or_404(Ticker, Ticker.name == ticker_name)
     params = request.args.to_dict()
@@ -61,13 +165,61 @@ def get_delta_prices(ticker_name):
     delta_scheme = DeltaPriceSchema()
     scheme_args = delta_scheme.load(params)
 
+    if response_mimetype() == MSGPACK_MIMETYPE:
+        columns = PriceHistory.get_delta_columns(**scheme_args.data)
+        return msgpack_columns(columns, names=DeltaListSchema.Meta.fields)
     prices_list = PriceHistory.get_delta(**scheme_args.data)
     prices_schema = DeltaListSchema(many=True)
     return prices_schema.jsonify(prices_list)
 
 
+@mod_api.route('/<ticker_name>/stats/')
+@cached_response
+def get_price_stats(ticker_name):
+    stats_scheme = PriceStatsSchema()
+    result = stats_scheme.load(request.args.to_dict())
+    if result.errors:
+        raise InvalidUsage('Wrong parameters of the stats', payload={'errors': result.errors})
+    stats_list = PriceStats.get_stats(ticker_name, **result.data).with_entities(
+        *(getattr(PriceStats, name) for name in STATS_ROWS.fields)
+    )
+    return jsonify(STATS_ROWS.dump_many(db.session.execute(stats_list.statement)))
+
+
 @mod_api.route('/<ticker_name>/')
 def get_tick_prices(ticker_name):
-    prices_list = PriceHistory.query.filter(PriceHistory.ticker.has(name=ticker_name))
-    prices_schema = PricesTickSchema(many=True)
-    return prices_schema.jsonify(prices_list)
+    page_scheme = PricesPageSchema()
+    result = page_scheme.load(request.args.to_dict())
+    if result.errors:
+        raise InvalidUsage('Wrong parameters of the page', payload={'errors': result.errors})
+    limit, after = result.data.get('limit'), result.data.get('after')
+    prices_list = PriceHistory.get_prices(ticker_name, after=after, limit=limit).with_entities(
+        *(getattr(PriceHistory, name) for name in PRICE_ROWS.fields)
+    ).statement
+
+    if response_mimetype() == MSGPACK_MIMETYPE:
+        # whole history goes from the column store when it is fresh
+        if after is None and limit is None:
+            columns = PriceHistory.get_series(ticker_name)
+        else:
+            columns = PriceColumns.from_rows(db.session.execute(prices_list).fetchall())
+        response, dates = msgpack_columns(columns, names=PRICE_ROWS.fields), columns.date
+    elif limit is None:
+        # whole history goes from the server-side cursor without holding it in memory
+        prices_list = db.session.execute(prices_list.execution_options(stream_results=True))
+        response, dates = stream_json(prices_list, PRICE_ROWS.encode), ()
+    else:
+        prices_list = db.session.execute(prices_list).fetchall()
+        response, dates = jsonify(PRICE_ROWS.dump_many(prices_list)), [row.date for row in prices_list]
+
+    response.vary.add('Accept')
+    if limit is not None and len(dates) == limit:
+        next_url = url_for(
+            'api.get_tick_prices',
+            ticker_name=ticker_name,
+            limit=limit,
+            after=str(dates[-1]),
+            _external=True
+        )
+        response.headers['Link'] = '<{}>; rel="next"'.format(next_url)
+    return response
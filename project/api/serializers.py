@@ -1,30 +1,69 @@
 import re
+import math
+from datetime import date
+from flask import json
 from project import ma
-from project.models import Ticker, PriceHistory, Insider, Trade
-from marshmallow import fields, Schema
-from marshmallow.compat import iteritems
-from flask_marshmallow.fields import URLFor
+from project.models import Ticker, PriceHistory, Trade
+from marshmallow import fields, Schema, validate, validates_schema, ValidationError
 
 
-_context_pattern = re.compile(r'^ctx\(\s*(\S*)\s*\)\s*')
+PRICES_PAGE_MAX = 5000
+ANALYTICS_BATCH_MAX = 100
+RETURNS_HORIZONS_MAX = 10
+# about ten years of the trading days
+RETURNS_HORIZON_MAX = 2520
+CORRELATION_TICKERS_MAX = 500
 
 
-def _key(val):
-    """Return value within ``( )`` if possible, else return ``None``."""
-    match = _context_pattern.match(val)
-    if match:
-        return match.groups()[0]
-    return None
+def _nullable(convert):
+    return lambda value: None if value is None else convert(value)
 
 
-class CustomURLFor(URLFor):
-    def _serialize(self, value, attr, obj):
+def _json_float(value):
+    value = float(value)
+    return float.__repr__(value) if math.isfinite(value) else json.dumps(value)
 
-        for name, value in iteritems(self.params):
-            attr_context = _key(str(value))
-            if attr_context:
-                self.params[name] = self.context.get(attr_context, '')
-        return super()._serialize(value, attr, obj)
+
+def _json_date(value):
+    return '"{}"'.format(value.isoformat())
+
+
+_row_types = {
+    'int': (int, str),
+    'float': (float, _json_float),
+    'date': (lambda value: value.isoformat(), _json_date),
+    'str': (str, json.dumps),
+}
+
+
+class RowSerializer:
+    """Rows of the Core select into the output of the model schema, without loading the ORM objects
+    The JSON text of the row goes by the template compiled once, keys are sorted like flask json.dumps does,
+    in the compact or the pretty printed layout of the item of the list given by jsonify.
+    :param fields: pairs of the output key and the type of the selected column, in order of the columns
+    """
+    def __init__(self, *fields):
+        self.fields = tuple(key for key, _ in fields)
+        self._converters = tuple(_nullable(_row_types[type_name][0]) for _, type_name in fields)
+
+        order = sorted(range(len(fields)), key=lambda index: fields[index][0])
+        keys = ['"{}"'.format(fields[index][0]) for index in order]
+        self._templates = {
+            False: '{' + ','.join(key + ':%s' for key in keys) + '}',
+            True: '{\n    ' + ', \n    '.join(key + ': %s' for key in keys) + '\n  }',
+        }
+        self._encoders = tuple((index, _row_types[fields[index][1]][1]) for index in order)
+
+    def dump(self, row):
+        return dict(zip(self.fields, (convert(value) for convert, value in zip(self._converters, row))))
+
+    def dump_many(self, rows):
+        return [self.dump(row) for row in rows]
+
+    def encode(self, row, pretty=False):
+        return self._templates[pretty] % tuple(
+            'null' if row[index] is None else encode(row[index]) for index, encode in self._encoders
+        )
 
 
 class TickSchema(ma.ModelSchema):
@@ -69,14 +108,6 @@ class DeltaListSchema(PricesTickSchema):
         fields = ('date', 'open', 'high', 'low', 'close', 'volume', 'g_num', 'total_diff')
 
 
-class InsiderSchema(ma.ModelSchema):
-    url = CustomURLFor('api.get_insider_trades', ticker_name='ctx(ticker_name)', insider_name='<name>', _external=True)
-
-    class Meta:
-        model = Insider
-        fields = ('name', 'url')
-
-
 class InsiderTradeSchema(ma.ModelSchema):
     transaction_type = fields.Function(lambda obj: obj.transaction_type.name)
 
@@ -85,14 +116,76 @@ class InsiderTradeSchema(ma.ModelSchema):
         # fields = ('date', 'open', 'high', 'open', 'low', 'close', 'volume')
 
 
+# fast read path of the prices and trades, same output as PricesTickSchema and InsiderTradeSchema
+PRICE_ROWS = RowSerializer(
+    ('date', 'date'), ('open', 'float'), ('high', 'float'), ('low', 'float'), ('close', 'float'), ('volume', 'int')
+)
+STATS_ROWS = RowSerializer(
+    ('date', 'date'),
+    ('window', 'int'),
+    ('daily_return', 'float'),
+    ('sma', 'float'),
+    ('ema', 'float'),
+    ('volatility', 'float'),
+)
+ACTIVITY_ROWS = RowSerializer(
+    ('month', 'date'),
+    ('insider', 'str'),
+    ('transaction_type', 'str'),
+    ('trades_count', 'int'),
+    ('net_shares', 'float'),
+    ('vwap', 'float'),
+)
+# forward returns of the group, the key of the group goes aside
+RETURNS_ROWS = RowSerializer(
+    ('horizon', 'int'),
+    ('trades_count', 'int'),
+    ('returns_count', 'int'),
+    ('mean_return', 'float'),
+    ('positive_share', 'float'),
+)
+TRADE_ROWS = RowSerializer(
+    ('id', 'int'),
+    ('insider', 'int'),
+    ('last_date', 'date'),
+    ('last_price', 'float'),
+    ('shares_held', 'float'),
+    ('shares_traded', 'float'),
+    ('ticker', 'int'),
+    ('transaction_type', 'str'),
+)
+
+
 class DateParsing(fields.Field):
-    """Field that deserializes to a date type into string.
+    """Field that deserializes the date of the nasdaq format mm/dd/yyyy into date type.
     """
+    default_error_messages = {'invalid': 'Not a valid date.'}
+
     def _deserialize(self, value, attr, data, **kwargs):
         date_pattern = re.compile(r'(\d{2}).(\d{2}).(\d{4})')
         match = date_pattern.match(value)
         if match:
-            return '-'.join(match.groups())
+            month, day, year = map(int, match.groups())
+            try:
+                return date(year, month, day)
+            except ValueError:
+                self.fail('invalid')
+
+
+class CommaSeparated(fields.Field):
+    """Field that deserializes the comma separated values of the query into the tuple.
+    """
+    default_error_messages = {'invalid': 'Not a valid comma separated list.'}
+
+    def __init__(self, convert=str, **kwargs):
+        super().__init__(**kwargs)
+        self.convert = convert
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        try:
+            return tuple(self.convert(item) for item in value.split(',') if item)
+        except (AttributeError, ValueError):
+            self.fail('invalid')
 
 
 class AnalyticsPriceSchema(ma.Schema):
@@ -101,6 +194,56 @@ class AnalyticsPriceSchema(ma.Schema):
     ticker_name = fields.Str()
 
 
+class AnalyticsPeriodSchema(ma.Schema):
+    date_from = DateParsing(required=True)
+    date_to = DateParsing(required=True)
+
+    @validates_schema
+    def validate_dates(self, data):
+        if data.get('date_from') is None or data.get('date_to') is None:
+            raise ValidationError('Dates of the period must be in the format mm/dd/yyyy.')
+
+
+class AnalyticsBatchSchema(ma.Schema):
+    tickers = fields.List(fields.Str(), required=True, validate=validate.Length(min=1, max=ANALYTICS_BATCH_MAX))
+    periods = fields.Nested(
+        AnalyticsPeriodSchema, many=True, required=True, validate=validate.Length(min=1, max=ANALYTICS_BATCH_MAX)
+    )
+
+
+class PriceStatsSchema(ma.Schema):
+    window = fields.Int(validate=validate.Range(min=1))
+    date_from = DateParsing()
+    date_to = DateParsing()
+
+
+class InsiderActivitySchema(ma.Schema):
+    date_from = DateParsing()
+    date_to = DateParsing()
+    insider = fields.Str(attribute='insider_name')
+
+
+class ForwardReturnsSchema(ma.Schema):
+    horizons = CommaSeparated(int, validate=[
+        validate.Length(min=1, max=RETURNS_HORIZONS_MAX),
+        lambda horizons: all(1 <= horizon <= RETURNS_HORIZON_MAX for horizon in horizons),
+    ])
+    date_from = DateParsing()
+    date_to = DateParsing()
+    insider = fields.Str(attribute='insider_name')
+
+
+class CorrelationSchema(ma.Schema):
+    tickers = CommaSeparated(validate=validate.Length(min=1, max=CORRELATION_TICKERS_MAX))
+    date_from = DateParsing()
+    date_to = DateParsing()
+
+
+class PricesPageSchema(ma.Schema):
+    limit = fields.Int(validate=validate.Range(min=1, max=PRICES_PAGE_MAX))
+    after = fields.Date()
+
+
 class DeltaPriceSchema(ma.Schema):
     ticker_name = fields.Str()
     value = fields.Int()
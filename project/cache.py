@@ -0,0 +1,99 @@
+# project/cache.py
+# Responses of the analytics endpoints, valid while the data version of the ticker is the same
+
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+from project.versions import ticker_versions
+from project.utils import response_mimetype
+
+CACHE_SIZE = 1024
+
+
+class ResponseCache:
+    """LRU of the response bodies keyed by endpoint, ticker, query args and the format of the response
+    Entries of the older data version of the ticker are not served.
+
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+            self.hits = self.misses = 0
+
+    def get(self, key, version):
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is None or cached[0] != version:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._responses.move_to_end(key)
+            return cached[1:]
+
+    def set(self, key, version, body, mimetype):
+        max_size = current_app.config.get('RESPONSE_CACHE_SIZE', CACHE_SIZE)
+        with self._lock:
+            self._responses[key] = (version, body, mimetype)
+            self._responses.move_to_end(key)
+            while len(self._responses) > max_size:
+                self._responses.popitem(last=False)
+
+
+response_cache = ResponseCache()
+
+
+def _respond(key, version, view):
+    """Response of the view from the cache, 304 for the client having the same version
+    The negotiated format is a part of the key, the response varies by Accept.
+    """
+    key = key + (response_mimetype(),)
+    etag = hashlib.sha1(repr((key, version)).encode()).hexdigest()
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        cached = response_cache.get(key, version)
+        if cached is None:
+            response = view()
+            if response.status_code == 200 and not response.is_streamed:
+                response_cache.set(key, version, response.get_data(), response.mimetype)
+        else:
+            body, mimetype = cached
+            response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    return response
+
+
+def cached_response(view):
+    """Cache the response of the ticker view and answer 304 to the clients having it
+    """
+    @wraps(view)
+    def wrapper(ticker_name, **kwargs):
+        args = tuple(sorted(request.args.items(multi=True)))
+        key = (request.endpoint, ticker_name, args)
+        return _respond(key, ticker_versions.get(ticker_name), lambda: view(ticker_name, **kwargs))
+    return wrapper
+
+
+def cached_tickers_response(view):
+    """Cache the response of the view of many tickers, valid while the versions of all of them are the same
+    The tickers argument holds the comma separated names in any order, all tickers without it.
+    """
+    @wraps(view)
+    def wrapper(**kwargs):
+        names = sorted(set(name for name in request.args.get('tickers', '').split(',') if name)) or None
+        args = tuple(sorted(item for item in request.args.items(multi=True) if item[0] != 'tickers'))
+        key = (request.endpoint, tuple(names or ()), args)
+        return _respond(key, ticker_versions.get_many(names), lambda: view(**kwargs))
+    return wrapper
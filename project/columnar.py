@@ -0,0 +1,172 @@
+# project/columnar.py
+# Optional store of the price series as memory-mapped column files, one directory per ticker
+
+import os
+import re
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import text
+
+from project import db
+from project.analytics import COLUMN_TYPES, PriceColumns
+from project.api.queries import PRICES_SERIES_SELECT, PRICES_SERIES_SINCE_SELECT
+from project.versions import ticker_versions
+
+META_FILE = 'meta.json'
+LOCK_FILE = 'lock'
+MAPS_SIZE = 1024
+_ticker_pattern = re.compile(r'^[\w.-]+$')
+
+
+class ColumnStore:
+    """Per-ticker files of date, OHLC and volume in the native dtype, read through np.memmap
+    Readers of several processes share the pages of the files. The store of the ticker is
+    used while its data version equals the version of the ticker, SQL is used otherwise.
+    Every refresh writes the new generation of the files, the meta file replaced atomically
+    switches the readers to it and the old one is removed; the maps opened before keep
+    the old data. Writers of the ticker are serialized by the lock file across the processes.
+
+    """
+    def __init__(self):
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return current_app.config.get('COLUMN_STORE_PATH')
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _ticker_path(self, ticker_name, *names):
+        if not _ticker_pattern.match(ticker_name):
+            raise ValueError('Wrong name of the ticker {!r}'.format(ticker_name))
+        return os.path.join(self.path, ticker_name, *names)
+
+    def _meta(self, ticker_name):
+        try:
+            with open(self._ticker_path(ticker_name, META_FILE)) as meta_file:
+                return json.load(meta_file)
+        except (IOError, ValueError):
+            return None
+
+    @contextmanager
+    def _writing(self, ticker_name):
+        """Exclusive lock of the ticker files, held until the meta file is replaced"""
+        os.makedirs(self._ticker_path(ticker_name), exist_ok=True)
+        with open(self._ticker_path(ticker_name, LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _column_file(self, name, generation):
+        return '{}.{}'.format(name, generation)
+
+    def _remove_stale(self, ticker_name, generation):
+        """Files of the other generations, the maps opened before keep the removed ones"""
+        keep = set(self._column_file(name, generation) for name, _ in COLUMN_TYPES) | {META_FILE, LOCK_FILE}
+        for file_name in os.listdir(self._ticker_path(ticker_name)):
+            if file_name not in keep:
+                os.remove(self._ticker_path(ticker_name, file_name))
+
+    def _write_meta(self, ticker_name, meta):
+        meta_path = self._ticker_path(ticker_name, META_FILE)
+        temp_path = '{}.{}.tmp'.format(meta_path, os.getpid())
+        with open(temp_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temp_path, meta_path)
+
+    def read(self, ticker_name, version=None):
+        """Zero-copy columns of the ticker, None when the store is disabled or stale
+        """
+        if not self.enabled:
+            return None
+        if version is None:
+            version = ticker_versions.get(ticker_name)
+        meta = self._meta(ticker_name)
+        if meta is None or meta['version'] != version or 'generation' not in meta:
+            return None
+
+        state = (meta['generation'], meta['length'])
+        with self._lock:
+            cached = self._maps.get(ticker_name)
+            if cached is not None and cached[0] == state:
+                self._maps.move_to_end(ticker_name)
+                return cached[1]
+        try:
+            columns = PriceColumns(*(
+                np.memmap(
+                    self._ticker_path(ticker_name, self._column_file(name, meta['generation'])),
+                    dtype=dtype, mode='r', shape=(meta['length'],)
+                )
+                if meta['length'] else np.array([], dtype=dtype)
+                for name, dtype in COLUMN_TYPES
+            ))
+        except (IOError, ValueError):
+            # the generation was replaced after the meta had been read
+            return None
+        max_size = current_app.config.get('COLUMN_STORE_MAPS', MAPS_SIZE)
+        with self._lock:
+            self._maps[ticker_name] = (state, columns)
+            self._maps.move_to_end(ticker_name)
+            while len(self._maps) > max_size:
+                self._maps.popitem(last=False)
+        return columns
+
+    def refresh(self, ticker_name, version, since=None):
+        """Write the new generation of the ticker files, the stored rows before the date are copied,
+        everything is read without the date or the fresh store
+        A writer of the version already stored or an older one leaves the store as it is.
+        :param version: data version of the ticker after the commit of the changes
+        :param since: first date changed by the commit
+        """
+        if not self.enabled:
+            return
+        with self._writing(ticker_name):
+            meta = self._meta(ticker_name)
+            if meta is not None and meta['version'] >= version:
+                return
+
+            stored = None
+            # incremental only on top of the store fresh before this commit
+            if meta is not None and since is not None and meta['version'] == version - 1:
+                stored = self.read(ticker_name, meta['version'])
+            if stored is not None:
+                cut = int(np.searchsorted(stored.date, np.datetime64(since, 'D')))
+                rows = db.session.execute(
+                    text(PRICES_SERIES_SINCE_SELECT), {'ticker_name': ticker_name, 'since': since}
+                ).fetchall()
+            else:
+                cut = 0
+                rows = db.session.execute(text(PRICES_SERIES_SELECT), {'ticker_name': ticker_name}).fetchall()
+
+            tail = PriceColumns.from_rows(rows)
+            for index, ((name, _), column) in enumerate(zip(COLUMN_TYPES, tail)):
+                with open(self._ticker_path(ticker_name, self._column_file(name, version)), 'wb') as column_file:
+                    if cut:
+                        column_file.write(stored[index][:cut].tobytes())
+                    column_file.write(column.tobytes())
+            self._write_meta(ticker_name, {'version': version, 'generation': version, 'length': cut + len(tail)})
+            self._remove_stale(ticker_name, version)
+
+    def advance(self, ticker_name, version):
+        """Keep the store fresh after the commit which didn't touch the prices
+        """
+        if not self.enabled or self._meta(ticker_name) is None:
+            return
+        with self._writing(ticker_name):
+            meta = self._meta(ticker_name)
+            if meta is not None and meta['version'] == version - 1:
+                self._write_meta(ticker_name, dict(meta, version=version))
+
+
+column_store = ColumnStore()
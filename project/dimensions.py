@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql
+
+from project import db
+from project.models import Ticker, Insider, TransactionType
+
+MAX_SIZE = 50000
+
+
+class DimensionCache:
+    """Bounded in-process map of the natural key to id for the small, almost static tables
+    Missed keys are inserted in one batch on the separate committed connection,
+    so ids stay valid when the transaction of the loader is rolled back.
+
+    """
+    def __init__(self, model, key, max_size=MAX_SIZE):
+        self.table = model.__table__
+        self.key = key
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self.hits = self.misses = 0
+
+    def warm(self):
+        """Load the whole table in one query, up to the size of the cache
+        """
+        key_column = self.table.c[self.key]
+        with db.engine.connect() as connection:
+            records = connection.execute(
+                select([key_column, self.table.c.id]).limit(self.max_size)
+            ).fetchall()
+        with self._lock:
+            for natural_key, row_id in records:
+                self._store(natural_key, row_id)
+
+    def get_id(self, natural_key, **columns):
+        return self.resolve({natural_key: columns})[natural_key]
+
+    def resolve(self, values):
+        """Ids for the natural keys, missing rows are created
+        :param values: dict of the natural key with other columns for the insert
+        :return: dict of the natural key with id
+        """
+        with self._lock:
+            ids, missed = {}, {}
+            for natural_key, columns in values.items():
+                row_id = self._ids.get(natural_key)
+                if row_id is None:
+                    missed[natural_key] = columns
+                else:
+                    self._ids.move_to_end(natural_key)
+                    ids[natural_key] = row_id
+            self.hits += len(ids)
+            self.misses += len(missed)
+
+            if missed:
+                for natural_key, row_id in self._insert_missed(missed).items():
+                    self._store(natural_key, row_id)
+                    ids[natural_key] = row_id
+        return ids
+
+    def _store(self, natural_key, row_id):
+        self._ids[natural_key] = row_id
+        self._ids.move_to_end(natural_key)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def _insert_missed(self, missed):
+        rows = [dict(columns, **{self.key: natural_key}) for natural_key, columns in missed.items()]
+        key_column = self.table.c[self.key]
+
+        if db.engine.dialect.name == 'postgresql':
+            # other loaders could insert the same keys, conflicts are skipped and picked up by the select
+            with db.engine.begin() as connection:
+                connection.execute(
+                    postgresql.insert(self.table).values(rows).on_conflict_do_nothing(index_elements=[self.key])
+                )
+        else:
+            for row in rows:
+                try:
+                    with db.engine.begin() as connection:
+                        connection.execute(self.table.insert(), row)
+                except IntegrityError:
+                    pass
+
+        with db.engine.connect() as connection:
+            records = connection.execute(
+                select([key_column, self.table.c.id]).where(key_column.in_(list(missed)))
+            )
+            return dict((natural_key, row_id) for natural_key, row_id in records)
+
+
+tickers = DimensionCache(Ticker, 'name')
+insiders = DimensionCache(Insider, 'code')
+transaction_types = DimensionCache(TransactionType, 'name')
+
+DIMENSIONS = OrderedDict((
+    ('ticker', tickers),
+    ('insider', insiders),
+    ('transaction type', transaction_types),
+))
+
+
+def warm():
+    for cache in DIMENSIONS.values():
+        cache.warm()
+
+
+def clear():
+    for cache in DIMENSIONS.values():
+        cache.clear()
+
+
+def report():
+    """Hit and miss counters of the caches, for the end of the scraping
+    """
+    for name, cache in DIMENSIONS.items():
+        print('Dimension cache {}: {} hits, {} misses, {} cached'.format(name, cache.hits, cache.misses, len(cache)))
@@ -0,0 +1,194 @@
+# project/metrics.py
+# Counters and histograms of the scraper stages and the API requests, exposed in the Prometheus text format
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Observations counted per bucket, the upper bounds are inclusive like Prometheus le
+
+    """
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class Metrics:
+    """Counters and histograms of the process by the metric name and the labels
+    SQL statements are counted from the cursor events of every engine, per request of the app too.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._local = threading.local()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the seconds of the block in the histogram"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def value(self, name, **labels):
+        """Value of the counter or count of the observations of the histogram
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key in self._histograms:
+                return self._histograms[key].count
+            return self._counters.get(key, 0)
+
+    def total(self, name):
+        """Sum of the counter over all labels"""
+        with self._lock:
+            return sum(value for (counter_name, _), value in self._counters.items() if counter_name == name)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def count_statement(self):
+        """One SQL round trip, called by the cursor event and by the raw DBAPI cursors"""
+        self.inc('db_statements_total')
+        statements = getattr(self._local, 'statements', None)
+        if statements is not None:
+            self._local.statements = statements + 1
+
+    def init_app(self, app):
+        """Count the SQL statements, time the requests of the app and serve /metrics
+        Rows of the streamed responses are sent after the request is measured.
+        """
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def _start_request(self):
+        self._local.started = time.perf_counter()
+        self._local.statements = 0
+
+    def _finish_request(self, response):
+        started = getattr(self._local, 'started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        self.observe(
+            'http_request_duration_seconds', time.perf_counter() - started,
+            endpoint=endpoint, method=request.method, status=response.status_code
+        )
+        self.observe(
+            'http_request_sql_statements', self._local.statements, buckets=STATEMENT_BUCKETS, endpoint=endpoint
+        )
+        self._local.started = self._local.statements = None
+        return response
+
+    def view(self):
+        return Response(self.render(), content_type=CONTENT_TYPE)
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (histogram.buckets, list(histogram.cumulative()), histogram.sum, histogram.count))
+                for key, histogram in self._histograms.items()
+            )
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} counter'.format(name))
+            lines.append('{}{} {}'.format(name, _format_labels(labels), _format_number(value)))
+        for (name, labels), (buckets, cumulative, total, count) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} histogram'.format(name))
+            for bound, bucket_count in zip(buckets + ('+Inf',), cumulative):
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(labels, le=str(bound)), bucket_count))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_number(total)))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def report(self, *prefixes):
+        """Print the metrics of the names with the prefixes, for the end of the command
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (histogram.count, histogram.sum)) for key, histogram in self._histograms.items())
+        for (name, labels), value in counters:
+            if name.startswith(prefixes):
+                print('{}{} {}'.format(name, _format_labels(labels), _format_number(value)))
+        for (name, labels), (count, total) in histograms:
+            if name.startswith(prefixes):
+                print('{}{}: {} observed, {:.3f} total, {:.3f} mean'.format(
+                    name, _format_labels(labels), count, total, total / count if count else 0
+                ))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics.count_statement()
+
+
+metrics = Metrics()
@@ -1,25 +1,95 @@
-from project import db
-from project.api.queries import DELTA_SELECT
+import math
+from datetime import date, timedelta
+
+import numpy as np
+from flask import current_app
 
-from sqlalchemy import event, text, and_
+from project import db
+from project.api.queries import PRICES_SERIES_SELECT, PRICES_DATES_SELECT, PRICES_CLOSES_SELECT
+from project.api.exceptions import InvalidUsage
+from project.analytics import (
+    PRICE_TYPES,
+    STATS_COLUMNS,
+    FORWARD_HORIZONS,
+    PriceColumns,
+    delta_rows,
+    delta_columns,
+    analytics_row,
+    rolling_stats,
+    forward_returns,
+    group_returns,
+    align_closes,
+    return_matrices,
+)
+from project.columnar import column_store
+from project.utils import bulk_upsert
+
+from sqlalchemy import event, text, and_, or_, case, bindparam
 from sqlalchemy.orm import aliased
 from sqlalchemy.sql import func, label
-from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.schema import UniqueConstraint, Index
 from sqlalchemy.ext.hybrid import hybrid_property
 
 from babel import Locale
 from babel.numbers import parse_decimal
 
 LOCALE = Locale('en_US')
+# transaction types decreasing the shares of the insider
+SELLING_TYPES = ('sell', 'disposition')
+
+
+def parse_int(value):
+    return int(parse_decimal(value, locale=LOCALE))
+
+
+def parse_float(value):
+    if not len(value):
+        value = '0.0'
+    return float(parse_decimal(value, locale=LOCALE))
 
 
 class Ticker(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, unique=True, nullable=False)
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # newest trade loaded by the complete paging, the incremental scraping stops on it
+    trades_mark_date = db.Column(db.Date)
+    trades_mark_key = db.Column(db.String)
     prices = db.relationship('PriceHistory', backref='ticker', lazy=True)
     trades = db.relationship('Trade', backref='ticker', lazy=True)
 
+    @classmethod
+    def bump_version(cls, ticker_id):
+        """Invalidate cached responses of the ticker, goes with the commit of the loaded data
+        :return: new data version
+        """
+        db.session.execute(
+            cls.__table__.update().where(cls.id == ticker_id).values(data_version=cls.data_version + 1)
+        )
+        return db.session.query(cls.data_version).filter(cls.id == ticker_id).scalar()
+
+    @classmethod
+    def get_trades_mark(cls, ticker_name):
+        """Date and key of the newest loaded trade of the ticker, None before the first paging
+        """
+        mark = db.session.query(cls.trades_mark_date, cls.trades_mark_key).filter(cls.name == ticker_name).first()
+        if mark is None or mark.trades_mark_date is None:
+            return None
+        return mark.trades_mark_date, mark.trades_mark_key
+
+    @classmethod
+    def set_trades_mark(cls, ticker_name, mark_date, mark_key):
+        """Move the mark forward, an older one is ignored
+        """
+        db.session.execute(
+            cls.__table__.update().where(and_(
+                cls.name == ticker_name,
+                (cls.trades_mark_date == None) | (cls.trades_mark_date <= mark_date)  # noqa: E711
+            )).values(trades_mark_date=mark_date, trades_mark_key=mark_key)
+        )
+        db.session.commit()
+
     def __repr__(self):
         return '<name {}'.format(self.name)
 
@@ -57,8 +127,19 @@ class PriceHistory(db.Model):
         if commit:
             db.session.commit()
 
+    @classmethod
+    def bulk_upsert(cls, rows, returning=None):
+        """Write the page of prices in one statement, rows must contain parsed values
+        :param returning: names of the columns to return for the inserted and changed rows
+        """
+        return bulk_upsert(cls, rows, '_ticker__date', returning)
+
     @classmethod
     def get_analytics(cls, ticker_name, date_from, date_to):
+        columns = column_store.read(ticker_name)
+        if columns is not None:
+            return analytics_row(columns, date_from, date_to)
+
         PricesA = aliased(cls)
         PricesB = aliased(cls)
 
@@ -77,13 +158,113 @@ class PriceHistory(db.Model):
             PricesA.date == date_from,
             PricesB.date == date_to
         )
-        return result
+        return result.all()
+
+    @classmethod
+    def get_analytics_batch(cls, ticker_names, periods):
+        """Analytics of every ticker for every period, the same rows as get_analytics gives
+        Tickers without the fresh column store are read by one query of the requested dates only.
+        :param periods: list of (date_from, date_to)
+        :return: dict of the ticker name to the dict of the period to the list of AnalyticsRow
+        """
+        series = dict((ticker_name, column_store.read(ticker_name)) for ticker_name in ticker_names)
+        missing = [ticker_name for ticker_name, columns in series.items() if columns is None]
+        if missing:
+            dates = sorted(set(day for period in periods for day in period))
+            statement = text(PRICES_DATES_SELECT).bindparams(
+                bindparam('ticker_names', expanding=True),
+                bindparam('dates', expanding=True),
+            )
+            rows = dict((ticker_name, []) for ticker_name in missing)
+            for row in db.session.execute(statement, {'ticker_names': missing, 'dates': dates}):
+                rows[row[0]].append(row[1:])
+            series.update((ticker_name, PriceColumns.from_rows(rows[ticker_name])) for ticker_name in missing)
+
+        return dict(
+            (ticker_name, dict((period, analytics_row(columns, *period)) for period in periods))
+            for ticker_name, columns in series.items()
+        )
 
     @classmethod
-    def get_delta(cls, ticker_name, type_price, value):
-        sql = text(DELTA_SELECT.format(ticker_name=ticker_name, type_price=type_price, value_delta=value))
-        result = db.engine.execute(sql)
-        return result.fetchall()
+    def get_correlation(cls, ticker_names, date_from=None, date_to=None):
+        """Correlation and covariance of the daily returns of the tickers on the dates all of them have
+        Closes of the tickers without the fresh column store are read by one query of the range.
+        :param ticker_names: tickers of the matrices, sorted by name, the ones without prices in the range are left out
+        :return: dict with the tickers, the missing ones, the aligned dates and the matrices
+        """
+        ticker_names = sorted(set(ticker_names))
+        date_from, date_to = date_from or date.min, date_to or date.max
+        series = {}
+        missing = []
+        for ticker_name in ticker_names:
+            columns = column_store.read(ticker_name)
+            if columns is None:
+                missing.append(ticker_name)
+                continue
+            begin = int(np.searchsorted(columns.date, np.datetime64(date_from, 'D'), 'left'))
+            end = int(np.searchsorted(columns.date, np.datetime64(date_to, 'D'), 'right'))
+            series[ticker_name] = (columns.date[begin:end], columns.close[begin:end])
+        if missing:
+            statement = text(PRICES_CLOSES_SELECT).bindparams(bindparam('ticker_names', expanding=True))
+            rows = dict((ticker_name, []) for ticker_name in missing)
+            for ticker_name, day, close in db.session.execute(statement, {
+                'ticker_names': missing, 'date_from': date_from, 'date_to': date_to,
+            }):
+                rows[ticker_name].append((day, close))
+            for ticker_name, ticker_rows in rows.items():
+                days, closes = list(zip(*ticker_rows)) or ((), ())
+                series[ticker_name] = (np.array(days, dtype='datetime64[D]'), np.array(closes, dtype=np.float64))
+
+        tickers = [ticker_name for ticker_name in ticker_names if len(series[ticker_name][0])]
+        dates, closes = align_closes([series[ticker_name] for ticker_name in tickers])
+        correlation, covariance = return_matrices(closes)
+        return {
+            'tickers': tickers,
+            'missing': [ticker_name for ticker_name in ticker_names if ticker_name not in tickers],
+            'dates': dates,
+            'correlation': correlation,
+            'covariance': covariance,
+        }
+
+    @classmethod
+    def get_prices(cls, ticker_name, after=None, limit=None):
+        """Prices of the ticker ordered by date, keyset page after the date
+        """
+        query = cls.query.join(Ticker).filter(Ticker.name == ticker_name)
+        if after is not None:
+            query = query.filter(cls.date > after)
+        return query.order_by(cls.date).limit(limit)
+
+    @classmethod
+    def get_series(cls, ticker_name):
+        """PriceColumns of the ticker, from the column store when it is fresh
+        """
+        columns = column_store.read(ticker_name)
+        if columns is None:
+            rows = db.session.execute(text(PRICES_SERIES_SELECT), {'ticker_name': ticker_name}).fetchall()
+            columns = PriceColumns.from_rows(rows)
+        return columns
+
+    @staticmethod
+    def _check_delta(type_price, value):
+        if type_price not in PRICE_TYPES:
+            raise InvalidUsage('Type of the price must be one of: {}'.format(', '.join(PRICE_TYPES)))
+        if value is None:
+            raise InvalidUsage('Value of the delta is required')
+
+    @classmethod
+    def get_delta(cls, ticker_name, type_price=None, value=None):
+        """Minimal periods where the difference of the price type exceeds the value
+        """
+        cls._check_delta(type_price, value)
+        return delta_rows(cls.get_series(ticker_name), type_price, value)
+
+    @classmethod
+    def get_delta_columns(cls, ticker_name, type_price=None, value=None):
+        """Rows of get_delta as the DeltaColumns
+        """
+        cls._check_delta(type_price, value)
+        return delta_columns(cls.get_series(ticker_name), type_price, value)
 
     def __repr__(self):
         return '<{} = {}, {}'.format(self.ticker.name, self.volume, self.date)
@@ -92,17 +273,128 @@ class PriceHistory(db.Model):
 @event.listens_for(PriceHistory, 'before_insert')
 @event.listens_for(PriceHistory, 'before_update')
 def serialize_prices_before_puts(mapper, connection, target):
-    target.volume = int(
-        parse_decimal(target.volume, locale=LOCALE)
+    if isinstance(target.volume, str):
+        target.volume = parse_int(target.volume)
+
+
+def _finite(values):
+    return [value if math.isfinite(value) else None for value in values.tolist()]
+
+
+class PriceStats(db.Model):
+    """Daily return, SMA, EMA and volatility of the close over the windows of PRICE_STATS_WINDOWS
+    Derived from the prices, rewritten from the first changed date by every loading of the prices.
+    """
+
+    __table_args__ = (
+        UniqueConstraint('ticker_id', 'date', 'window', name='_ticker__date__window'),
     )
 
+    id = db.Column(db.Integer, primary_key=True)
+    ticker_id = db.Column(db.Integer, db.ForeignKey('ticker.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    window = db.Column(db.Integer, nullable=False)
+    daily_return = db.Column(db.Float)
+    sma = db.Column(db.Float)
+    ema = db.Column(db.Float)
+    volatility = db.Column(db.Float)
+
+    @classmethod
+    def refresh(cls, ticker_id, since=None):
+        """Recompute the stats of the ticker from the date, all of them without the date
+        The closes of the largest window before the date are the context of the tail,
+        EMA goes on from the stored row before the date. Goes with the commit of the prices.
+        :return: count of the written rows
+        """
+        windows = current_app.config['PRICE_STATS_WINDOWS']
+        if not windows:
+            return 0
+        context_size = max(windows)
+        prices = db.session.query(PriceHistory.date, PriceHistory.close).filter(PriceHistory.ticker_id == ticker_id)
+        if since is None:
+            db.session.query(cls).filter(cls.ticker_id == ticker_id).delete(synchronize_session=False)
+            context = []
+            tail = prices.order_by(PriceHistory.date).all()
+        else:
+            context = prices.filter(PriceHistory.date < since).order_by(PriceHistory.date.desc()).limit(
+                context_size
+            ).all()[::-1]
+            tail = prices.filter(PriceHistory.date >= since).order_by(PriceHistory.date).all()
+        if not tail:
+            return 0
+
+        emas = {}
+        if len(context) == context_size:
+            # the context may not reach the seed of EMA
+            emas = dict(db.session.query(cls.window, cls.ema).filter(
+                cls.ticker_id == ticker_id, cls.date == context[-1].date, cls.window.in_(windows)
+            ))
+            if any(emas.get(window) is None for window in windows):
+                return cls.refresh(ticker_id)
+
+        dates = [day for day, _ in tail]
+        close = np.array([close for _, close in context + tail], dtype=np.float64)
+        rows = []
+        for window in windows:
+            stats = rolling_stats(close, window, offset=len(context), ema_before=emas.get(window))
+            rows.extend(
+                dict(zip(STATS_COLUMNS, values), ticker_id=ticker_id, date=day, window=window)
+                for day, values in zip(dates, zip(*(_finite(column) for column in stats)))
+            )
+        return bulk_upsert(cls, rows, '_ticker__date__window')
+
+    @classmethod
+    def check(cls, ticker_id):
+        """Compare the stored stats of the ticker with the computation from scratch
+        :return: list of (window, date) of the rows differing, missing or stored for an unknown window
+        """
+        series = db.session.query(PriceHistory.date, PriceHistory.close).filter(
+            PriceHistory.ticker_id == ticker_id
+        ).order_by(PriceHistory.date).all()
+        close = np.array([close for _, close in series], dtype=np.float64)
+        stored = dict(
+            ((row.window, row.date), tuple(np.nan if value is None else value for value in row[2:]))
+            for row in db.session.query(cls.window, cls.date, *(getattr(cls, name) for name in STATS_COLUMNS)).filter(
+                cls.ticker_id == ticker_id
+            )
+        )
+
+        differ = []
+        for window in current_app.config['PRICE_STATS_WINDOWS']:
+            expected = np.column_stack(rolling_stats(close, window))
+            for (day, _), values in zip(series, expected):
+                stored_values = stored.pop((window, day), None)
+                if stored_values is None or not np.allclose(stored_values, values, rtol=1e-9, equal_nan=True):
+                    differ.append((window, day))
+        return differ + sorted(stored)
+
+    @classmethod
+    def get_stats(cls, ticker_name, window=None, date_from=None, date_to=None):
+        """Stats of the ticker ordered by window and date
+        """
+        query = cls.query.join(Ticker).filter(Ticker.name == ticker_name)
+        if window is not None:
+            query = query.filter(cls.window == window)
+        if date_from is not None:
+            query = query.filter(cls.date >= date_from)
+        if date_to is not None:
+            query = query.filter(cls.date <= date_to)
+        return query.order_by(cls.window, cls.date)
+
 
 class Insider(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.Integer, unique=True)
-    name = db.Column(db.String, nullable=False)
+    name = db.Column(db.String, nullable=False, index=True)
     trades = db.relationship('Trade', backref='insider', lazy=True)
 
+    @classmethod
+    def get_by_ticker(cls, ticker_name):
+        """Insiders having trades of the ticker, once per insider
+        """
+        ticker_insiders = db.session.query(Trade.insider_id).join(Ticker).filter(Ticker.name == ticker_name)
+        return cls.query.filter(cls.id.in_(ticker_insiders.subquery())).order_by(cls.name)
+
     @hybrid_property
     def url_name(self):
         return '-'.join([self.name.lower().replace(' ', '-'), str(self.code)])
@@ -113,7 +405,7 @@ class Insider(db.Model):
 
 class TransactionType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String, nullable=False)
+    name = db.Column(db.String, unique=True, nullable=False)
     trades = db.relationship('Trade', backref='transaction_type', lazy=True)
 
     def __repr__(self):
@@ -124,6 +416,10 @@ class Trade(db.Model):
 
     __table_args__ = (
         UniqueConstraint('ticker_id', 'insider_id', 'transaction_type_id', 'last_date', name='_insider__last_date'),
+        # trades of the insider within the ticker ordered by date
+        Index('ix_trade_ticker_insider_last_date', 'ticker_id', 'insider_id', 'last_date'),
+        # joins from the insider side, the constraints above lead with ticker_id
+        Index('ix_trade_insider_id', 'insider_id'),
     )
 
     id = db.Column(db.Integer, primary_key=True)
@@ -164,22 +460,269 @@ class Trade(db.Model):
         if commit:
             db.session.commit()
 
+    @classmethod
+    def bulk_upsert(cls, rows, returning=None):
+        """Write the page of trades in one statement, rows must contain parsed values
+        :param returning: names of the columns to return for the inserted and changed rows
+        """
+        return bulk_upsert(cls, rows, '_insider__last_date', returning)
+
+    @classmethod
+    def get_insider_trades(cls, ticker_name, insider_name):
+        """Trades of the insider within the ticker ordered by date
+        """
+        return cls.query.join(Ticker).join(Insider).filter(
+            Ticker.name == ticker_name,
+            Insider.name == insider_name
+        ).order_by(cls.last_date)
+
+    @classmethod
+    def get_forward_returns(cls, ticker_name, horizons=FORWARD_HORIZONS, date_from=None, date_to=None,
+                            insider_name=None):
+        """Returns of the close after the trades of the ticker aggregated per insider and per transaction type
+        Trades come by one query and meet the price series by the vectorized as-of join, see forward_returns.
+        :param horizons: trading days after the close on or after the date of the trade
+        :return: dict with the lists of ReturnsRow by 'insider' and by 'transaction_type'
+        """
+        trades = db.session.query(cls.last_date, Insider.name, TransactionType.name).join(Ticker).join(
+            Insider
+        ).join(TransactionType).filter(Ticker.name == ticker_name)
+        if date_from is not None:
+            trades = trades.filter(cls.last_date >= date_from)
+        if date_to is not None:
+            trades = trades.filter(cls.last_date <= date_to)
+        if insider_name is not None:
+            trades = trades.filter(Insider.name == insider_name)
+        trade_dates, insiders, transaction_types = list(zip(*trades.all())) or ((), (), ())
+
+        columns = PriceHistory.get_series(ticker_name)
+        returns = forward_returns(columns.date, columns.close, trade_dates, horizons)
+        return {
+            'insider': group_returns(insiders, returns, horizons),
+            'transaction_type': group_returns(transaction_types, returns, horizons),
+        }
+
     def __repr__(self):
         return '<{} = {}, {}'.format(self.insider.name, self.last_price, self.last_date)
 
 
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+class InsiderActivity(db.Model):
+    """Trades of the insider within the ticker aggregated by the transaction type and the month
+    Shares of the selling types count negative in net_shares, vwap is weighted by the traded shares.
+    Rewritten for the insiders and months of every loaded page of trades.
+    """
+
+    __table_args__ = (
+        UniqueConstraint(
+            'ticker_id', 'insider_id', 'transaction_type_id', 'month', name='_ticker__insider__type__month'
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    ticker_id = db.Column(db.Integer, db.ForeignKey('ticker.id'), nullable=False)
+    insider_id = db.Column(db.Integer, db.ForeignKey('insider.id'), nullable=False)
+    transaction_type_id = db.Column(db.Integer, db.ForeignKey('transaction_type.id'), nullable=False)
+    # first day of the month
+    month = db.Column(db.Date, nullable=False)
+    trades_count = db.Column(db.Integer, nullable=False)
+    net_shares = db.Column(db.Float, nullable=False)
+    vwap = db.Column(db.Float)
+
+    @staticmethod
+    def shares_sign(transaction_type):
+        name = transaction_type.lower()
+        return -1 if any(selling in name for selling in SELLING_TYPES) else 1
+
+    @classmethod
+    def refresh(cls, ticker_id, keys=None):
+        """Aggregate the trades of the ticker again for the insiders and months, everything without the keys
+        Goes with the commit of the trades.
+        :param keys: iterable of (insider id, first day of the month)
+        :return: count of the written rows
+        """
+        trades = db.session.query(
+            Trade.insider_id, Trade.transaction_type_id, TransactionType.name,
+            Trade.last_date, Trade.last_price, Trade.shares_traded,
+        ).join(TransactionType).filter(Trade.ticker_id == ticker_id)
+        stored = db.session.query(cls).filter(cls.ticker_id == ticker_id)
+        months = None
+        if keys is not None:
+            keys = set(keys)
+            if not keys:
+                return 0
+            insider_ids = set(insider_id for insider_id, _ in keys)
+            months = set(month for _, month in keys)
+            trades = trades.filter(
+                Trade.insider_id.in_(insider_ids),
+                Trade.last_date >= min(months),
+                Trade.last_date < _next_month(max(months)),
+            )
+            stored = stored.filter(cls.insider_id.in_(insider_ids), cls.month.in_(months))
+
+        groups = {}
+        for insider_id, transaction_type_id, transaction_type, last_date, last_price, shares_traded in trades:
+            month = last_date.replace(day=1)
+            if months is not None and month not in months:
+                continue
+            group = groups.setdefault((insider_id, transaction_type_id, month), [0, 0.0, 0.0, 0.0])
+            group[0] += 1
+            group[1] += cls.shares_sign(transaction_type) * shares_traded
+            group[2] += last_price * shares_traded
+            group[3] += shares_traded
+
+        stored.delete(synchronize_session=False)
+        rows = [
+            dict(
+                ticker_id=ticker_id,
+                insider_id=insider_id,
+                transaction_type_id=transaction_type_id,
+                month=month,
+                trades_count=trades_count,
+                net_shares=net_shares,
+                vwap=value / shares if shares else None,
+            )
+            for (insider_id, transaction_type_id, month), (trades_count, net_shares, value, shares) in groups.items()
+        ]
+        return bulk_upsert(cls, rows, '_ticker__insider__type__month')
+
+    @classmethod
+    def get_activity(cls, ticker_name, date_from=None, date_to=None, insider_name=None):
+        """Aggregates of the ticker for the months overlapping the dates, ordered by month, insider and type
+        """
+        query = cls.query.join(Ticker).join(Insider).join(TransactionType).filter(Ticker.name == ticker_name)
+        if date_from is not None:
+            query = query.filter(cls.month >= date_from.replace(day=1))
+        if date_to is not None:
+            query = query.filter(cls.month <= date_to)
+        if insider_name is not None:
+            query = query.filter(Insider.name == insider_name)
+        return query.order_by(cls.month, Insider.name, TransactionType.name)
+
+
 @event.listens_for(Trade, 'before_insert')
 @event.listens_for(Trade, 'before_update')
 def serialize_trade_before_puts(mapper, connection, target):
-    target.shares_traded = int(
-        parse_decimal(target.shares_traded, locale=LOCALE)
-    )
-    target.shares_held = int(
-        parse_decimal(target.shares_held, locale=LOCALE)
-    )
+    # values from the parsing stage of the scraper are already typed
+    if isinstance(target.shares_traded, str):
+        target.shares_traded = parse_int(target.shares_traded)
+    if isinstance(target.shares_held, str):
+        target.shares_held = parse_int(target.shares_held)
+    if isinstance(target.last_price, str):
+        target.last_price = parse_float(target.last_price)
+
+
+class ScrapeJob(db.Model):
+    """Ticker and kind of the pages to scrap, pulled by the workers
+    The claimed job is leased to the worker, the heartbeats extend the lease and the expired one
+    goes back to the queue, the crashed worker doesn't hold its jobs.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    # claims of the job before it fails for good
+    MAX_ATTEMPTS = 3
 
-    if not len(target.last_price):
-        target.last_price = '0.0'
-    target.last_price = float(
-        parse_decimal(target.last_price, locale=LOCALE)
+    __table_args__ = (
+        UniqueConstraint('ticker_name', 'kind', name='_ticker_name__kind'),
+        Index('ix_scrape_job_state_leased_until', 'state', 'leased_until'),
     )
+
+    id = db.Column(db.Integer, primary_key=True)
+    ticker_name = db.Column(db.String, nullable=False)
+    # value of TypeScrap, price or trade
+    kind = db.Column(db.String, nullable=False)
+    state = db.Column(db.String, nullable=False, default=QUEUED, server_default=QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    worker = db.Column(db.String)
+    leased_until = db.Column(db.DateTime(timezone=True))
+    finished_at = db.Column(db.DateTime(timezone=True))
+    error = db.Column(db.String)
+
+    @classmethod
+    def enqueue(cls, ticker_names, kinds):
+        """Queue the jobs of the tickers, the finished ones again, the running ones are left to their workers
+        :param kinds: values of TypeScrap, price or trade
+        :return: count of the queued jobs
+        """
+        keys = set((ticker_name.lower(), kind) for ticker_name in ticker_names for kind in kinds)
+        if not keys:
+            return 0
+        names = set(ticker_name for ticker_name, _ in keys)
+        existing = set(
+            db.session.query(cls.ticker_name, cls.kind).filter(cls.ticker_name.in_(names), cls.kind.in_(kinds))
+        )
+        queued = db.session.query(cls).filter(
+            cls.ticker_name.in_(names), cls.kind.in_(kinds), cls.state != cls.RUNNING
+        ).update(
+            dict(state=cls.QUEUED, attempts=0, worker=None, leased_until=None, finished_at=None, error=None),
+            synchronize_session=False
+        )
+        new_jobs = [dict(ticker_name=ticker_name, kind=kind) for ticker_name, kind in sorted(keys - existing)]
+        if new_jobs:
+            db.session.execute(cls.__table__.insert(), new_jobs)
+        db.session.commit()
+        return queued + len(new_jobs)
+
+    @classmethod
+    def claim(cls, worker, limit, lease):
+        """Lease the queued jobs and the ones of the expired leases to the worker, the rows locked
+        by the other workers are skipped
+        :param lease: seconds of the lease
+        :return: list of (id, ticker name, kind) of the claimed jobs
+        """
+        now = func.now()
+        db.session.query(cls).filter(
+            cls.state == cls.RUNNING, cls.leased_until < now, cls.attempts >= cls.MAX_ATTEMPTS
+        ).update(dict(state=cls.FAILED, worker=None, error='lease expired'), synchronize_session=False)
+        jobs = db.session.query(cls.id, cls.ticker_name, cls.kind).filter(or_(
+            cls.state == cls.QUEUED, and_(cls.state == cls.RUNNING, cls.leased_until < now)
+        )).order_by(cls.id).limit(limit).with_for_update(skip_locked=True).all()
+        if jobs:
+            db.session.query(cls).filter(cls.id.in_([job.id for job in jobs])).update(dict(
+                state=cls.RUNNING, worker=worker, attempts=cls.attempts + 1,
+                leased_until=now + timedelta(seconds=lease), error=None,
+            ), synchronize_session=False)
+        db.session.commit()
+        return [tuple(job) for job in jobs]
+
+    @classmethod
+    def heartbeat(cls, worker, job_ids, lease):
+        """Extend the leases of the running jobs of the worker
+        :return: count of the jobs still leased to the worker
+        """
+        extended = db.session.query(cls).filter(
+            cls.id.in_(job_ids), cls.worker == worker, cls.state == cls.RUNNING
+        ).update(dict(leased_until=func.now() + timedelta(seconds=lease)), synchronize_session=False)
+        db.session.commit()
+        return extended
+
+    @classmethod
+    def complete(cls, job_ids, worker, failed=False, error=None):
+        """Finish the jobs leased to the worker, the failed ones go back to the queue until the max of attempts
+        :return: count of the finished jobs, the ones of the lost leases are left alone
+        """
+        values = dict(worker=None, leased_until=None, finished_at=func.now(), error=error)
+        if failed:
+            values.update(
+                state=case([(cls.attempts >= cls.MAX_ATTEMPTS, cls.FAILED)], else_=cls.QUEUED),
+                error=error or 'pages failed',
+            )
+        else:
+            values.update(state=cls.DONE)
+        finished = db.session.query(cls).filter(
+            cls.id.in_(job_ids), cls.worker == worker, cls.state == cls.RUNNING
+        ).update(values, synchronize_session=False)
+        db.session.commit()
+        return finished
+
+    @classmethod
+    def pending(cls):
+        """Count of the queued and running jobs, the workers wait while some are running elsewhere
+        """
+        return db.session.query(func.count(cls.id)).filter(cls.state.in_((cls.QUEUED, cls.RUNNING))).scalar()
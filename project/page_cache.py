@@ -0,0 +1,107 @@
+# project/page_cache.py
+# Validators and content hashes of the scraped pages, unchanged pages are not parsed nor loaded again
+
+import os
+import re
+import json
+import hashlib
+
+_name_pattern = re.compile(r'^[\w.-]+$')
+
+NOT_MODIFIED = 'not modified'
+SAME_CONTENT = 'same content'
+CHANGED = 'changed'
+
+
+class PageCache:
+    """On-disk meta of the pages loaded by the scraper, one file per ticker and page
+    The meta is written only after the page was loaded, so the failed loading is retried
+    on the next run. Without the path nothing is stored and every page is loaded.
+    :param path: directory of the cache
+    :param force: load every page, the meta is rewritten
+    """
+    def __init__(self, path=None, force=False):
+        self.path = path
+        self.force = force
+        self.counters = dict((state, 0) for state in (NOT_MODIFIED, SAME_CONTENT, CHANGED))
+        self._pending = {}
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _page_path(self, ticker_name, page):
+        if not (_name_pattern.match(ticker_name) and _name_pattern.match(page)):
+            raise ValueError('Wrong key of the page {!r}, {!r}'.format(ticker_name, page))
+        return os.path.join(self.path, ticker_name, '{}.json'.format(page))
+
+    def lookup(self, ticker_name, page):
+        """Meta of the last loaded page, None when the page must be loaded
+        """
+        if not self.enabled or self.force:
+            return None
+        try:
+            with open(self._page_path(ticker_name, page)) as meta_file:
+                return json.load(meta_file)
+        except (IOError, ValueError):
+            return None
+
+    def request_headers(self, meta):
+        """Validators of the conditional GET"""
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def check(self, meta, status, headers, content):
+        """Compare the response with the meta of the loaded page
+        :return: state of the page and the new meta, None on NOT_MODIFIED
+        """
+        if meta is not None and status == 304:
+            self.counters[NOT_MODIFIED] += 1
+            return NOT_MODIFIED, None
+
+        content_hash = hashlib.sha1(content).hexdigest()
+        new_meta = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'hash': content_hash,
+        }
+        if meta is not None and meta.get('hash') == content_hash:
+            self.counters[SAME_CONTENT] += 1
+            return SAME_CONTENT, dict(meta, **new_meta)
+        self.counters[CHANGED] += 1
+        return CHANGED, new_meta
+
+    def stage(self, agent, ticker_name, page, meta):
+        """Keep the meta until the rows of the agent are loaded"""
+        if self.enabled:
+            self._pending[agent] = (ticker_name, page, meta)
+
+    def commit(self, agent):
+        """Store the meta of the page whose rows were loaded by the agent"""
+        pending = self._pending.pop(agent, None)
+        if pending is not None:
+            self.store(*pending)
+
+    def store(self, ticker_name, page, meta):
+        if not self.enabled:
+            return
+        page_path = self._page_path(ticker_name, page)
+        os.makedirs(os.path.dirname(page_path), exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(page_path, os.getpid())
+        with open(temp_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temp_path, page_path)
+
+    def report(self):
+        """Hit rate of the cache, for the end of the scraping
+        """
+        total = sum(self.counters.values())
+        unchanged = self.counters[NOT_MODIFIED] + self.counters[SAME_CONTENT]
+        print('Page cache: {} not modified, {} same content, {} changed, {:.0%} skipped'.format(
+            self.counters[NOT_MODIFIED], self.counters[SAME_CONTENT], self.counters[CHANGED],
+            unchanged / total if total else 0
+        ))
@@ -0,0 +1,85 @@
+# project/parsing.py
+# Parsing stage of the scraper: whole scraped tables of en_US strings into typed rows
+
+import re
+from datetime import date
+
+STR_DATE = '%m/%d/%Y'
+FORMAT_TIME = re.compile(r'^\d{2}:\d{2}')
+
+PRICE_COLUMNS = ('date', 'open', 'high', 'low', 'close', 'volume')
+TRADE_COLUMNS = (
+    'code', 'insider', 'last_date', 'transaction_type', 'last_price', 'shares_traded', 'shares_held'
+)
+
+
+def parse_int(value):
+    """'1,234,567' -> 1234567, fraction is dropped like int(parse_decimal(...))"""
+    value = value.replace(',', '')
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+
+def parse_float(value):
+    """'1,234.56' -> 1234.56, empty value is 0.0"""
+    value = value.replace(',', '').strip()
+    if not value:
+        return 0.0
+    return float(value)
+
+
+def parse_date(value, today=None):
+    """'10/12/2018' -> date(2018, 10, 12), time of the current session is today"""
+    if FORMAT_TIME.match(value):
+        return today or date.today()
+    month, day, year = value.split('/')
+    return date(int(year), int(month), int(day))
+
+
+def parse_prices(rows, today=None):
+    """Scraped rows of the historical prices table in one pass, empty rows are skipped
+    :param rows: iterable of [date, open, high, low, close, volume] strings
+    :return: list of tuples in order of PRICE_COLUMNS
+    """
+    today = today or date.today()
+    return [
+        (
+            parse_date(row[0], today),
+            parse_float(row[1]),
+            parse_float(row[2]),
+            parse_float(row[3]),
+            parse_float(row[4]),
+            parse_int(row[5]),
+        )
+        for row in rows if any(row)
+    ]
+
+
+def parse_trades(rows):
+    """Scraped rows of the insider trades table in one pass
+    :param rows: iterable of [code, insider, last price, relation, last date,
+        transaction type, owner type, shares traded, shares held] strings
+    :return: list of tuples in order of TRADE_COLUMNS
+    """
+    return [
+        (
+            int(row[0].split('-')[-1]),
+            row[1],
+            parse_date(row[4]),
+            row[5],
+            parse_float(row[2]),
+            parse_int(row[7]),
+            parse_int(row[8]),
+        )
+        for row in rows
+    ]
+
+
+def trade_mark(row):
+    """Date and the unique key 'code:type:date' of the scraped trade row, as the mark of the ticker is kept
+    :param row: scraped row, see parse_trades
+    """
+    last_date = parse_date(row[4])
+    return last_date, '{}:{}:{}'.format(int(row[0].split('-')[-1]), row[5], last_date.isoformat())
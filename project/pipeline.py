@@ -0,0 +1,124 @@
+# project/pipeline.py
+# Parsing and loading of the fetched pages as the stages connected by the bounded queues
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from project.metrics import metrics
+
+QUEUE_SIZE = 32
+BATCH_PAGES = 16
+_CLOSE = object()
+
+
+class Pipeline:
+    """Fetched pages go through the parse queue to the parse stage on the event loop and through
+    the load queue to the writer thread, which writes all pages waiting in the queue by one call.
+    The full queue holds the producer, so the fetching waits for the slow parsing or loading.
+    After the failure of a stage the rest of its queue is dropped and the next put raises the error.
+    :param parse: function of the ticker name and the page, returns the item of the writer or None
+    :param write: function of the list of the items, called in the writer thread within the app context
+    :param app: Flask app of the writer thread
+    :param queue_size: max of the items waiting in each queue
+    :param batch_pages: max of the items written by one call
+    """
+    def __init__(self, parse, write, app, queue_size=QUEUE_SIZE, batch_pages=BATCH_PAGES):
+        self.parse = parse
+        self.write = write
+        self.app = app
+        self.queue_size = max(1, queue_size)
+        self.batch_pages = max(1, batch_pages)
+        self.parse_queue = asyncio.Queue(self.queue_size)
+        self.load_queue = asyncio.Queue(self.queue_size)
+        self.writer = ThreadPoolExecutor(1)
+        self.error = None
+        self.batches = 0
+        self.stages = [asyncio.ensure_future(self._parse_stage()), asyncio.ensure_future(self._write_stage())]
+
+    async def _put(self, stage, queue, item):
+        await queue.put(item)
+        metrics.observe('scraper_queue_depth', queue.qsize(), buckets=tuple(range(self.queue_size + 1)), stage=stage)
+
+    async def put(self, ticker_name, page):
+        """Queue the fetched page for the parsing, waits while the queue is full
+        """
+        if self.error is not None:
+            raise self.error
+        await self._put('parse', self.parse_queue, (ticker_name, page))
+
+    async def finish(self, callback):
+        """Call the function in the writer thread after the pages queued before it are written
+        """
+        if self.error is not None:
+            raise self.error
+        await self._put('parse', self.parse_queue, callback)
+
+    async def call(self, function, *args):
+        """Call the function in the writer thread right away, not after the queued pages
+        :return: result of the function
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.writer, self._call, functools.partial(function, *args))
+
+    async def close(self):
+        """Wait for the queued pages and stop the writer thread
+        """
+        await self.parse_queue.put(_CLOSE)
+        try:
+            await asyncio.gather(*self.stages)
+        finally:
+            self.writer.shutdown()
+        if self.error is not None:
+            raise self.error
+
+    async def _parse_stage(self):
+        while True:
+            item = await self.parse_queue.get()
+            if item is _CLOSE or callable(item):
+                await self._put('load', self.load_queue, item)
+                if item is _CLOSE:
+                    return
+                continue
+            if self.error is not None:
+                continue
+            try:
+                parsed = self.parse(*item)
+            except Exception as error:
+                self.error = error
+                continue
+            if parsed is not None:
+                await self._put('load', self.load_queue, parsed)
+
+    async def _write_stage(self):
+        loop = asyncio.get_event_loop()
+        closing = False
+        while not closing:
+            items = [await self.load_queue.get()]
+            while len(items) < self.batch_pages and not self.load_queue.empty():
+                items.append(self.load_queue.get_nowait())
+            if items[-1] is _CLOSE:
+                items.pop()
+                closing = True
+            if items and self.error is None:
+                try:
+                    await loop.run_in_executor(self.writer, self._write, items)
+                except Exception as error:
+                    self.error = error
+
+    def _call(self, function):
+        with self.app.app_context():
+            return function()
+
+    def _write(self, items):
+        """Pages of the batch by one call of write, then the callbacks queued between them
+        """
+        pages = [item for item in items if not callable(item)]
+        with self.app.app_context():
+            if pages:
+                metrics.observe('scraper_write_batch_pages', len(pages), buckets=tuple(range(1, self.batch_pages + 1)))
+                self.batches += 1
+                self.write(pages)
+            for callback in items:
+                if callable(callback):
+                    callback()
@@ -0,0 +1,227 @@
+# project/scheduler.py
+# Pages of many tickers interleaved under the adaptive concurrency and the rate limit of the host
+
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from collections import Counter
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from project.metrics import metrics
+
+RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+# latency above the tolerance of the base one means the host is saturated
+LATENCY_TOLERANCE = 3.0
+# base latency drifts up to the observed one by the factor per request, an old fast sample doesn't throttle forever
+BASE_LATENCY_DRIFT = 1.05
+DECREASE_COOLDOWN = 1.0
+RETRY_ERRORS = (asyncio.TimeoutError, aiohttp.ServerDisconnectedError)
+
+
+class FetchError(Exception):
+    """Server error on every attempt of the request"""
+
+
+class TokenBucket:
+    """Requests per second with the burst, waits for the token instead of failing
+    :param rate: tokens added per second, None for no limit
+    :param burst: max of the tokens saved up
+    """
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Scheduler:
+    """Priority queue of the scrapers, the one with the fewest pages issued goes next
+    Concurrency grows by one per window of the successful requests and halves on the errors
+    and the latency over the tolerance (AIMD), between 1 and max_concurrency.
+    :param rate: requests per second to one host, None for no limit
+    :param burst: requests of the host going without waiting
+    :param retries: attempts after the first one on 5xx and timeouts
+    :param backoff: base seconds of the jittered exponential backoff
+    """
+    def __init__(self, max_concurrency=10, rate=None, burst=1, retries=RETRIES, backoff=BACKOFF_BASE):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(max(1, self.max_concurrency // 2))
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.buckets = {}
+        self.base_latency = None
+        self.decreased = 0.0
+        self.pages = 0
+        self.failed = 0
+        self.retried = 0
+        self.started = None
+        self.finished = None
+
+    @property
+    def concurrency(self):
+        return int(self.limit)
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host]
+
+    def delay(self, attempt):
+        """Full jitter backoff before the retry"""
+        return random.uniform(0, min(BACKOFF_CAP, self.backoff * 2 ** attempt))
+
+    def succeeded(self, latency):
+        if self.base_latency is None:
+            self.base_latency = latency
+        self.base_latency = min(latency, self.base_latency * BASE_LATENCY_DRIFT)
+        if latency > self.base_latency * LATENCY_TOLERANCE:
+            self.decrease()
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def decrease(self):
+        now = time.monotonic()
+        if now - self.decreased >= DECREASE_COOLDOWN:
+            self.decreased = now
+            self.limit = max(1.0, self.limit / 2)
+
+    async def request(self, session, method, url, **kwargs):
+        """Request through the rate limit of the host, 5xx and timeouts are retried with the backoff
+        :return: status, headers and body of the response
+        """
+        bucket = self.bucket(url)
+        for attempt in range(self.retries + 1):
+            await bucket.acquire()
+            started = time.monotonic()
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    content = await response.read()
+            except RETRY_ERRORS as error:
+                failure = error
+            else:
+                if response.status < 500:
+                    self.succeeded(time.monotonic() - started)
+                    return response.status, response.headers, content
+                failure = FetchError('{} {} answered {}'.format(method, url, response.status))
+
+            self.decrease()
+            if attempt == self.retries:
+                raise failure
+            self.retried += 1
+            metrics.inc('scraper_retries_total')
+            await asyncio.sleep(self.delay(attempt))
+
+    async def run(self, names, start, load, finish, max_tickers=None):
+        """Scrap the tickers with their pages interleaved
+        The scraper goes back to the queue after every issued page unless its next page depends
+        on the ones in flight. After the failed page the ticker gets no more pages.
+        :param names: ticker names in order of the start
+        :param start: function of the ticker name returning its TradingScraper
+        :param load: coroutine function of the dict of the finished tasks to the ticker names,
+            waiting holds the next pages
+        :param finish: coroutine function of the scraper with all pages loaded and whether some of them failed
+        :param max_tickers: tickers scraped at once, max_concurrency by default
+        """
+        names = list(names)
+        max_tickers = max_tickers or self.max_concurrency
+        order = itertools.count()
+        ready, queued, active, failed = [], set(), set(), set()
+        issued, in_flight_pages = Counter(), Counter()
+        in_flight = {}
+
+        def push(scraper):
+            queued.add(scraper)
+            heapq.heappush(ready, (issued[scraper], next(order), scraper))
+
+        def open_tickers():
+            while names and len(active) < max_tickers:
+                scraper = start(names.pop(0))
+                active.add(scraper)
+                push(scraper)
+
+        async def close(scraper):
+            active.discard(scraper)
+            await finish(scraper, scraper in failed)
+            open_tickers()
+
+        self.started = time.monotonic()
+        open_tickers()
+        try:
+            while ready or in_flight:
+                while ready and len(in_flight) < self.concurrency:
+                    _, _, scraper = heapq.heappop(ready)
+                    queued.discard(scraper)
+                    job = None if scraper in failed else scraper.next_job()
+                    if job is None or scraper.finished:
+                        if job is not None:
+                            job.close()
+                        if not in_flight_pages[scraper]:
+                            await close(scraper)
+                        continue
+                    issued[scraper] += 1
+                    in_flight_pages[scraper] += 1
+                    in_flight[asyncio.ensure_future(job)] = scraper
+                    if not scraper.paging_blocked:
+                        push(scraper)
+                if not in_flight:
+                    continue
+                metrics.observe('scraper_pages_in_flight', len(in_flight), buckets=tuple(range(1, 33)))
+
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                loaded, touched = {}, set()
+                for task in done:
+                    scraper = in_flight.pop(task)
+                    in_flight_pages[scraper] -= 1
+                    touched.add(scraper)
+                    if task.exception() is not None:
+                        print('Page of {} failed: {!r}'.format(scraper.trick_name, task.exception()))
+                        metrics.inc('scraper_pages_failed_total')
+                        self.failed += 1
+                        failed.add(scraper)
+                    else:
+                        self.pages += 1
+                        loaded[task] = scraper.trick_name
+                await load(loaded)
+
+                for scraper in touched:
+                    if scraper in queued:
+                        continue
+                    if scraper not in failed and not scraper.finished and not scraper.paging_blocked:
+                        push(scraper)
+                    elif not in_flight_pages[scraper]:
+                        await close(scraper)
+        finally:
+            # the cancelled run leaves no pages behind
+            for task in in_flight:
+                task.cancel()
+        self.finished = time.monotonic()
+
+    def report(self):
+        """Throughput of the run, for the end of the scraping
+        """
+        seconds = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        print('Scheduler: {} pages in {:.1f} s, {:.1f} pages/sec, {} retries, {} failed, concurrency {} of {}'.format(
+            self.pages, seconds, self.pages / seconds if seconds else 0, self.retried, self.failed,
+            self.concurrency, self.max_concurrency
+        ))
@@ -0,0 +1,175 @@
+# project/transfer.py
+# CSV import and export of the price and trade history, COPY through the staging table on postgres
+
+import csv
+import itertools
+from datetime import datetime
+
+from sqlalchemy import text
+
+from project import db, dimensions
+from project.api.queries import (
+    PRICES_EXPORT_SELECT,
+    TRADES_EXPORT_SELECT,
+    PRICES_STAGING_CREATE,
+    TRADES_STAGING_CREATE,
+    STAGING_TICKERS_INSERT,
+    STAGING_TICKERS_SELECT,
+    PRICES_MERGE,
+    TRADES_DIMENSIONS_INSERT,
+    TRADES_MERGE,
+)
+from project.columnar import column_store
+from project.metrics import metrics
+from project.models import Ticker, PriceHistory, PriceStats, Trade, InsiderActivity
+
+BATCH_SIZE = 5000
+KINDS = ('prices', 'trades')
+CSV_COLUMNS = {
+    'prices': ('ticker', 'date', 'open', 'high', 'low', 'close', 'volume'),
+    'trades': (
+        'ticker', 'insider_code', 'insider', 'transaction_type', 'last_date', 'last_price', 'shares_traded',
+        'shares_held',
+    ),
+}
+_exports = {'prices': PRICES_EXPORT_SELECT, 'trades': TRADES_EXPORT_SELECT}
+_staging = {
+    'prices': ('import_prices', PRICES_STAGING_CREATE, PRICES_MERGE, PriceHistory),
+    'trades': ('import_trades', TRADES_STAGING_CREATE, TRADES_MERGE, Trade),
+}
+
+
+def _use_copy(copy):
+    if copy is None:
+        return db.session.get_bind().dialect.name == 'postgresql'
+    return copy
+
+
+def _raw_cursor():
+    return db.session.connection().connection.cursor()
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _csv_value(value):
+    """Whole floats without the fraction, the same text as COPY writes"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def export_csv(kind, csv_file, copy=None):
+    """Write the history with the names of the ticker, insider and transaction type, header first
+    Rows go to the file as they are read, COPY TO STDOUT on postgres and the server-side cursor elsewhere.
+    :param kind: one of KINDS
+    :param copy: force COPY on or off, on postgres by default
+    :return: count of the written rows
+    """
+    select = _exports[kind].strip()
+    if _use_copy(copy):
+        with _raw_cursor() as cursor:
+            cursor.copy_expert('COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true)'.format(select), csv_file)
+            metrics.count_statement()
+            return cursor.rowcount
+
+    writer = csv.writer(csv_file, lineterminator='\n')
+    writer.writerow(CSV_COLUMNS[kind])
+    result = db.session.execute(text(select).execution_options(stream_results=True))
+    count = 0
+    for rows in iter(lambda: result.fetchmany(BATCH_SIZE), []):
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        count += len(rows)
+    return count
+
+
+def import_csv(kind, csv_file, copy=None):
+    """Merge the rows of the export into the history, the last one of the same key wins
+    Missing tickers, insiders and transaction types are created, derived tables of the tickers
+    are rebuilt and everything goes in one commit.
+    :param kind: one of KINDS
+    :param copy: force COPY on or off, on postgres by default
+    :return: count of the merged rows
+    """
+    header = tuple(next(csv.reader([csv_file.readline()]), ()))
+    if header != CSV_COLUMNS[kind]:
+        raise ValueError('Columns of the {} CSV must be: {}'.format(kind, ', '.join(CSV_COLUMNS[kind])))
+
+    if _use_copy(copy):
+        count, tickers = _copy_merge(kind, csv_file)
+    else:
+        count, tickers = _batches_upsert(kind, csv_file)
+
+    versions = []
+    for ticker_id, ticker_name in tickers:
+        if kind == 'prices':
+            PriceStats.refresh(ticker_id)
+        else:
+            InsiderActivity.refresh(ticker_id)
+        versions.append((ticker_name, Ticker.bump_version(ticker_id)))
+    db.session.commit()
+    for ticker_name, version in versions:
+        if kind == 'prices':
+            column_store.refresh(ticker_name, version)
+        else:
+            column_store.advance(ticker_name, version)
+    return count
+
+
+def _copy_merge(kind, csv_file):
+    """COPY the rest of the file into the staging table and merge it by one statement per table
+    :return: count of the merged rows and (id, name) of their tickers
+    """
+    staging, create, merge, model = _staging[kind]
+    db.session.execute(text(create))
+    with _raw_cursor() as cursor:
+        cursor.copy_expert(
+            'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(staging, ', '.join(CSV_COLUMNS[kind])), csv_file
+        )
+    metrics.count_statement()
+
+    db.session.execute(text(STAGING_TICKERS_INSERT.format(staging=staging)))
+    if kind == 'trades':
+        db.session.execute(text(TRADES_DIMENSIONS_INSERT))
+    inserted, count = db.session.execute(text(merge)).first()
+    metrics.inc('db_rows_inserted_total', inserted, table=model.__tablename__)
+    metrics.inc('db_rows_updated_total', count - inserted, table=model.__tablename__)
+    tickers = db.session.execute(text(STAGING_TICKERS_SELECT.format(staging=staging))).fetchall()
+    return count, [tuple(ticker) for ticker in tickers]
+
+
+def _batches_upsert(kind, csv_file):
+    """Upsert the rest of the file by batches with the ids from the dimension caches
+    :return: count of the merged rows and (id, name) of their tickers
+    """
+    reader = csv.reader(csv_file)
+    count, tickers = 0, {}
+    for batch in iter(lambda: list(itertools.islice(reader, BATCH_SIZE)), []):
+        ticker_ids = dimensions.tickers.resolve(dict((row[0], {}) for row in batch))
+        tickers.update((ticker_id, ticker_name) for ticker_name, ticker_id in ticker_ids.items())
+        if kind == 'prices':
+            count += PriceHistory.bulk_upsert([
+                dict(
+                    ticker_id=ticker_ids[ticker_name], date=_date(day), open=float(open_price),
+                    high=float(high), low=float(low), close=float(close), volume=int(volume),
+                )
+                for ticker_name, day, open_price, high, low, close, volume in batch
+            ])
+            continue
+
+        insider_ids = dimensions.insiders.resolve(dict((int(row[1]), {'name': row[2]}) for row in batch))
+        transaction_type_ids = dimensions.transaction_types.resolve(dict((row[3], {}) for row in batch))
+        count += Trade.bulk_upsert([
+            dict(
+                ticker_id=ticker_ids[ticker_name],
+                insider_id=insider_ids[int(code)],
+                transaction_type_id=transaction_type_ids[transaction_type],
+                last_date=_date(last_date),
+                last_price=float(last_price),
+                shares_traded=float(shares_traded),
+                shares_held=float(shares_held),
+            )
+            for ticker_name, code, _, transaction_type, last_date, last_price, shares_traded, shares_held in batch
+        ])
+    return count, sorted(tickers.items())
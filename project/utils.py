@@ -1,6 +1,18 @@
+import msgpack
+import numpy as np
+from flask import Response, current_app, request, stream_with_context, url_for
 from project import db
+from sqlalchemy import bindparam, select, and_
 from sqlalchemy.orm import exc
+from psycopg2.extras import execute_values
 from project.api.exceptions import InvalidUsage
+from project.metrics import metrics
+
+STREAM_CHUNK = 500
+URL_PLACEHOLDER = '__url_placeholder__'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+# JSON goes first, it wins the equal quality and */*
+RESPONSE_MIMETYPES = ('application/json', MSGPACK_MIMETYPE)
 
 
 def get_or_create(model, **kwargs):
@@ -19,3 +31,159 @@ def get_object_or_404(model, *criterion):
         return model.query.filter(*criterion).one()
     except (exc.NoResultFound, exc.MultipleResultsFound):
         raise InvalidUsage('This object not found', 404)
+
+
+def url_builder(endpoint, name, **values):
+    """url_for of the endpoint where only one argument changes, the rule is built once
+    :param name: name of the changing argument
+    :return: function of the argument value to the external url
+    """
+    url = url_for(endpoint, _external=True, **dict(values, **{name: URL_PLACEHOLDER}))
+    prefix, suffix = url.split(URL_PLACEHOLDER)
+    converter = current_app.url_map.converters['default'](current_app.url_map)
+    return lambda value: prefix + converter.to_url(value) + suffix
+
+
+def stream_json(items, encode, chunk_size=STREAM_CHUNK):
+    """JSON array sent by chunks while the items are iterated, the same bytes as jsonify of the list
+    Pretty printed like jsonify unless JSONIFY_PRETTYPRINT_REGULAR is off or the request is XHR.
+    :param items: iterable of the serializable items
+    :param encode: function of the item and the pretty flag to the JSON text of the item in the list
+    """
+    pretty = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] and not request.is_xhr
+    opening, separator, closing = ('[\n  ', ', \n  ', '\n]\n') if pretty else ('[', ',', ']\n')
+
+    def generate():
+        prefix = opening
+        chunk = []
+        for item in items:
+            chunk.append(prefix + encode(item, pretty))
+            prefix = separator
+            if len(chunk) >= chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+        chunk.append(closing if prefix == separator else '[]\n')
+        yield ''.join(chunk)
+    return Response(stream_with_context(generate()), mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def response_mimetype():
+    """Format of the response by the Accept header of the request, one of RESPONSE_MIMETYPES
+    """
+    return request.accept_mimetypes.best_match(RESPONSE_MIMETYPES) or RESPONSE_MIMETYPES[0]
+
+
+def msgpack_columns(columns, names=None):
+    """msgpack map of the columns as the typed arrays, without formatting the values one by one
+    Every column goes as the name, the numpy dtype string and the little-endian bytes of the values,
+    np.frombuffer(data, dtype) reads it back, dates are days since 1970-01-01 ('<M8[D]').
+    :param columns: namedtuple of the 1-d arrays of the same length
+    :param names: names of the columns in the response, the fields of the namedtuple by default
+    """
+    payload = {'length': len(columns[0]) if len(columns) else 0, 'columns': []}
+    for name, column in zip(names or columns._fields, columns):
+        column = np.asarray(column)
+        column = column.astype(column.dtype.newbyteorder('<'), copy=False)
+        payload['columns'].append({'name': name, 'dtype': column.dtype.str, 'data': column.tobytes()})
+    return Response(msgpack.packb(payload, use_bin_type=True), mimetype=MSGPACK_MIMETYPE)
+
+
+def json_matrix(values):
+    """Nested lists of the array with null instead of NaN and infinities, JSON has none of them
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+def bulk_upsert(model, rows, constraint_name, returning=None):
+    """Insert the rows or update the ones already stored, by the unique constraint
+    INSERT ... ON CONFLICT DO UPDATE on postgres, lookup of the stored keys elsewhere.
+    Stored rows with the same values are left as they are.
+    :param model: model with the unique constraint
+    :param rows: list of dicts with the clean column values
+    :param constraint_name: name of the unique constraint of the model
+    :param returning: names of the columns to return for the inserted and changed rows
+    :return: count of the rows, tuples of the returning columns of the written ones when they are given
+    """
+    table = model.__table__
+    key_columns = [
+        column.name for constraint in table.constraints
+        if constraint.name == constraint_name
+        for column in constraint.columns
+    ]
+    # one statement can't touch the same row twice, the last value wins like on sequential updates
+    rows = list(dict((tuple(row[key] for key in key_columns), row) for row in rows).values())
+    if not rows:
+        return [] if returning else 0
+
+    returning = tuple(returning or ())
+    if db.session.get_bind().dialect.name == 'postgresql':
+        written = _upsert_on_conflict(table, rows, constraint_name, key_columns, returning)
+    else:
+        written = _upsert_by_lookup(table, rows, key_columns, returning)
+    inserted = sum(1 for record in written if record[0])
+    metrics.inc('db_rows_inserted_total', inserted, table=table.name)
+    metrics.inc('db_rows_updated_total', len(written) - inserted, table=table.name)
+    if returning:
+        return [tuple(record[1:]) for record in written]
+    return len(rows)
+
+
+def _upsert_on_conflict(table, rows, constraint_name, key_columns, returning):
+    """:return: (inserted, *returning) of the written rows, xmax of the row is zero unless the conflict updated it"""
+    columns = list(rows[0])
+    values = [name for name in columns if name not in key_columns]
+    quote = db.session.get_bind().dialect.identifier_preparer.quote
+    sql = (
+        'INSERT INTO {table} ({columns}) VALUES %s ON CONFLICT ON CONSTRAINT {constraint} DO UPDATE SET {updates} '
+        'WHERE ({stored}) IS DISTINCT FROM ({excluded}) '
+        'RETURNING {returning}'
+    )
+    sql = sql.format(
+        table=quote(table.name),
+        columns=', '.join(quote(name) for name in columns),
+        constraint=quote(constraint_name),
+        updates=', '.join('{0} = EXCLUDED.{0}'.format(quote(name)) for name in values),
+        stored=', '.join('{}.{}'.format(quote(table.name), quote(name)) for name in values),
+        excluded=', '.join('EXCLUDED.{}'.format(quote(name)) for name in values),
+        returning=', '.join(('xmax = 0',) + tuple(quote(name) for name in returning)),
+    )
+    # the whole page goes in one VALUES list, skipping the compilation of the multi-row insert
+    with db.session.connection().connection.cursor() as cursor:
+        execute_values(cursor, sql, [tuple(row[name] for name in columns) for row in rows], page_size=len(rows))
+        metrics.count_statement()
+        return cursor.fetchall()
+
+
+def _upsert_by_lookup(table, rows, key_columns, returning):
+    """:return: (inserted, *returning) of the written rows"""
+    values = [name for name in rows[0] if name not in key_columns]
+    stored = db.session.execute(
+        select([table.c.id] + [table.c[name] for name in key_columns + values]).where(and_(*(
+            table.c[key].in_(set(row[key] for row in rows)) for key in key_columns
+        )))
+    )
+    size = len(key_columns)
+    stored_rows = dict((tuple(record[1:size + 1]), (record[0], tuple(record[size + 1:]))) for record in stored)
+
+    updates, inserts, written = [], [], []
+    for row in rows:
+        stored_row = stored_rows.get(tuple(row[key] for key in key_columns))
+        if stored_row is None:
+            inserts.append(row)
+        elif stored_row[1] == tuple(row[name] for name in values):
+            continue
+        else:
+            updates.append(dict((('u_' + name, value) for name, value in row.items()), u_id=stored_row[0]))
+        written.append((stored_row is None,) + tuple(row[name] for name in returning))
+
+    if updates:
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('u_id')).values(dict(
+                (name, bindparam('u_' + name)) for name in values
+            )),
+            updates
+        )
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+    return written
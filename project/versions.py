@@ -0,0 +1,52 @@
+# project/versions.py
+# Data versions of the tickers, bumped by the loaders on every commit
+
+import time
+import threading
+
+from flask import current_app
+from sqlalchemy import text
+
+from project import db
+from project.api.queries import TICKER_VERSIONS_SELECT
+
+VERSION_TTL = 5
+
+
+class TickerVersions:
+    """Versions of all tickers read in one query, reused for VERSION_TTL seconds
+
+    """
+    def __init__(self):
+        self._versions = {}
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._versions = {}
+            self._loaded = None
+
+    def _current(self):
+        ttl = current_app.config.get('RESPONSE_CACHE_VERSION_TTL', VERSION_TTL)
+        now = time.monotonic()
+        with self._lock:
+            if self._loaded is None or now - self._loaded >= ttl:
+                self._versions = dict(db.session.execute(text(TICKER_VERSIONS_SELECT)).fetchall())
+                self._loaded = now
+            return self._versions
+
+    def get(self, ticker_name):
+        return self._current().get(ticker_name, 0)
+
+    def get_many(self, ticker_names=None):
+        """Versions of the tickers, of all known ones without the names, a new ticker changes them too
+        :return: tuple of (name, version) sorted by name
+        """
+        versions = self._current()
+        if ticker_names is None:
+            return tuple(sorted(versions.items()))
+        return tuple((ticker_name, versions.get(ticker_name, 0)) for ticker_name in sorted(set(ticker_names)))
+
+
+ticker_versions = TickerVersions()
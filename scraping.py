@@ -1,28 +1,41 @@
-import re
+import os
 import sys
 import enum
+import time
 import asyncio
-import requests
-from lxml import html
-from datetime import date, datetime
-
-from project import db
-from project.models import (
-    Trade,
-    Insider,
-    TransactionType,
-    Ticker,
-    PriceHistory,
-)
-from project.utils import get_or_create
+import socket
+import resource
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+from flask import current_app, has_app_context
+from lxml import etree, html
+
+from project import app, db, dimensions
+from project.models import Ticker, Trade, PriceHistory, PriceStats, InsiderActivity, ScrapeJob
+from project.columnar import column_store
+from project.metrics import metrics
+from project.scheduler import RETRIES, Scheduler
+from project.pipeline import QUEUE_SIZE, BATCH_PAGES, Pipeline
+from project.page_cache import PageCache, CHANGED, SAME_CONTENT
+from project.parsing import PRICE_COLUMNS, TRADE_COLUMNS, parse_prices, parse_trades, trade_mark
 
 MAX_PAGES = 10
-STR_DATE = '%m/%d/%Y'
-FORMAT_TIME = r'^\d{2}:\d{2}'
+# seconds the claimed job is kept by the worker without the heartbeat
+LEASE_SECONDS = 60
+HEARTBEATS_PER_LEASE = 3
+POLL_SECONDS = 5
+KEEPALIVE_TIMEOUT = 30
+REQUEST_TIMEOUT = 60
+
+
+class LeaseLost(Exception):
+    """Jobs of the worker were taken over or their leases expired, the run is stopped"""
 
 
 @enum.unique
-class TypeScrap(enum.Flag):
+class TypeScrap(enum.Enum):
     """ Available types for scrapping
 
     """
@@ -35,39 +48,126 @@ class TradingScraper:
     """Trading scrapper for site on www.nasdaq.com
 
     """
-    URL_PRICES = 'http://www.nasdaq.com/symbol/{}/historical'
-    URL_TRADES = 'https://www.nasdaq.com/symbol/{}/insider-trades?page={}'
+    BASE_URL = 'https://www.nasdaq.com'
+    URL_PRICES = '{base_url}/symbol/{ticker}/historical'
+    URL_TRADES = '{base_url}/symbol/{ticker}/insider-trades?page={page}'
     XPATH_TRADES = '//*[@id="content_main"]/div[8]/div[5]/table/tr'
     XPATH_PRICES = '//table/tbody/tr'
     XPATH_LAST_PAGE = 'substring-after(//*[@id="quotes_content_left_lb_LastPage"]/@href, "?page=")'
     PRICES_INTERVAL = '3m'
 
-    def __init__(self, trick_name, scraping_type=None):
+    # compiled once, plain strings don't keep the tree alive
+    _trades_rows = etree.XPath(XPATH_TRADES)
+    _insider_code = etree.XPath('substring-after(td[1]/a/@href, "insiders/")', smart_strings=False)
+    _insider_name = etree.XPath('string(td[1]/a/text())', smart_strings=False)
+    _last_price = etree.XPath('string(td[7]/text())', smart_strings=False)
+    _trade_cells = etree.XPath('td[position() > 1][position() != 6]/text()', smart_strings=False)
+    _last_page = etree.XPath(XPATH_LAST_PAGE, smart_strings=False)
+    _prices_rows = etree.XPath(XPATH_PRICES)
+    _price_cells = etree.XPath('td/text()', smart_strings=False)
+
+    def __init__(self, trick_name, scraping_type=None, session=None, base_url=None, page_cache=None,
+                 trades_mark=None, executor=None, parse_stats=None, scheduler=None):
         self.trick_name = trick_name.lower()
+        self.session = session
+        self.base_url = base_url or self.BASE_URL
+        self.page_cache = page_cache or PageCache()
+        # pool of the parsing processes, pages are parsed on the event loop without it
+        self.executor = executor
+        self.parse_stats = parse_stats or ParseStats()
+        # rate limit, retries and concurrency shared by the scrapers of the run
+        self.scheduler = scheduler or Scheduler()
+        # (date, key) of the newest trade loaded before, the paging stops on the page reaching it
+        self.trades_mark = trades_mark
+        self.newest_trade = None
         self.prices_done = False
         self.paging = 0
+        self.pages_seen = 0
         self.pages_count = MAX_PAGES
         self.started_paging = False
         self.last_page = None
         self.finished = False
-        if scraping_type in TypeScrap:
+        if isinstance(scraping_type, TypeScrap):
             self.scrap_type = scraping_type
         else:
             self.scrap_type = TypeScrap.ALL
 
     def __await__(self):
+        return self.next_job().__await__()
+
+    @property
+    def paging_blocked(self):
+        """Next trades page depends on the one in flight: on its last page number or on the mark
+        """
+        if not self.started_paging:
+            return False
+        return not self.last_page or self.trades_mark is not None and self.pages_seen < self.paging
+
+    def reaches_mark(self, marks):
+        """Whether the page has some trade loaded before, older pages are all known then
+        :param marks: (date, key) of the trades of the page
+        """
+        mark_date, mark_key = self.trades_mark
+        return any(last_date < mark_date or key == mark_key for last_date, key in marks)
+
+    def next_job(self):
+        """Move the scraper to the next page and return the coroutine fetching it
+        :return: coroutine, ready to be scheduled as a task
+        """
         if not self.prices_done and self.scrap_type in (TypeScrap.PRICE, TypeScrap.ALL):
             self.prices_done = True
-            return self.scraping_prices().__await__()
+            return self.scraping_prices()
         elif self.paging < self.pages_count and self.scrap_type in (TypeScrap.TRADE, TypeScrap.ALL):
             if not self.paging:
                 self.started_paging = True
             self.paging += 1
-            return self.scraping_trades(self.paging).__await__()
+            return self.scraping_trades(self.paging)
         else:
             self.finished = True
             return asyncio.sleep(0)
 
+    async def fetch(self, method, url, **kwargs):
+        """Request the page through the shared session, the connection goes back to the pool
+        :return: raw body of the page
+        """
+        async with self.session.request(method, url, **kwargs) as response:
+            return await response.read()
+
+    async def fetch_page(self, page, method, url, **kwargs):
+        """Request the page, conditionally for GET, and compare it with the last loaded one
+        :param page: key of the page within the ticker in the page cache
+        :return: body of the page or None when it is unchanged, and its meta
+        """
+        meta = self.page_cache.lookup(self.trick_name, page)
+        if method == 'GET':
+            kwargs['headers'] = self.page_cache.request_headers(meta)
+        with metrics.timer('scraper_stage_seconds', stage='fetch'):
+            status, headers, content = await self.scheduler.request(self.session, method, url, **kwargs)
+        state, new_meta = self.page_cache.check(meta, status, headers, content)
+        metrics.inc('scraper_pages_total', kind=page.split('-')[0], state=state)
+
+        if state == CHANGED:
+            return content, new_meta
+        if state == SAME_CONTENT:
+            self.page_cache.store(self.trick_name, page, new_meta)
+        return None, new_meta or meta
+
+    async def extract(self, kind, content, with_last_page=False):
+        """Rows of the page parsed by the worker process
+        :return: rows and number of the last page, see extract_page
+        """
+        with metrics.timer('scraper_stage_seconds', stage='extract'):
+            if self.executor is None:
+                result = extract_page(kind, content, with_last_page)
+            else:
+                loop = asyncio.get_event_loop()
+                result = await loop.run_in_executor(
+                    self.executor, functools.partial(extract_page, kind, content, with_last_page)
+                )
+        rows, last_page, seconds, max_rss = result
+        self.parse_stats.add(seconds, max_rss)
+        return rows, last_page
+
     async def scraping_trades(self, page_index):
         """Scraping of trades price from specific index page
         :param page_index: specific paging
@@ -75,23 +175,37 @@ class TradingScraper:
         """
         print('Start trades scrapping for {} paging'.format(str(page_index)))
 
-        page = requests.get(self.URL_TRADES.format(self.trick_name, page_index))
-        tree = html.fromstring(page.content)
-        trades = (
-            [
-                tr.xpath('substring-after(td[1]/a/@href, "insiders/")'),
-                tr.xpath('string(td[1]/a/text())'),
-                tr.xpath('string(td[7]/text())'),
-            ] + tr.xpath('td[position() > 1][position() != 6]/text()')
-            for tr in
-            tree.xpath(self.XPATH_TRADES)
-        )
+        url = self.URL_TRADES.format(base_url=self.base_url, ticker=self.trick_name, page=page_index)
+        page = 'trades-{}'.format(page_index)
+        content, meta = await self.fetch_page(page, 'GET', url)
+        if content is None:
+            trades, last_page = None, meta.get('last_page')
+        else:
+            trades, last_page = await self.extract('trades', content, with_last_page=not self.last_page)
 
         if not self.last_page:
-            self.last_page = int(tree.xpath(self.XPATH_LAST_PAGE))
+            self.last_page = last_page
             if self.last_page < self.pages_count:
                 self.pages_count = self.last_page
-        return trades_agent(trades, page_index)
+
+        marks = [trade_mark(row) for row in trades or ()]
+        if marks:
+            newest = max(marks, key=lambda mark: mark[0])
+            if self.newest_trade is None or newest[0] > self.newest_trade[0]:
+                self.newest_trade = newest
+        # unchanged page was loaded before, as the older ones
+        if self.trades_mark is not None and (trades is None or self.reaches_mark(marks)):
+            if page_index < self.pages_count:
+                print('Known trades are reached on {} paging'.format(str(page_index)))
+                self.pages_count = page_index
+        self.pages_seen += 1
+
+        if trades is None:
+            print('Trades are unchanged on {} paging'.format(str(page_index)))
+            return None
+        agent = trades_agent(trades, page_index)
+        self.page_cache.stage(agent, self.trick_name, page, dict(meta, last_page=last_page))
+        return agent
 
     async def scraping_prices(self):
         """ Scrapping of historical prices for the specific interval
@@ -99,17 +213,78 @@ class TradingScraper:
         """
 
         payload = '{}|false|{}'.format(self.PRICES_INTERVAL, self.trick_name)
-        page = requests.post(self.URL_PRICES.format(self.trick_name), data=payload)
-        tree = html.fromstring(page.content)
-        prices = (
-            list(map(
-                lambda td: td.replace('\r\n', '').strip(),
-                tr.xpath('td/text()')
-            ))
-            for tr in
-            tree.xpath(self.XPATH_PRICES)
-        )
-        return prices_agent(prices)
+        url = self.URL_PRICES.format(base_url=self.base_url, ticker=self.trick_name)
+        # POST of the historical form has no validators, only the content hash tells the same page
+        content, meta = await self.fetch_page('prices', 'POST', url, data=payload)
+        if content is None:
+            print('Prices are unchanged')
+            return None
+        prices, _ = await self.extract('prices', content)
+        agent = prices_agent(prices)
+        self.page_cache.stage(agent, self.trick_name, 'prices', meta)
+        return agent
+
+    @classmethod
+    def extract_trades(cls, content, with_last_page=True):
+        """Rows of the insider trades table of the page
+        :param content: raw body of the page
+        :return: list of the row tuples of strings and number of the last page, None without with_last_page
+        """
+        tree = html.fromstring(content)
+        trades = [
+            (cls._insider_code(tr), cls._insider_name(tr), cls._last_price(tr)) + tuple(cls._trade_cells(tr))
+            for tr in cls._trades_rows(tree)
+        ]
+        last_page = int(cls._last_page(tree)) if with_last_page else None
+        return trades, last_page
+
+    @classmethod
+    def extract_prices(cls, content):
+        """Rows of the historical prices table of the page
+        :param content: raw body of the page
+        :return: list of the row tuples of strings
+        """
+        tree = html.fromstring(content)
+        return [
+            tuple(td.replace('\r\n', '').strip() for td in cls._price_cells(tr))
+            for tr in cls._prices_rows(tree)
+        ]
+
+
+def extract_page(kind, content, with_last_page=False):
+    """Parsing of the page in the worker process, only the plain rows go back to the scraper
+    :param kind: 'prices' or 'trades'
+    :return: rows, number of the last page or None, seconds of the parsing and peak RSS of the process in KiB
+    """
+    started = time.perf_counter()
+    if kind == 'prices':
+        rows, last_page = TradingScraper.extract_prices(content), None
+    else:
+        rows, last_page = TradingScraper.extract_trades(content, with_last_page)
+    seconds = time.perf_counter() - started
+    return rows, last_page, seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class ParseStats:
+    """Parse time per page and the peak RSS of the parsing processes
+
+    """
+    def __init__(self):
+        self.pages = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.max_rss = 0
+
+    def add(self, seconds, max_rss):
+        self.pages += 1
+        self.seconds += seconds
+        self.slowest = max(self.slowest, seconds)
+        self.max_rss = max(self.max_rss, max_rss)
+
+    def report(self):
+        print('Parsing: {} pages, {:.1f} ms per page, slowest {:.1f} ms, peak RSS of the workers {} KiB'.format(
+            self.pages, 1000 * self.seconds / self.pages if self.pages else 0, 1000 * self.slowest, self.max_rss
+        ))
 
 
 def trades_agent(generator, index):
@@ -122,99 +297,320 @@ def prices_agent(generator):
     yield from generator
 
 
-def send_tasks_to_load(tick_name, tasks):
-    for task in tasks:
-        agent = task.result()
-        if agent is None:
-            continue
-
-        if agent.__name__ == 'prices_agent':
-            prices_loading(tick_name, agent)
-        elif agent.__name__ == 'trades_agent':
-            trades_loading(tick_name, agent)
+def parse_page(trick_name, agent):
+    """Parse stage of the pipeline, rows of the fetched page for the writer
+    :param agent: generator of the page from the scraper, None for the unchanged page
+    :return: ticker name, kind, rows and the agent, None for the unchanged page
+    """
+    if agent is None:
+        return None
+    kind, parse = ('prices', parse_prices) if agent.__name__ == 'prices_agent' else ('trades', parse_trades)
+    with metrics.timer('scraper_stage_seconds', stage='parse'):
+        rows = parse(agent)
+    metrics.inc('scraper_rows_parsed_total', len(rows), kind=kind)
+    return trick_name, kind, rows, agent
+
+
+def write_pages(pages, page_cache=None):
+    """Writer stage of the pipeline, the parsed pages go by one transaction
+    :param pages: items from parse_page
+    :param page_cache: PageCache of the scrapers, the pages are stored in it after the commit
+    """
+    batch = WriteBatch()
+    with metrics.timer('scraper_stage_seconds', stage='load'):
+        for trick_name, kind, rows, _ in pages:
+            if kind == 'prices':
+                batch.prices(trick_name, rows)
+            else:
+                batch.trades(trick_name, rows)
+        batch.commit()
+    if page_cache is not None:
+        for _, _, _, agent in pages:
+            page_cache.commit(agent)
+
+
+class WriteBatch:
+    """Parsed pages of many tickers written by one transaction
+    The version of every ticker goes up once per commit, so the column store stays incremental.
+    """
+    def __init__(self):
+        # ticker name to its id, the first date of the changed prices and the (insider id, month) of the changed trades
+        self.tickers = {}
+
+    def _ticker(self, trick_name):
+        if trick_name not in self.tickers:
+            self.tickers[trick_name] = [dimensions.tickers.get_id(trick_name), None, set()]
+        return self.tickers[trick_name]
+
+    def prices(self, trick_name, prices):
+        """Write the parsed page of prices
+        :param prices: rows from parse_prices
+        """
+        ticker = self._ticker(trick_name)
+        rows = [dict(zip(PRICE_COLUMNS, values), ticker_id=ticker[0]) for values in prices]
+        changed = PriceHistory.bulk_upsert(rows, returning=('date',))
+        if changed:
+            since = min(day for day, in changed)
+            ticker[1] = since if ticker[1] is None else min(ticker[1], since)
+
+    def trades(self, trick_name, trades):
+        """Write the parsed page of trades
+        :param trades: rows from parse_trades
+        """
+        ticker = self._ticker(trick_name)
+        trades = [dict(zip(TRADE_COLUMNS, values)) for values in trades]
+
+        insider_ids = dimensions.insiders.resolve(dict(
+            (trade['code'], {'name': trade['insider']}) for trade in trades
+        ))
+        transaction_type_ids = dimensions.transaction_types.resolve(dict(
+            (trade['transaction_type'], {}) for trade in trades
+        ))
+        rows = [
+            dict(
+                ticker_id=ticker[0],
+                insider_id=insider_ids[trade['code']],
+                transaction_type_id=transaction_type_ids[trade['transaction_type']],
+                last_date=trade['last_date'],
+                last_price=trade['last_price'],
+                shares_traded=trade['shares_traded'],
+                shares_held=trade['shares_held'],
+            )
+            for trade in trades
+        ]
+        changed = Trade.bulk_upsert(rows, returning=('insider_id', 'last_date'))
+        ticker[2].update((insider_id, last_date.replace(day=1)) for insider_id, last_date in changed)
+
+    def commit(self):
+        """Refresh the stats from the first changed date and the activity of the changed months,
+        bump the versions of the tickers, commit and bring their column store up to date
+        """
+        for ticker_id, since, activity in self.tickers.values():
+            if since is not None:
+                PriceStats.refresh(ticker_id, since=since)
+            InsiderActivity.refresh(ticker_id, activity)
+        versions = [
+            (trick_name, Ticker.bump_version(ticker_id), since)
+            for trick_name, (ticker_id, since, _) in self.tickers.items()
+        ]
+        db.session.commit()
+        for trick_name, version, since in versions:
+            if since is not None:
+                column_store.refresh(trick_name, version, since=since)
+            else:
+                column_store.advance(trick_name, version)
+        self.tickers = {}
 
 
 def prices_loading(trick_name, prices):
-    today = date.today()
-    ticker = get_or_create(Ticker, name=trick_name)
-    order_params = {'date': 0, 'open': 1, 'high': 2, 'low': 3, 'close': 4, 'volume': 5}
-    for row in prices:
-        if not any(row):
-            continue
-
-        params = dict((key, row[index]) for key, index in order_params.items())
-        param_date = params.pop('date')
-        if re.match(FORMAT_TIME, param_date):
-            write_date = today
-        else:
-            write_date = datetime.strptime(param_date, STR_DATE).date()
-        price_record, created = PriceHistory.get_or_create(ticker=ticker, date=write_date, **params)
-        if not created:
-            price_record.update(**params)
-    db.session.commit()
+    """Write the parsed page of prices by its own commit
+    :param prices: rows from parse_prices
+    """
+    batch = WriteBatch()
+    batch.prices(trick_name, prices)
+    batch.commit()
 
 
 def trades_loading(trick_name, trades):
-    order_params = {
-        'code': 0,
-        'insider': 1,
-        'last_price': 2,
-        # 'relation': 3,
-        'last_date': 4,
-        'transaction_type': 5,
-        # 'owner_type': 6,
-        'shares_traded': 7,
-        'shares_held': 8
-    }
-    ticker = get_or_create(Ticker, name=trick_name)
-    for row in trades:
-        params = dict((key, row[index]) for key, index in order_params.items())
-        last_date = datetime.strptime(params.pop('last_date'), STR_DATE).date()
-        insider_code = params.pop('code', '').split('-')[-1]
-        insider = get_or_create(Insider, name=params.pop('insider'), code=insider_code)
-        transaction_type = get_or_create(TransactionType, name=params.pop('transaction_type'))
-
-        trade_record, created = Trade.get_or_create(
-            ticker=ticker,
-            insider=insider,
-            last_date=last_date,
-            transaction_type=transaction_type,
-            **params
+    """Write the parsed page of trades by its own commit
+    :param trades: rows from parse_trades
+    """
+    batch = WriteBatch()
+    batch.trades(trick_name, trades)
+    batch.commit()
+
+
+def store_trades_mark(scraper, failed=False):
+    """Keep the newest trade of the ticker whose pages are all loaded, the next run pages down to it
+    :param failed: some page of the ticker wasn't loaded, the mark would skip it
+    """
+    if not failed and scraper.newest_trade is not None:
+        Ticker.set_trades_mark(scraper.trick_name, *scraper.newest_trade)
+
+
+def create_session(threads_limit):
+    """Client session with the keep-alive connection pool, shared by all scrapers
+    :param threads_limit: max of the simultaneous connections to the one host
+    """
+    connector = aiohttp.TCPConnector(limit_per_host=threads_limit, keepalive_timeout=KEEPALIVE_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+
+
+async def main(event_loop, ticks_list, threads_limit=10, types_scrubs=None, base_url=None, page_cache=None,
+               full=False, parse_workers=None, rate=None, burst=1, retries=RETRIES, queue_size=QUEUE_SIZE,
+               batch_pages=BATCH_PAGES, jobs=None, worker=None, lease=LEASE_SECONDS):
+    """Scrap the tickers with their pages interleaved by the scheduler
+    Fetched pages are parsed and loaded by the pipeline, the writer thread commits many pages at once.
+    :param threads_limit: max of the pages in flight, the scheduler adapts the concurrency below it
+    :param full: walk all pages of trades, not only the ones newer than the mark of the ticker
+    :param parse_workers: count of the parsing processes, CPU count by default, 0 parses on the event loop
+    :param rate: requests per second to the host, None for no limit
+    :param retries: attempts after the first one on 5xx and timeouts
+    :param queue_size: pages waiting for the parsing and for the loading, the fetching waits beyond it
+    :param batch_pages: max of the pages loaded by one transaction
+    :param jobs: (id, ticker name, kind) of the ScrapeJob claimed by the worker, scraped instead of ticks_list,
+        their leases are extended while they run and they are completed after the pages are loaded
+    """
+    claimed = {}
+    for job_id, trick_name, kind in jobs or ():
+        claimed.setdefault(trick_name, []).append((job_id, TypeScrap(kind)))
+    # jobs not completed yet, changed and read in the writer thread only
+    leased = set(job_id for job_id, _, _ in jobs or ())
+    if jobs is not None:
+        ticks_list = list(claimed)
+
+    page_cache = page_cache or PageCache()
+    parse_stats = ParseStats()
+    scheduler = Scheduler(threads_limit, rate=rate, burst=burst, retries=retries)
+    executor = ProcessPoolExecutor(parse_workers) if parse_workers != 0 else None
+    dimensions.warm()
+    pipeline = Pipeline(
+        parse_page, functools.partial(write_pages, page_cache=page_cache),
+        current_app._get_current_object() if has_app_context() else app,
+        queue_size=queue_size, batch_pages=batch_pages
+    )
+
+    def start(trick_name):
+        scrap_type = types_scrubs
+        if trick_name in claimed:
+            kinds = set(kind for _, kind in claimed[trick_name])
+            scrap_type = kinds.pop() if len(kinds) == 1 else TypeScrap.ALL
+        return TradingScraper(
+            trick_name, scrap_type, session=session, base_url=base_url, page_cache=page_cache,
+            trades_mark=None if full else Ticker.get_trades_mark(trick_name.lower()),
+            executor=executor, parse_stats=parse_stats, scheduler=scheduler
         )
 
-        if not created:
-            trade_record.update(**params)
-    db.session.commit()
+    async def load(tasks):
+        for task, trick_name in tasks.items():
+            if task.result() is not None:
+                await pipeline.put(trick_name, task.result())
 
+    def complete(job_ids, failed):
+        ScrapeJob.complete(job_ids, worker, failed)
+        leased.difference_update(job_ids)
 
-async def main(event_loop, ticks_list, threads_limit=10, types_scrubs=None):
-    dl_tasks = set()
-    scraper = TradingScraper(ticks_list.pop(0), types_scrubs)
-    while not scraper.finished:
-        dl_tasks.add(event_loop.create_task(scraper.__await__()))
+    async def finish(scraper, failed):
+        await pipeline.finish(functools.partial(store_trades_mark, scraper, failed))
+        if scraper.trick_name in claimed:
+            job_ids = [job_id for job_id, _ in claimed[scraper.trick_name]]
+            await pipeline.finish(functools.partial(complete, job_ids, failed))
 
-        if len(dl_tasks) >= threads_limit or scraper.started_paging and not scraper.last_page:
-            # Wait for some download to finish before adding a new one
-            _done, dl_tasks = await asyncio.wait(
-                dl_tasks, return_when=asyncio.FIRST_COMPLETED
-            )
-            send_tasks_to_load(scraper.trick_name, _done)
+    def extend_leases():
+        job_ids = sorted(leased)
+        return len(job_ids), ScrapeJob.heartbeat(worker, job_ids, lease) if job_ids else 0
 
-        if scraper.finished and len(ticks_list):
-            scraper = TradingScraper(ticks_list.pop(0), types_scrubs)
+    async def heartbeat():
+        """Extend the leases in the writer thread, the failed heartbeats are retried while the lease lasts
+        Raises LeaseLost when some job isn't leased to the worker anymore.
+        """
+        renewed = time.monotonic()
+        while True:
+            await asyncio.sleep(lease / HEARTBEATS_PER_LEASE)
+            try:
+                running, extended = await pipeline.call(extend_leases)
+            except Exception as error:
+                metrics.inc('scraper_heartbeat_errors_total')
+                print('Heartbeat of the worker {} failed: {!r}'.format(worker, error))
+                if time.monotonic() - renewed < lease:
+                    continue
+                raise LeaseLost('Leases of the worker {} expired after the failed heartbeats'.format(worker))
+            if extended < running:
+                raise LeaseLost('{} of {} jobs are not leased to the worker {} anymore'.format(
+                    running - extended, running, worker
+                ))
+            renewed = time.monotonic()
+
+    heartbeats = asyncio.ensure_future(heartbeat()) if jobs else None
+    try:
+        async with create_session(threads_limit) as session:
+            scraping = asyncio.ensure_future(scheduler.run(ticks_list, start, load, finish))
+            if heartbeats is not None:
+                await asyncio.wait([scraping, heartbeats], return_when=asyncio.FIRST_COMPLETED)
+                if heartbeats.done():
+                    # the heartbeat ends by the error only, the jobs go on elsewhere
+                    scraping.cancel()
+                    heartbeats.result()
+            await scraping
+    finally:
+        try:
+            await pipeline.close()
+        finally:
+            if heartbeats is not None:
+                heartbeats.cancel()
+            if executor is not None:
+                executor.shutdown()
+    if heartbeats is not None and heartbeats.done() and not heartbeats.cancelled():
+        # lost while the last pages were written
+        heartbeats.result()
+
+    dimensions.report()
+    parse_stats.report()
+    if page_cache.enabled:
+        page_cache.report()
+    scheduler.report()
+    metrics.report('scraper_', 'db_')
+
+
+def read_tickers(file_path):
+    with open(file_path, 'r') as tick_file:
+        return [name for name in tick_file.read().splitlines() if name.strip()]
+
+
+def run(file_path, threads_limit, types_scrubs=None, force=False, full=False, parse_workers=None, rate=None):
+    tick_list = read_tickers(file_path)
+    page_cache = PageCache(app.config.get('PAGE_CACHE_PATH'), force=force)
+    if rate is None:
+        rate = app.config.get('SCRAPER_HOST_RATE')
 
-    if len(dl_tasks):
-        # Wait for the remaining downloads to finish
-        _done, _ = await asyncio.wait(dl_tasks)
-        send_tasks_to_load(scraper.trick_name, _done)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(
+        loop, tick_list, threads_limit=threads_limit, types_scrubs=types_scrubs, page_cache=page_cache, full=full,
+        parse_workers=parse_workers, rate=rate, burst=app.config.get('SCRAPER_HOST_BURST', 1)
+    ))
 
 
-def run(file_path, threads_limit, types_scrubs=None):
-    tick_file = open(file_path, 'r')
-    tick_list = tick_file.read().splitlines()
+def enqueue(file_path, types_scrubs=None):
+    """Queue the jobs of the tickers of the file for the workers
+    :return: count of the queued jobs
+    """
+    if types_scrubs in (None, TypeScrap.ALL):
+        kinds = [TypeScrap.PRICE.value, TypeScrap.TRADE.value]
+    else:
+        kinds = [types_scrubs.value]
+    return ScrapeJob.enqueue(read_tickers(file_path), kinds)
+
+
+def work(threads_limit, force=False, full=False, parse_workers=None, rate=None, base_url=None, worker=None,
+         lease=LEASE_SECONDS, poll=POLL_SECONDS):
+    """Scrap the jobs of the queue until none is queued or running, any count of the workers on any hosts
+    Every round claims the jobs for the threads, the ones of the crashed workers come back after their leases.
+    :param worker: name of the worker in the jobs, host and pid by default
+    :param lease: seconds the claimed jobs are kept without the heartbeat
+    :param poll: seconds between the claims while the jobs are running elsewhere
+    """
+    worker = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+    page_cache = PageCache(app.config.get('PAGE_CACHE_PATH'), force=force)
+    if rate is None:
+        rate = app.config.get('SCRAPER_HOST_RATE')
 
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(main(loop, tick_list, threads_limit=threads_limit, types_scrubs=types_scrubs))
+    while True:
+        jobs = ScrapeJob.claim(worker, threads_limit, lease)
+        if not jobs:
+            if not ScrapeJob.pending():
+                break
+            time.sleep(poll)
+            continue
+        print('Worker {} claimed {} jobs'.format(worker, len(jobs)))
+        try:
+            loop.run_until_complete(main(
+                loop, None, threads_limit=threads_limit, base_url=base_url, page_cache=page_cache, full=full,
+                parse_workers=parse_workers, rate=rate, burst=app.config.get('SCRAPER_HOST_BURST', 1),
+                jobs=jobs, worker=worker, lease=lease
+            ))
+        except LeaseLost as error:
+            print('Worker {} stopped the run: {}'.format(worker, error))
 
 
 if __name__ == '__main__':
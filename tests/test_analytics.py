@@ -0,0 +1,308 @@
+import os
+import random
+import statistics
+import shutil
+import tempfile
+from datetime import date, timedelta
+from unittest import TestCase
+
+import numpy as np
+
+from tests.test_config import BaseTestCase
+from project import db
+from project.models import Ticker, PriceHistory, PriceStats
+from project.analytics import (
+    COLUMN_TYPES,
+    AnalyticsRow,
+    ReturnsRow,
+    delta_periods,
+    rolling_stats,
+    forward_returns,
+    group_returns,
+    align_closes,
+    return_matrices,
+)
+from project.columnar import column_store
+from project.parsing import parse_prices
+from scraping import prices_loading
+
+
+def brute_force_periods(prices, value):
+    """Periods as the pairwise DELTA_SELECT self-join defined them"""
+    ends = {}
+    for begin in range(len(prices)):
+        found = [end for end in range(begin + 1, len(prices)) if abs(prices[begin] - prices[end]) > value]
+        if found:
+            ends[begin] = min(found)
+    begins = {}
+    for begin, end in ends.items():
+        begins[end] = max(begins.get(end, begin), begin)
+    return sorted((begin, end) for end, begin in begins.items())
+
+
+def brute_force_stats(close, window):
+    """Rows of the stats by the definition, None where the window isn't complete"""
+    alpha = 2.0 / (window + 1)
+    rows, ema = [], None
+    for index in range(len(close)):
+        daily_return = close[index] / close[index - 1] - 1 if index else None
+        sma = sum(close[index - window + 1:index + 1]) / window if index >= window - 1 else None
+        if index == window - 1:
+            ema = sma
+        elif index >= window:
+            ema = alpha * close[index] + (1 - alpha) * ema
+        volatility = statistics.stdev(
+            close[day] / close[day - 1] - 1 for day in range(index - window + 1, index + 1)
+        ) if index >= window else None
+        rows.append((daily_return, sma, ema, volatility))
+    return np.array(rows, dtype=np.float64).reshape(len(close), 4)
+
+
+class TestDeltaPeriods(TestCase):
+
+    def test_same_as_self_join(self):
+        rnd = random.Random(5)
+        for _ in range(200):
+            prices = [100.0]
+            for _ in range(rnd.randint(0, 60)):
+                prices.append(round(prices[-1] + rnd.choice((-3, -1, -0.5, 0, 0.1, 1, 2.5)), 2))
+            value = rnd.choice((0, 0.5, 1, 2, 3, 5))
+
+            self.assertEqual(delta_periods(prices, value), brute_force_periods(prices, value))
+
+    def test_no_periods(self):
+        self.assertEqual(delta_periods([], 1), [])
+        self.assertEqual(delta_periods([10.0, 10.5, 9.5], 1), [])
+
+
+class TestRollingStats(TestCase):
+
+    def test_same_as_definition(self):
+        rnd = random.Random(6)
+        for _ in range(100):
+            close = [100.0]
+            for _ in range(rnd.randint(0, 40)):
+                close.append(round(max(1.0, close[-1] + rnd.uniform(-3, 3)), 2))
+            window = rnd.randint(2, 10)
+
+            stats = np.column_stack(rolling_stats(close, window))
+            self.assertTrue(np.allclose(stats, brute_force_stats(close, window), equal_nan=True))
+
+    def test_tail(self):
+        close = [100.0 + (day % 7) * 1.5 - day * 0.1 for day in range(60)]
+        window, offset = 10, 35
+        full = rolling_stats(close, window)
+        tail = rolling_stats(close[offset - window:], window, offset=window, ema_before=full[2][offset - 1])
+        for full_column, tail_column in zip(full, tail):
+            self.assertEqual(full_column[offset:].tolist(), tail_column.tolist())
+
+
+def brute_force_returns(dates, close, trade_dates, horizons):
+    """Returns by the lookup of every trade, None where the series doesn't reach the exit"""
+    rows = []
+    for trade_date in trade_dates:
+        entry = next((index for index, day in enumerate(dates) if day >= trade_date), None)
+        rows.append([
+            close[entry + horizon] / close[entry] - 1 if entry is not None and entry + horizon < len(close) else None
+            for horizon in horizons
+        ])
+    return np.array(rows, dtype=np.float64).reshape(len(trade_dates), len(horizons))
+
+
+class TestForwardReturns(TestCase):
+
+    def test_same_as_lookup(self):
+        rnd = random.Random(7)
+        for _ in range(100):
+            # trading days with the gaps, trades on any day around them
+            days = sorted(rnd.sample(range(60), rnd.randint(0, 40)))
+            dates = [date(2018, 1, 1) + timedelta(days=day) for day in days]
+            close = [round(rnd.uniform(50, 150), 2) for _ in days]
+            trade_dates = [date(2018, 1, 1) + timedelta(days=rnd.randint(-5, 65)) for _ in range(rnd.randint(0, 20))]
+            horizons = rnd.sample(range(1, 15), rnd.randint(1, 4))
+
+            returns = forward_returns(np.array(dates, dtype='datetime64[D]'), close, trade_dates, horizons)
+            self.assertTrue(np.allclose(
+                returns, brute_force_returns(dates, close, trade_dates, horizons), equal_nan=True
+            ))
+
+    def test_groups(self):
+        returns = np.array([[0.1, np.nan], [-0.2, 0.3], [0.4, 0.5], [np.nan, np.nan]])
+        rows = group_returns(['b', 'a', 'b', 'c'], returns, (5, 20))
+        self.assertEqual(rows[:2], [ReturnsRow('a', 5, 1, 1, -0.2, 0.0), ReturnsRow('a', 20, 1, 1, 0.3, 1.0)])
+        self.assertEqual(rows[2].group, 'b')
+        self.assertAlmostEqual(rows[2].mean_return, 0.25)
+        self.assertEqual(rows[2][:4] + rows[2][5:], ('b', 5, 2, 2, 1.0))
+        self.assertEqual(rows[3], ReturnsRow('b', 20, 2, 1, 0.5, 1.0))
+        self.assertEqual(rows[4:], [ReturnsRow('c', 5, 1, 0, None, None), ReturnsRow('c', 20, 1, 0, None, None)])
+        self.assertEqual(group_returns([], np.empty((0, 2)), (5, 20)), [])
+
+
+class TestCorrelation(TestCase):
+
+    def test_aligned(self):
+        rnd = random.Random(8)
+        for _ in range(50):
+            series = []
+            for _ in range(rnd.randint(1, 6)):
+                days = sorted(rnd.sample(range(30), rnd.randint(0, 30)))
+                series.append(dict((date(2018, 1, 1) + timedelta(days=day), rnd.uniform(50, 150)) for day in days))
+            dates, closes = align_closes([
+                (np.array(sorted(closes), dtype='datetime64[D]'), [closes[day] for day in sorted(closes)])
+                for closes in series
+            ])
+
+            common = sorted(set.intersection(*(set(closes) for closes in series)))
+            self.assertEqual(dates.tolist(), common)
+            self.assertEqual(closes.tolist(), [[closes[day] for closes in series] for day in common])
+
+    def test_matrices(self):
+        rnd = random.Random(9)
+        closes = np.array([[rnd.uniform(50, 150) for _ in range(5)] for _ in range(40)])
+        correlation, covariance = return_matrices(closes)
+        returns = closes[1:] / closes[:-1] - 1
+        self.assertTrue(np.allclose(correlation, np.corrcoef(returns, rowvar=False)))
+        self.assertTrue(np.allclose(covariance, np.cov(returns, rowvar=False)))
+
+        # no variance of the constant close, no returns of the single date
+        correlation, _ = return_matrices(np.column_stack([closes[:, 0], np.full(40, 10.0)]))
+        self.assertEqual(correlation[0, 0], 1.0)
+        self.assertTrue(np.isnan(correlation[0, 1]) and np.isnan(correlation[1, 1]))
+        correlation, covariance = return_matrices(closes[:2])
+        self.assertEqual(correlation.shape, (5, 5))
+        self.assertTrue(np.isnan(covariance).all())
+
+
+class TestColumnStore(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        super().setUp()
+        self.store_path = tempfile.mkdtemp()
+        self.app.config['COLUMN_STORE_PATH'] = self.store_path
+
+    def tearDown(self):
+        self.app.config['COLUMN_STORE_PATH'] = None
+        shutil.rmtree(self.store_path)
+        super().tearDown()
+
+    def assert_same_as_sql(self, ticker_name):
+        columns = PriceHistory.get_series(ticker_name)
+        self.assertIsInstance(columns.close, np.memmap)
+
+        self.app.config['COLUMN_STORE_PATH'] = None
+        sql_columns = PriceHistory.get_series(ticker_name)
+        self.app.config['COLUMN_STORE_PATH'] = self.store_path
+        for column, sql_column in zip(columns, sql_columns):
+            self.assertEqual(column.tolist(), sql_column.tolist())
+
+    def test_incremental_refresh(self):
+        prices_loading('cvx', parse_prices([['01/10/2018', '1.0', '2.0', '0.5', '1.5', '100']]))
+        self.assert_same_as_sql('cvx')
+        self.assertEqual(len(PriceHistory.get_series('cvx')), 11)
+
+        prices_loading('cvx', parse_prices([
+            ['01/09/2018', '108.0', '121.0', '118.0', '130.0', '9,516,349'],
+            ['01/11/2018', '2.0', '3.0', '1.5', '2.5', '200'],
+        ]))
+        self.assert_same_as_sql('cvx')
+        self.assertEqual(len(PriceHistory.get_series('cvx')), 12)
+
+        self.assertEqual(
+            PriceHistory.get_analytics('cvx', date(2017, 12, 31), date(2018, 1, 9)),
+            [AnalyticsRow(open=8.0, close=30.0, low=0.0, high=21.0)]
+        )
+        periods = [(date(2017, 12, 31), date(2018, 1, 9)), (date(2018, 1, 11), date(2018, 1, 12))]
+        batch = PriceHistory.get_analytics_batch(['cvx', 'aapl'], periods)
+        delta = PriceHistory.get_delta('cvx', 'close', 11)
+        self.app.config['COLUMN_STORE_PATH'] = None
+        self.assertEqual(delta, PriceHistory.get_delta('cvx', 'close', 11))
+        self.assertEqual(batch, PriceHistory.get_analytics_batch(['cvx', 'aapl'], periods))
+        self.assertEqual(batch['cvx'][periods[0]], [AnalyticsRow(open=8.0, close=30.0, low=0.0, high=21.0)])
+
+        prices_loading('aapl', parse_prices([
+            ['01/0{}/2018'.format(day), '1.0', '2.0', '0.5', '{}.5'.format(day % 3 + day), '100']
+            for day in range(1, 10)
+        ]))
+        dates = (date(2018, 1, 2), date(2018, 1, 11))
+        matrices = PriceHistory.get_correlation(['cvx', 'aapl'], *dates)
+        self.app.config['COLUMN_STORE_PATH'] = self.store_path
+        self.assertEqual(matrices['dates'].tolist(), [date(2018, 1, day) for day in range(2, 10)])
+        stored = PriceHistory.get_correlation(['cvx', 'aapl'], *dates)
+        for name in ('dates', 'correlation', 'covariance'):
+            self.assertEqual(stored[name].tolist(), matrices[name].tolist())
+
+    def test_generations(self):
+        prices_loading('cvx', parse_prices([['01/10/2018', '1.0', '2.0', '0.5', '1.5', '100']]))
+        before = PriceHistory.get_series('cvx')
+        version = Ticker.query.filter_by(name='cvx').one().data_version
+
+        prices_loading('cvx', parse_prices([['01/09/2018', '1.0', '2.0', '0.5', '7.5', '100']]))
+        self.assert_same_as_sql('cvx')
+        # the map of the replaced generation keeps its data, its files are gone
+        self.assertEqual((before.close[-2], len(before)), (118.0, 11))
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.store_path, 'cvx'))),
+            sorted(['lock', 'meta.json'] + ['{}.{}'.format(name, version + 1) for name, _ in COLUMN_TYPES])
+        )
+
+        # the late writer of the older version leaves the store
+        column_store.refresh('cvx', version)
+        self.assertEqual(PriceHistory.get_series('cvx').close[-2], 7.5)
+
+        self.app.config['COLUMN_STORE_MAPS'] = 1
+        column_store.refresh('aapl', Ticker.query.filter_by(name='aapl').one().data_version)
+        PriceHistory.get_series('aapl')
+        self.assertEqual(list(column_store._maps), ['aapl'])
+        del self.app.config['COLUMN_STORE_MAPS']
+
+    def test_stale_store(self):
+        prices_loading('cvx', parse_prices([['01/10/2018', '1.0', '2.0', '0.5', '1.5', '100']]))
+        Ticker.bump_version(Ticker.query.filter_by(name='cvx').one().id)
+        db.session.commit()
+
+        self.assertIsNone(column_store.read('cvx'))
+        self.assertNotIsInstance(PriceHistory.get_series('cvx').close, np.memmap)
+
+
+class TestPriceStats(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['PRICE_STATS_WINDOWS'] = (2, 4)
+        self.ticker_id = Ticker.query.filter_by(name='cvx').one().id
+        PriceStats.refresh(self.ticker_id)
+        db.session.commit()
+
+    def tearDown(self):
+        self.app.config['PRICE_STATS_WINDOWS'] = (5, 20, 50)
+        super().tearDown()
+
+    def test_incremental_refresh(self):
+        self.assertEqual(PriceStats.check(self.ticker_id), [])
+        self.assertEqual(PriceStats.query.filter_by(ticker_id=self.ticker_id).count(), 20)
+
+        prices_loading('cvx', parse_prices([['01/10/2018', '1.0', '2.0', '0.5', '1.5', '100']]))
+        self.assertEqual(PriceStats.check(self.ticker_id), [])
+        prices_loading('cvx', parse_prices([
+            ['01/03/2018', '108.0', '121.0', '118.0', '130.0', '9,516,349'],
+            ['01/11/2018', '2.0', '3.0', '1.5', '2.5', '200'],
+        ]))
+        self.assertEqual(PriceStats.check(self.ticker_id), [])
+        self.assertEqual(PriceStats.query.filter_by(ticker_id=self.ticker_id).count(), 24)
+
+    def test_missing_context(self):
+        PriceStats.query.delete()
+        prices_loading('cvx', parse_prices([['01/10/2018', '1.0', '2.0', '0.5', '1.5', '100']]))
+        self.assertEqual(PriceStats.check(self.ticker_id), [])
+
+    def test_check(self):
+        stats = PriceStats.query.filter_by(ticker_id=self.ticker_id, window=4).order_by(PriceStats.date).all()
+        stats[-1].sma += 0.01
+        db.session.delete(stats[-2])
+        db.session.commit()
+        self.assertEqual(PriceStats.check(self.ticker_id), [(4, stats[-2].date), (4, stats[-1].date)])
+
+        self.app.config['PRICE_STATS_WINDOWS'] = (2,)
+        self.assertEqual(len(PriceStats.check(self.ticker_id)), 9)
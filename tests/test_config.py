@@ -1,7 +1,10 @@
 from flask import Flask
 from unittest import TestCase
 from flask_fixtures import FixturesMixin
-from project import db, config
+from project import db, config, dimensions
+from project.cache import response_cache
+from project.metrics import metrics
+from project.versions import ticker_versions
 
 
 class BaseTestCase(TestCase, FixturesMixin):
@@ -17,6 +20,7 @@ class BaseTestCase(TestCase, FixturesMixin):
 
         test_app.register_blueprint(mod_api, url_prefix='/api')
         test_app.register_blueprint(mod_site)
+        metrics.init_app(test_app)
 
         return test_app
 
@@ -32,6 +36,10 @@ class BaseTestCase(TestCase, FixturesMixin):
         super().tearDownClass()
 
     def tearDown(self):
+        dimensions.clear()
+        response_cache.clear()
+        metrics.clear()
+        ticker_versions.clear()
         self.db.session.rollback()
         self.db.drop_all()
         super().tearDown()
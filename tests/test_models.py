@@ -1,6 +1,11 @@
+from datetime import date
+
 from tests.test_config import BaseTestCase
-from project.models import PriceHistory
+from project import db, dimensions
+from project.api.exceptions import InvalidUsage
+from project.models import PriceHistory, Ticker, Insider, InsiderActivity, TransactionType, Trade
 from project.api.serializers import PricesTickSchema
+from scraping import trades_loading
 
 
 class TestPricesHistory(BaseTestCase):
@@ -16,6 +21,25 @@ class TestPricesHistory(BaseTestCase):
         # 31/12/2017 - 08/01/2018 ~ diff 11 from fixtures
         self.assertEquals(len(delta_list_open), 9)
 
+    def test_diff_periods(self):
+        delta_list = PriceHistory.get_delta('cvx', 'close', 11)
+
+        periods = {}
+        for row in delta_list:
+            periods.setdefault((row.g_num, row.diff), []).append(str(row.date))
+
+        # 31/12/2017 - 08/01/2018 ~ 100 -> 113, 03/01/2018 - 09/01/2018 ~ 106 -> 118
+        self.assertEqual(
+            [(g_num, diff, dates[0], dates[-1]) for (g_num, diff), dates in sorted(periods.items())],
+            [(1, 13.0, '2017-12-31', '2018-01-08'), (2, 12.0, '2018-01-03', '2018-01-09')]
+        )
+
+    def test_diff_arguments(self):
+        with self.assertRaises(InvalidUsage):
+            PriceHistory.get_delta('cvx', 'close; DROP TABLE ticker', 11)
+        with self.assertRaises(InvalidUsage):
+            PriceHistory.get_delta('cvx', 'close', None)
+
     def test_analytics(self):
         data_analytics = PriceHistory.get_analytics(
             'cvx',
@@ -29,3 +53,123 @@ class TestPricesHistory(BaseTestCase):
         data = prices_schema.dump(data_analytics)
 
         self.assertEquals(data.data[0].get('close'), 13)
+
+
+class TestDimensionCache(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def test_resolve(self):
+        dimensions.warm()
+        ids = dimensions.tickers.resolve({'cvx': {}, 'aapl': {}, 'xom': {}})
+
+        self.assertEqual(ids['cvx'], Ticker.query.filter_by(name='cvx').one().id)
+        self.assertEqual(ids['xom'], Ticker.query.filter_by(name='xom').one().id)
+        self.assertEqual((dimensions.tickers.hits, dimensions.tickers.misses), (2, 1))
+
+        self.assertEqual(dimensions.tickers.get_id('xom'), ids['xom'])
+        self.assertEqual(dimensions.tickers.hits, 3)
+
+    def test_conflicting_insert(self):
+        # row inserted by the concurrent loader after the cache was warmed
+        dimensions.warm()
+        db.session.add(TransactionType(name='Sell'))
+        db.session.commit()
+        stored_id = TransactionType.query.filter_by(name='Sell').one().id
+
+        ids = dimensions.transaction_types.resolve({'Sell': {}, 'Buy': {}})
+
+        self.assertEqual(ids['Sell'], stored_id)
+        self.assertEqual(TransactionType.query.count(), 2)
+
+    def test_bounded(self):
+        cache = dimensions.DimensionCache(Insider, 'code', max_size=2)
+        cache.resolve(dict((code, {'name': 'insider {}'.format(code)}) for code in (1, 2, 3)))
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(Insider.query.count(), 3)
+
+
+class TestInsiderActivity(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def stored(self):
+        return sorted(
+            (row.insider_id, row.transaction_type_id, row.month, row.trades_count, row.net_shares, row.vwap)
+            for row in InsiderActivity.query.all()
+        )
+
+    def aggregated(self):
+        """Activity summed over the stored trades"""
+        groups = {}
+        for trade in Trade.query.all():
+            key = (trade.insider_id, trade.transaction_type_id, trade.last_date.replace(day=1))
+            sign = -1 if 'Sell' in trade.transaction_type.name else 1
+            groups.setdefault(key, []).append((sign * trade.shares_traded, trade.last_price, trade.shares_traded))
+        return sorted(key + (
+            len(trades),
+            sum(net for net, _, _ in trades),
+            sum(price * shares for _, price, shares in trades) / sum(shares for _, _, shares in trades),
+        ) for key, trades in groups.items())
+
+    def test_incremental_refresh(self):
+        trades_loading('cvx', [
+            (1, 'Smith John', date(2018, 1, 5), 'Sell', 10.0, 100, 1000),
+            (1, 'Smith John', date(2018, 1, 25), 'Sell', 12.0, 300, 700),
+            (1, 'Smith John', date(2018, 2, 1), 'Automatic Sell', 11.0, 50, 650),
+            (2, 'Müller Ann', date(2018, 1, 5), 'Buy', 11.5, 200, 2000),
+        ])
+        self.assertEqual(self.stored(), self.aggregated())
+        sells = InsiderActivity.query.filter_by(month=date(2018, 1, 1), net_shares=-400).one()
+        self.assertEqual((sells.trades_count, sells.vwap), (2, 11.5))
+
+        # the page of other months and the corrected trade rewrite only their aggregates
+        trades_loading('cvx', [
+            (1, 'Smith John', date(2018, 1, 25), 'Sell', 12.0, 500, 500),
+            (2, 'Müller Ann', date(2018, 3, 9), 'Buy', 9.0, 100, 2100),
+        ])
+        self.assertEqual(self.stored(), self.aggregated())
+        self.assertEqual(len(self.stored()), 4)
+
+        InsiderActivity.refresh(Ticker.query.filter_by(name='cvx').one().id)
+        self.assertEqual(self.stored(), self.aggregated())
+
+
+class TestQueryPlans(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        super().setUp()
+        for ticker_name, insider_codes in (('cvx', range(0, 200)), ('aapl', range(100, 300))):
+            trades_loading(ticker_name, [
+                (code, 'insider {}'.format(code), date(2018, 1, day), 'Sell', 10.0, 100, 1000)
+                for code in insider_codes for day in range(1, 21)
+            ])
+        db.session.execute('ANALYZE')
+
+    def assert_index_scans(self, query, *indexes):
+        """Query must be answerable by the indexes, sequential scan is only the last resort of the planner
+        """
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        connection = db.session.connection()
+        connection.execute('SET enable_seqscan = off')
+        plan = '\n'.join(row[0] for row in connection.execute('EXPLAIN ' + str(compiled), compiled.params))
+        connection.execute('SET enable_seqscan = on')
+        self.assertNotIn('Seq Scan', plan)
+        for index in indexes:
+            self.assertIn(index, plan)
+
+    def test_insiders(self):
+        insiders = Insider.get_by_ticker('cvx')
+
+        self.assertEqual(insiders.count(), 200)
+        self.assertEqual(insiders.first().name, 'insider 0')
+        self.assert_index_scans(insiders, 'ix_trade_insider_id')
+
+    def test_insider_trades(self):
+        trades = Trade.get_insider_trades('cvx', 'insider 150')
+
+        self.assertEqual([trade.last_date.day for trade in trades], list(range(1, 21)))
+        self.assert_index_scans(trades, 'ix_insider_name')
+
+    def test_prices(self):
+        self.assert_index_scans(PriceHistory.get_prices('cvx', after=date(2018, 1, 1), limit=4))
@@ -1,5 +1,19 @@
 import json
+from datetime import date
+
+import msgpack
+import numpy as np
+from flask import jsonify
+
 from tests.test_config import BaseTestCase
+from project import db
+from project.models import Ticker, Trade, PriceStats, PriceHistory
+from project.cache import response_cache
+from project.metrics import metrics
+from project.api.serializers import InsiderTradeSchema, PricesTickSchema
+from project.api.exceptions import InvalidUsage
+from project.parsing import parse_prices
+from scraping import trades_loading, prices_loading
 
 
 class TestRoutes(BaseTestCase):
@@ -15,3 +29,299 @@ class TestRoutes(BaseTestCase):
                 [item.get('name') for item in data if item.get('name')],
                 ['cvx', 'aapl']
             )
+
+    def test_prices_stream(self):
+        with self.app.test_client() as client:
+            resp_client = client.get('/api/cvx/')
+            data = json.loads(resp_client.data)
+            self.assertEqual(len(data), 10)
+            self.assertEqual(data[0], {
+                'date': '2017-12-31', 'open': 100.0, 'high': 121.0, 'low': 118.0, 'close': 100.0, 'volume': 9516349
+            })
+
+            resp_client = client.get('/api/unknown/')
+            self.assertEqual(json.loads(resp_client.data), [])
+
+    def test_prices_bytes(self):
+        # the streamed history is what jsonify of the schema gave, pretty printed and compact for XHR
+        prices = PricesTickSchema(many=True).dump(PriceHistory.get_prices('cvx')).data
+        with self.app.test_client() as client:
+            resp_client = client.get('/api/cvx/')
+            self.assertTrue(resp_client.data.startswith(
+                b'[\n  {\n    "close": 100.0, \n    "date": "2017-12-31", \n    "high": 121.0, '
+            ))
+            for headers in ({}, {'X-Requested-With': 'XMLHttpRequest'}):
+                with self.app.test_request_context(headers=headers):
+                    expected, empty = jsonify(prices).data, jsonify([]).data
+                self.assertEqual(client.get('/api/cvx/', headers=headers).data, expected)
+                self.assertEqual(client.get('/api/unknown/', headers=headers).data, empty)
+
+    def test_prices_pages(self):
+        dates = []
+        url = '/api/cvx/?limit=4'
+        with self.app.test_client() as client:
+            while url:
+                resp_client = client.get(url)
+                dates.extend(item['date'] for item in json.loads(resp_client.data))
+                link = resp_client.headers.get('Link')
+                url = link and link[1:link.index('>')]
+
+        self.assertEqual(len(dates), 10)
+        self.assertEqual(dates, sorted(dates))
+
+    def unpack_columns(self, resp_client):
+        """Columns of the msgpack response as the lists of the JSON values"""
+        self.assertEqual(resp_client.mimetype, 'application/x-msgpack')
+        payload = msgpack.unpackb(resp_client.data, raw=False)
+        columns = dict(
+            (column['name'], np.frombuffer(column['data'], column['dtype']).tolist()) for column in payload['columns']
+        )
+        self.assertTrue(all(len(values) == payload['length'] for values in columns.values()))
+        columns['date'] = [day.isoformat() for day in columns['date']]
+        return columns
+
+    def json_columns(self, resp_client):
+        rows = json.loads(resp_client.data)
+        return dict((name, [row[name] for row in rows]) for name in (rows[0] if rows else ()))
+
+    def test_prices_msgpack(self):
+        msgpack_accept = {'Accept': 'application/x-msgpack'}
+        with self.app.test_client() as client:
+            prices = self.json_columns(client.get('/api/cvx/', headers={'Accept': 'application/json, */*'}))
+            self.assertEqual(self.unpack_columns(client.get('/api/cvx/', headers=msgpack_accept)), prices)
+            self.assertEqual(self.unpack_columns(client.get('/api/unknown/', headers=msgpack_accept))['date'], [])
+
+            resp_client = client.get('/api/cvx/?limit=4&after=2018-01-01', headers=msgpack_accept)
+            self.assertEqual(self.unpack_columns(resp_client)['date'], prices['date'][2:6])
+            self.assertIn('after=2018-01-05', resp_client.headers['Link'])
+            self.assertIn('Accept', resp_client.headers['Vary'])
+
+            url = '/api/cvx/delta/?type=close&value=11'
+            resp_json = client.get(url)
+            resp_client = client.get(url, headers=msgpack_accept)
+            self.assertNotEqual(resp_client.headers['ETag'], resp_json.headers['ETag'])
+            delta = self.json_columns(resp_json)
+            # the rounded decimal of JSON goes as the float
+            delta['total_diff'] = [float(diff) for diff in delta['total_diff']]
+            self.assertEqual(self.unpack_columns(resp_client), delta)
+
+            resp_client = client.get(url, headers=msgpack_accept)
+            self.assertEqual(resp_client.mimetype, 'application/x-msgpack')
+            self.assertEqual(response_cache.hits, 1)
+
+    def load_trades(self):
+        for ticker_name, day in (('cvx', 1), ('aapl', 2)):
+            trades_loading(ticker_name, [
+                (1, 'Smith John', date(2018, 1, day), 'Sell', 10.25, 100, 1000),
+                (2, 'Müller Ann', date(2018, 1, day), 'Buy', 11.5, 200, 2000),
+            ])
+
+    def test_insiders(self):
+        self.load_trades()
+        with self.app.test_client() as client:
+            resp_client = client.get('/api/aapl/insider/')
+            self.assertEqual(json.loads(resp_client.data), [
+                {'name': 'Müller Ann', 'url': 'http://localhost/api/aapl/insider/M%C3%BCller%20Ann/'},
+                {'name': 'Smith John', 'url': 'http://localhost/api/aapl/insider/Smith%20John/'},
+            ])
+
+    def test_insider_trades(self):
+        self.load_trades()
+        with self.app.test_client() as client:
+            resp_client = client.get('/api/cvx/insider/Smith John/')
+            trades = Trade.query.join(Ticker).filter(Ticker.name == 'cvx', Trade.shares_traded == 100)
+
+            # same as the model schema, with the transaction type by name and the related ids
+            self.assertEqual(json.loads(resp_client.data), InsiderTradeSchema(many=True).dump(trades).data)
+            self.assertEqual(json.loads(resp_client.data)[0]['transaction_type'], 'Sell')
+
+    def test_delta_cache(self):
+        url = '/api/cvx/delta/?type=close&value=11'
+        with self.app.test_client() as client:
+            resp_client = client.get(url)
+            etag = resp_client.headers['ETag']
+            self.assertEqual(resp_client.status_code, 200)
+
+            resp_client = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(resp_client.status_code, 304)
+            self.assertEqual(resp_client.data, b'')
+
+            resp_client = client.get('/api/cvx/delta/?value=11&type=close')
+            self.assertEqual(resp_client.headers['ETag'], etag)
+            self.assertEqual(response_cache.hits, 1)
+
+            ticker = Ticker.query.filter_by(name='cvx').one()
+            Ticker.bump_version(ticker.id)
+            db.session.commit()
+
+            resp_client = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(resp_client.status_code, 200)
+            self.assertNotEqual(resp_client.headers['ETag'], etag)
+            self.assertEqual(len(json.loads(resp_client.data)), 16)
+
+    def test_analytics_batch(self):
+        periods = [('12/31/2017', '01/08/2018'), ('01/02/2018', '12/31/2017'), ('12/30/2017', '01/08/2018')]
+        with self.app.test_client() as client:
+            resp_client = client.post('/api/analytics/', content_type='application/json', data=json.dumps({
+                'tickers': ['cvx', 'aapl', 'unknown'],
+                'periods': [{'date_from': date_from, 'date_to': date_to} for date_from, date_to in periods],
+            }))
+            self.assertEqual(resp_client.status_code, 200)
+            data = json.loads(resp_client.data)
+            self.assertEqual(sorted(data), ['aapl', 'cvx', 'unknown'])
+
+            # every pair answers the same as the analytics of the ticker
+            for ticker_name in ('cvx', 'aapl', 'unknown'):
+                for date_from, date_to in periods:
+                    single = client.get('/api/{}/analytics/?date_from={}&date_to={}'.format(
+                        ticker_name, date_from, date_to
+                    ))
+                    key = '{2}-{0}-{1}:{5}-{3}-{4}'.format(*(date_from.split('/') + date_to.split('/')))
+                    self.assertEqual(data[ticker_name][key], json.loads(single.data))
+            self.assertEqual(len(data['cvx']['2017-12-31:2018-01-08']), 1)
+
+            with self.assertRaises(InvalidUsage) as error:
+                client.post('/api/analytics/', content_type='application/json', data=json.dumps({
+                    'tickers': ['cvx'], 'periods': [{'date_from': '2017-12-31', 'date_to': '01/08/2018'}],
+                }))
+            self.assertIn('periods', error.exception.payload['errors'])
+
+    def test_price_stats(self):
+        PriceStats.refresh(Ticker.query.filter_by(name='cvx').one().id)
+        db.session.commit()
+        with self.app.test_client() as client:
+            resp_client = client.get('/api/cvx/stats/?window=5&date_from=01/01/2018')
+            data = json.loads(resp_client.data)
+            self.assertEqual(len(data), 9)
+            self.assertEqual(sorted(data[0]), ['daily_return', 'date', 'ema', 'sma', 'volatility', 'window'])
+            self.assertEqual([row['window'] for row in data], [5] * 9)
+            self.assertIsNone(data[0]['volatility'])
+            self.assertIsNotNone(data[-1]['volatility'])
+
+            resp_client = client.get('/api/cvx/stats/')
+            self.assertEqual(len(json.loads(resp_client.data)), 30)
+
+    def test_insider_activity(self):
+        self.load_trades()
+        trades_loading('aapl', [(1, 'Smith John', date(2018, 2, 3), 'Sell', 12.25, 300, 700)])
+        with self.app.test_client() as client:
+            resp_client = client.get('/api/aapl/activity/')
+            self.assertEqual(json.loads(resp_client.data), [
+                {
+                    'month': '2018-01-01', 'insider': 'Müller Ann', 'transaction_type': 'Buy',
+                    'trades_count': 1, 'net_shares': 200.0, 'vwap': 11.5,
+                },
+                {
+                    'month': '2018-01-01', 'insider': 'Smith John', 'transaction_type': 'Sell',
+                    'trades_count': 1, 'net_shares': -100.0, 'vwap': 10.25,
+                },
+                {
+                    'month': '2018-02-01', 'insider': 'Smith John', 'transaction_type': 'Sell',
+                    'trades_count': 1, 'net_shares': -300.0, 'vwap': 12.25,
+                },
+            ])
+
+            resp_client = client.get('/api/aapl/activity/?date_from=02/14/2018&insider=Smith John')
+            self.assertEqual([row['month'] for row in json.loads(resp_client.data)], ['2018-02-01'])
+            resp_client = client.get('/api/aapl/activity/?date_to=01/31/2018')
+            self.assertEqual(len(json.loads(resp_client.data)), 2)
+
+    def test_forward_returns(self):
+        self.load_trades()
+        trades_loading('cvx', [(1, 'Smith John', date(2018, 1, 7), 'Sell', 12.25, 300, 700)])
+        with self.app.test_client() as client:
+            resp_client = client.get('/api/cvx/returns/?horizons=1,5')
+            data = json.loads(resp_client.data)
+
+        # entries at the closes of 01-01 (102) and 01-07 (108), the second one has no close 5 days later
+        self.assertEqual(data['insider'][:2], [
+            {
+                'insider': 'Müller Ann', 'horizon': 1, 'trades_count': 1, 'returns_count': 1,
+                'mean_return': 104 / 102 - 1, 'positive_share': 1.0,
+            },
+            {
+                'insider': 'Müller Ann', 'horizon': 5, 'trades_count': 1, 'returns_count': 1,
+                'mean_return': 109 / 102 - 1, 'positive_share': 1.0,
+            },
+        ])
+        smith = data['insider'][2:]
+        self.assertEqual([(row['horizon'], row['trades_count'], row['returns_count']) for row in smith], [
+            (1, 2, 2), (5, 2, 1)
+        ])
+        self.assertAlmostEqual(smith[0]['mean_return'], (104 / 102 + 113 / 108) / 2 - 1)
+        self.assertEqual(
+            [(row['transaction_type'], row['horizon']) for row in data['transaction_type']],
+            [('Buy', 1), ('Buy', 5), ('Sell', 1), ('Sell', 5)]
+        )
+        for row in smith:
+            row['transaction_type'] = 'Sell'
+            del row['insider']
+        self.assertEqual(data['transaction_type'][2:], smith)
+
+        with self.app.test_client() as client:
+            resp_client = client.get('/api/cvx/returns/?date_from=01/02/2018&insider=Smith John')
+            rows = json.loads(resp_client.data)['insider']
+            self.assertEqual([(row['horizon'], row['trades_count']) for row in rows], [(5, 1), (20, 1), (60, 1)])
+            with self.assertRaises(InvalidUsage):
+                client.get('/api/cvx/returns/?horizons=0,5')
+
+    def test_correlation(self):
+        prices_loading('aapl', parse_prices([
+            ['01/0{}/2018'.format(day), '1.0', '2.0', '0.5', '{}.0'.format(200 - day ** 2), '100']
+            for day in range(2, 9)
+        ]))
+        url = '/api/correlation/?tickers=cvx,aapl,unknown&date_to=01/07/2018'
+        with self.app.test_client() as client:
+            resp_client = client.get(url)
+            data = json.loads(resp_client.data)
+            etag = resp_client.headers['ETag']
+
+            # daily returns of the closes of 01-02..01-07 both tickers have
+            returns = np.diff([[196, 191, 184, 175, 164, 151], [104, 106, 108, 110, 109, 108]]) / [
+                [196, 191, 184, 175, 164], [104, 106, 108, 110, 109]
+            ]
+            self.assertEqual(data['tickers'], ['aapl', 'cvx'])
+            self.assertEqual(data['missing'], ['unknown'])
+            self.assertEqual(
+                (data['dates_count'], data['date_from'], data['date_to']), (6, '2018-01-02', '2018-01-07')
+            )
+            self.assertTrue(np.allclose(data['correlation'], np.corrcoef(returns)))
+            self.assertTrue(np.allclose(data['covariance'], np.cov(returns)))
+
+            # the set of the tickers in any order is the same entry
+            resp_client = client.get(
+                '/api/correlation/?date_to=01/07/2018&tickers=unknown,aapl,cvx', headers={'If-None-Match': etag}
+            )
+            self.assertEqual(resp_client.status_code, 304)
+            self.assertEqual(json.loads(client.get(url).data), data)
+            self.assertEqual(response_cache.hits, 1)
+
+            prices_loading('cvx', parse_prices([['01/07/2018', '1.0', '2.0', '0.5', '90.0', '100']]))
+            resp_client = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(resp_client.status_code, 200)
+            self.assertNotEqual(json.loads(resp_client.data)['correlation'], data['correlation'])
+
+            data = json.loads(client.get('/api/correlation/?date_from=01/09/2018').data)
+            self.assertEqual((data['tickers'], data['dates_count']), (['cvx'], 1))
+            self.assertEqual(data['correlation'], [[None]])
+            with self.assertRaises(InvalidUsage):
+                client.get('/api/correlation/?tickers=')
+
+    def test_metrics(self):
+        with self.app.test_client() as client:
+            client.get('/api/cvx/?limit=4')
+            client.get('/api/cvx/?limit=4')
+            client.get('/api/')
+            resp_client = client.get('/metrics')
+
+        self.assertEqual(resp_client.content_type, 'text/plain; version=0.0.4; charset=utf-8')
+        lines = resp_client.data.decode().splitlines()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', lines)
+        self.assertIn(
+            'http_request_duration_seconds_count{endpoint="api.get_tick_prices",method="GET",status="200"} 2', lines
+        )
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="api.get_tickers",method="GET",status="200",'
+                      'le="+Inf"} 1', lines)
+        # one select of the page per request
+        self.assertIn('http_request_sql_statements_sum{endpoint="api.get_tick_prices"} 2.0', lines)
+        self.assertEqual(metrics.value('http_request_sql_statements', endpoint='api.get_tickers'), 1)
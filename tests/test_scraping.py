@@ -0,0 +1,613 @@
+import os
+import time
+import shutil
+import hashlib
+import asyncio
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from unittest import TestCase
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from tests.test_config import BaseTestCase
+from project.models import Ticker, PriceHistory, Trade, TransactionType, ScrapeJob
+from project.page_cache import PageCache, NOT_MODIFIED, SAME_CONTENT, CHANGED
+from project.utils import _upsert_by_lookup
+from project.metrics import metrics
+from project import db, models
+from project.parsing import parse_prices, parse_trades, parse_int, parse_float
+from scraping import (
+    TradingScraper, TypeScrap, ParseStats, LeaseLost, create_session, prices_loading, trades_loading, main, work
+)
+from project.scheduler import Scheduler, TokenBucket, FetchError
+from project.pipeline import Pipeline
+from benchmarks import generators
+
+PAGES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'pages')
+
+
+class StubNasdaq:
+    """Local server with the recorded nasdaq pages, counts the requests in flight
+
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.trade_pages = []
+        # tickers of the requests in order, every ticker gets the pages of cvx
+        self.tickers = []
+        # count of the next requests answered by 503
+        self.errors = 0
+        self.app = web.Application()
+        self.app.router.add_post('/symbol/{ticker}/historical', self.historical)
+        self.app.router.add_get('/symbol/{ticker}/insider-trades', self.insider_trades)
+
+    async def serve(self, file_name, request=None):
+        if self.errors:
+            self.errors -= 1
+            return web.Response(status=503)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            with open(os.path.join(PAGES_DIR, file_name), 'rb') as page:
+                body = page.read()
+            if request is None:
+                return web.Response(body=body, content_type='text/html')
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            if request.headers.get('If-None-Match') == etag:
+                return web.Response(status=304, headers={'ETag': etag})
+            return web.Response(body=body, content_type='text/html', headers={'ETag': etag})
+        finally:
+            self.in_flight -= 1
+
+    async def historical(self, request):
+        self.tickers.append(request.match_info['ticker'])
+        return await self.serve('cvx_historical.html')
+
+    async def insider_trades(self, request):
+        self.tickers.append(request.match_info['ticker'])
+        self.trade_pages.append(int(request.query.get('page', 1)))
+        page = min(int(request.query.get('page', 1)), 2)
+        return await self.serve('cvx_insider_trades_{}.html'.format(page), request)
+
+
+def run_worker(worker, base_url, lease):
+    """Worker process of the queue, forked with the app of the test"""
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    work(2, full=True, parse_workers=0, base_url=base_url, worker=worker, lease=lease, poll=0.2)
+
+
+class TestTradingScraper(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.stub = StubNasdaq(delay=0.2)
+        self.server = TestServer(self.stub.app)
+        self.loop.run_until_complete(self.server.start_server())
+        self.base_url = str(self.server.make_url('')).rstrip('/')
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.server.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def scrap(self, *jobs, **kwargs):
+        async def gather():
+            async with create_session(5) as session:
+                scraper = TradingScraper('CVX', TypeScrap.ALL, session=session, base_url=self.base_url, **kwargs)
+                agents = await asyncio.gather(*(job(scraper) for job in jobs))
+                return [list(agent) for agent in agents]
+        return self.loop.run_until_complete(gather())
+
+    def test_prices(self):
+        prices, = self.scrap(lambda scraper: scraper.scraping_prices())
+
+        self.assertEqual(len(prices), 9)
+        self.assertEqual(prices[0], ('16:00', '117.91', '118.67', '116.80', '117.38', '6,107,912'))
+
+    def test_trades(self):
+        trades, = self.scrap(lambda scraper: scraper.scraping_trades(1))
+
+        self.assertEqual(len(trades), 5)
+        self.assertEqual(trades[0][:5], (
+            'johnson-james-w-1220351', 'JOHNSON JAMES W', '114.86', 'Chief Executive Officer', '10/12/2018'
+        ))
+        self.assertIs(type(trades[0][0]), str)
+        # empty last price of the option execute
+        self.assertEqual(trades[3][2], '')
+
+    def test_pages_overlap(self):
+        pages = self.scrap(*(
+            lambda scraper, index=index: scraper.scraping_trades(index)
+            for index in range(1, 5)
+        ))
+
+        self.assertEqual([len(page) for page in pages], [5, 4, 4, 4])
+        self.assertGreater(self.stub.max_in_flight, 1)
+
+    def test_parse_workers(self):
+        parse_stats = ParseStats()
+        with ProcessPoolExecutor(2) as executor:
+            pages = self.scrap(
+                lambda scraper: scraper.scraping_prices(),
+                lambda scraper: scraper.scraping_trades(1),
+                executor=executor, parse_stats=parse_stats
+            )
+
+        self.assertEqual(pages, self.scrap(
+            lambda scraper: scraper.scraping_prices(),
+            lambda scraper: scraper.scraping_trades(1),
+        ))
+        self.assertEqual(parse_stats.pages, 2)
+        self.assertGreater(parse_stats.max_rss, 0)
+
+
+class TestParsing(TestCase):
+
+    def test_prices(self):
+        today = date(2018, 10, 12)
+        rows = parse_prices([
+            ['16:00', '117.91', '118.67', '116.80', '117.38', '6,107,912'],
+            ['10/11/2018', '1,118.33', '1,118.92', '1,116.53', '1,116.58', '854,568'],
+            ['', '', '', '', '', ''],
+        ], today=today)
+
+        self.assertEqual(rows, [
+            (today, 117.91, 118.67, 116.8, 117.38, 6107912),
+            (date(2018, 10, 11), 1118.33, 1118.92, 1116.53, 1116.58, 854568),
+        ])
+
+    def test_trades(self):
+        rows = parse_trades([
+            ['wirth-michael-k-1024427', 'WIRTH MICHAEL K', '', 'CEO', '09/14/2018', 'Option Execute', 'direct',
+             '8,102', '1,542,084'],
+        ])
+
+        self.assertEqual(rows, [
+            (1024427, 'WIRTH MICHAEL K', date(2018, 9, 14), 'Option Execute', 0.0, 8102, 1542084)
+        ])
+
+    def test_same_as_listeners(self):
+        for value in ('0', '12', '1,234', '1,234,567', '12.5', '1,234.75', ' 42 '):
+            self.assertEqual(parse_int(value), models.parse_int(value), value)
+        for value in ('', '0.0', '117.91', '1,118.33', '0.0001', '12'):
+            self.assertEqual(parse_float(value), models.parse_float(value), value)
+
+    def test_generated_pages(self):
+        # pages of the benchmarks must go through the same extraction as the scraped ones
+        prices = [generators.scraped_price(bar) for bar in generators.price_bars(5)]
+        trades = generators.scraped_trades(5)
+
+        self.assertEqual(TradingScraper.extract_prices(generators.prices_html(prices)), [tuple(row) for row in prices])
+        self.assertEqual(
+            TradingScraper.extract_trades(generators.trades_html(trades, last_page=3)),
+            ([tuple(row) for row in trades], 3)
+        )
+
+
+class TestLoading(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def test_prices_loading(self):
+        page = [
+            ['01/01/2018', '101.50', '103.00', '100.25', '102.75', '1,234,567'],
+            ['02/01/2019', '120.00', '121.00', '119.00', '120.50', '7,654,321'],
+            ['02/01/2019', '120.00', '121.00', '119.00', '120.75', '7,654,322'],
+            ['', '', '', '', '', ''],
+        ]
+        prices_loading('cvx', parse_prices(page))
+        prices = PriceHistory.query.join(Ticker).filter(Ticker.name == 'cvx')
+
+        self.assertEqual(prices.count(), 11)
+        updated = prices.filter(PriceHistory.date == date(2018, 1, 1)).one()
+        self.assertEqual((updated.open, updated.close, updated.volume), (101.5, 102.75, 1234567))
+        created = prices.filter(PriceHistory.date == date(2019, 2, 1)).one()
+        self.assertEqual((created.close, created.volume), (120.75, 7654322))
+        self.assertEqual(metrics.value('db_rows_inserted_total', table='price_history'), 1)
+        self.assertEqual(metrics.value('db_rows_updated_total', table='price_history'), 1)
+
+        # the same page again writes neither the prices nor the stats
+        stats = metrics.value('db_rows_inserted_total', table='price_stats')
+        prices_loading('cvx', parse_prices(page))
+        self.assertEqual(metrics.value('db_rows_inserted_total', table='price_history'), 1)
+        self.assertEqual(metrics.value('db_rows_updated_total', table='price_history'), 1)
+        self.assertEqual(metrics.value('db_rows_inserted_total', table='price_stats'), stats)
+
+    def test_trades_loading(self):
+        trades = [
+            ['wirth-michael-k-1024427', 'WIRTH MICHAEL K', '114.86', 'CEO', '10/12/2018', 'Sell', 'direct',
+             '20,272', '424,002'],
+            ['wirth-michael-k-1024427', 'WIRTH MICHAEL K', '', 'CEO', '10/12/2018', 'Option Execute', 'direct',
+             '8,102', '444,274'],
+        ]
+        trades_loading('cvx', parse_trades(trades))
+        trades[0][2] = '115.10'
+        trades_loading('cvx', parse_trades(trades))
+
+        self.assertEqual(Trade.query.count(), 2)
+        sell = Trade.query.join(TransactionType).filter(TransactionType.name == 'Sell').one()
+        self.assertEqual((sell.last_price, sell.shares_traded, sell.shares_held), (115.1, 20272, 424002))
+        option = Trade.query.join(TransactionType).filter(TransactionType.name == 'Option Execute').one()
+        self.assertEqual(option.last_price, 0.0)
+
+    def test_upsert_by_lookup(self):
+        ticker = Ticker.query.filter_by(name='aapl').one()
+        row = dict(ticker_id=ticker.id, date=date(2018, 1, 2), open=1.0, high=2.0, low=0.5, close=1.5, volume=10)
+        keys = ['ticker_id', 'date']
+        self.assertEqual(_upsert_by_lookup(PriceHistory.__table__, [row], keys, ('date',)), [(True, date(2018, 1, 2))])
+        self.assertEqual(_upsert_by_lookup(PriceHistory.__table__, [dict(row, close=1.75)], keys, ()), [(False,)])
+        self.assertEqual(_upsert_by_lookup(PriceHistory.__table__, [dict(row, close=1.75)], keys, ()), [])
+
+        self.assertEqual(
+            [(price.close, price.volume) for price in PriceHistory.query.filter_by(ticker_id=ticker.id)],
+            [(1.75, 10)]
+        )
+
+
+class TestPageCache(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.stub = StubNasdaq()
+        self.server = TestServer(self.stub.app)
+        self.loop.run_until_complete(self.server.start_server())
+        self.base_url = str(self.server.make_url('')).rstrip('/')
+        self.cache_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.server.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.cache_path)
+        super().tearDown()
+
+    def scrap(self, full=True, path=True, **kwargs):
+        page_cache = PageCache(self.cache_path if path else None, **kwargs)
+        self.stub.trade_pages = []
+        self.loop.run_until_complete(main(
+            self.loop, ['cvx'], threads_limit=2, base_url=self.base_url, page_cache=page_cache, full=full
+        ))
+        return page_cache.counters
+
+    def data_version(self):
+        db.session.rollback()
+        return Ticker.query.filter_by(name='cvx').one().data_version
+
+    def test_unchanged_pages(self):
+        self.assertEqual(self.scrap(), {NOT_MODIFIED: 0, SAME_CONTENT: 0, CHANGED: 3})
+        self.assertEqual(Trade.query.count(), 9)
+        version = self.data_version()
+        self.assertEqual(metrics.value('scraper_pages_total', kind='trades', state=CHANGED), 2)
+        self.assertEqual(metrics.value('scraper_rows_parsed_total', kind='trades'), 9)
+        for stage in ('fetch', 'extract', 'parse', 'load'):
+            self.assertGreater(metrics.value('scraper_stage_seconds', stage=stage), 0, stage)
+        self.assertGreater(metrics.total('db_statements_total'), 0)
+
+        # trades are validated by ETag, prices of the POST form by the content hash
+        self.assertEqual(self.scrap(), {NOT_MODIFIED: 2, SAME_CONTENT: 1, CHANGED: 0})
+        self.assertEqual(self.data_version(), version)
+
+        # one version per transaction of the writer, pages waiting in the queue go together
+        batches = metrics.value('scraper_write_batch_pages')
+        self.assertEqual(self.scrap(force=True), {NOT_MODIFIED: 0, SAME_CONTENT: 0, CHANGED: 3})
+        self.assertEqual(self.data_version(), version + metrics.value('scraper_write_batch_pages') - batches)
+
+    def test_trades_mark(self):
+        self.scrap(full=False, path=False)
+        self.assertEqual(self.stub.trade_pages, [1, 2])
+        self.assertEqual(Ticker.get_trades_mark('cvx'), (date(2018, 10, 12), '1220351:Automatic Sell:2018-10-12'))
+
+        # newest trade is known from the first page
+        self.scrap(full=False, path=False)
+        self.assertEqual(self.stub.trade_pages, [1])
+
+        self.scrap(full=True, path=False)
+        self.assertEqual(self.stub.trade_pages, [1, 2])
+
+    def test_unchanged_first_page(self):
+        self.scrap(full=False)
+        self.assertEqual(self.scrap(full=False), {NOT_MODIFIED: 1, SAME_CONTENT: 1, CHANGED: 0})
+        self.assertEqual(self.stub.trade_pages, [1])
+
+
+class TestScheduler(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.stub = StubNasdaq(delay=0.05)
+        self.server = TestServer(self.stub.app)
+        self.loop.run_until_complete(self.server.start_server())
+        self.base_url = str(self.server.make_url('')).rstrip('/')
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.server.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        super().tearDown()
+
+    def request(self, scheduler):
+        async def fetch():
+            async with create_session(2) as session:
+                status, _, _ = await scheduler.request(session, 'GET', self.base_url + '/symbol/cvx/insider-trades')
+                return status
+        return self.loop.run_until_complete(fetch())
+
+    def test_interleaved_tickers(self):
+        self.loop.run_until_complete(main(
+            self.loop, ['cvx', 'aapl', 'xom'], threads_limit=4, base_url=self.base_url, full=True
+        ))
+
+        # the ticker with the fewest pages issued goes next
+        self.assertEqual(set(self.stub.tickers[:3]), {'cvx', 'aapl', 'xom'})
+        self.assertEqual(len(self.stub.tickers), 9)
+        self.assertEqual(Trade.query.count(), 27)
+        for ticker_name in ('cvx', 'aapl', 'xom'):
+            self.assertIsNotNone(Ticker.get_trades_mark(ticker_name))
+
+    def test_retries(self):
+        self.stub.errors = 2
+        scheduler = Scheduler(4, backoff=0.01)
+        self.assertEqual(self.request(scheduler), 200)
+        self.assertEqual(scheduler.retried, 2)
+        self.assertEqual(metrics.value('scraper_retries_total'), 2)
+
+        self.stub.errors = 2
+        with self.assertRaises(FetchError):
+            self.request(Scheduler(4, retries=1, backoff=0.01))
+
+    def test_failed_ticker(self):
+        self.stub.errors = 1
+        self.loop.run_until_complete(main(
+            self.loop, ['cvx', 'aapl'], threads_limit=1, types_scrubs=TypeScrap.TRADE, base_url=self.base_url,
+            full=True, retries=0
+        ))
+
+        # first page of cvx failed, its mark would skip the trades of the page
+        self.assertEqual(self.stub.tickers, ['cvx', 'aapl', 'aapl'])
+        self.assertIsNone(Ticker.get_trades_mark('cvx'))
+        self.assertIsNotNone(Ticker.get_trades_mark('aapl'))
+        self.assertEqual(metrics.value('scraper_pages_failed_total'), 1)
+
+    def test_aimd(self):
+        scheduler = Scheduler(8)
+        self.assertEqual(scheduler.concurrency, 4)
+        for _ in range(40):
+            scheduler.succeeded(0.1)
+        self.assertEqual(scheduler.concurrency, 8)
+
+        scheduler.succeeded(1.0)
+        self.assertEqual(scheduler.concurrency, 4)
+        # one decrease per cooldown
+        scheduler.decrease()
+        self.assertEqual(scheduler.concurrency, 4)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=50, burst=2)
+
+        async def acquire():
+            started = time.monotonic()
+            for _ in range(7):
+                await bucket.acquire()
+            return time.monotonic() - started
+        self.assertGreaterEqual(self.loop.run_until_complete(acquire()), 0.09)
+
+
+class TestPipeline(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.written = []
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        super().tearDown()
+
+    def write(self, pages):
+        time.sleep(0.02)
+        self.written.append(list(pages))
+
+    def run_pipeline(self, write, pages, **kwargs):
+        async def run():
+            pipeline = Pipeline(
+                lambda ticker_name, page: (ticker_name, page), write, self.app, **kwargs
+            )
+            try:
+                for page in range(pages):
+                    await pipeline.put('cvx', page)
+                await pipeline.finish(lambda: self.written.append('finished'))
+            finally:
+                await pipeline.close()
+            return pipeline
+        return self.loop.run_until_complete(run())
+
+    def test_batches(self):
+        pipeline = self.run_pipeline(self.write, 10, queue_size=4, batch_pages=3)
+
+        # pages waiting while the writer is busy go by one call, in order
+        self.assertEqual(self.written[-1], 'finished')
+        self.assertEqual(sum(self.written[:-1], []), [('cvx', page) for page in range(10)])
+        self.assertLess(pipeline.batches, 10)
+        self.assertTrue(all(len(batch) <= 3 for batch in self.written[:-1]))
+        self.assertEqual(metrics.value('scraper_write_batch_pages'), pipeline.batches)
+        self.assertGreater(metrics.value('scraper_queue_depth', stage='load'), 0)
+
+    def test_failed_writer(self):
+        def write(pages):
+            raise ValueError('broken')
+        with self.assertRaises(ValueError):
+            self.run_pipeline(write, 10, queue_size=1)
+        self.assertEqual(self.written, [])
+
+
+class TestScrapeJobs(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.stub = StubNasdaq()
+        self.server = TestServer(self.stub.app)
+        self.loop.run_until_complete(self.server.start_server())
+        self.base_url = str(self.server.make_url('')).rstrip('/')
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.server.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        super().tearDown()
+
+    def states(self):
+        db.session.rollback()
+        return dict(
+            ((job.ticker_name, job.kind), (job.state, job.attempts)) for job in ScrapeJob.query
+        )
+
+    def expire(self):
+        ScrapeJob.query.update(dict(leased_until=db.func.now() - timedelta(seconds=1)), synchronize_session=False)
+        db.session.commit()
+
+    def test_claim(self):
+        self.assertEqual(ScrapeJob.enqueue(['CVX', 'aapl'], ['price', 'trade']), 4)
+        locked = ScrapeJob.query.filter_by(ticker_name='aapl', kind='price').one().id
+        db.session.rollback()
+
+        # the row locked by the other worker is skipped
+        with db.engine.connect() as connection:
+            transaction = connection.begin()
+            connection.execute('SELECT id FROM scrape_job WHERE id = %s FOR UPDATE', locked)
+            claimed = ScrapeJob.claim('first', 10, 60)
+            transaction.rollback()
+        self.assertEqual(sorted(job[1:] for job in claimed), [('aapl', 'trade'), ('cvx', 'price'), ('cvx', 'trade')])
+        self.assertEqual(ScrapeJob.claim('second', 10, 60), [(locked, 'aapl', 'price')])
+        self.assertEqual(ScrapeJob.claim('third', 10, 60), [])
+
+        # running jobs are left to their workers
+        self.assertEqual(ScrapeJob.enqueue(['cvx'], ['price']), 0)
+        self.assertEqual(ScrapeJob.heartbeat('second', [job[0] for job in claimed], 60), 0)
+        self.assertEqual(ScrapeJob.complete([locked], 'second'), 1)
+        self.assertEqual(ScrapeJob.pending(), 3)
+        self.assertEqual(ScrapeJob.enqueue(['aapl'], ['price']), 1)
+
+    def test_lease(self):
+        ScrapeJob.enqueue(['cvx'], ['trade'])
+        job_id, _, _ = ScrapeJob.claim('crashed', 10, 60)[0]
+        self.assertEqual(ScrapeJob.heartbeat('crashed', [job_id], 60), 1)
+        self.assertEqual(ScrapeJob.claim('second', 10, 60), [])
+
+        # the expired lease goes to the next worker, the first one can't finish the job anymore
+        self.expire()
+        self.assertEqual(ScrapeJob.claim('second', 10, 60), [(job_id, 'cvx', 'trade')])
+        self.assertEqual(ScrapeJob.complete([job_id], 'crashed'), 0)
+        self.assertEqual(self.states(), {('cvx', 'trade'): ('running', 2)})
+
+        # failed job is queued again up to the max of the attempts
+        self.assertEqual(ScrapeJob.complete([job_id], 'second', failed=True), 1)
+        self.assertEqual(self.states(), {('cvx', 'trade'): ('queued', 2)})
+        ScrapeJob.claim('third', 10, 60)
+        self.expire()
+        self.assertEqual(ScrapeJob.claim('fourth', 10, 60), [])
+        self.assertEqual(self.states(), {('cvx', 'trade'): ('failed', 3)})
+        self.assertEqual(ScrapeJob.pending(), 0)
+
+    def test_lost_lease(self):
+        self.stub.delay = 0.5
+        ScrapeJob.enqueue(['cvx'], ['trade'])
+        jobs = ScrapeJob.claim('local', 4, 1)
+        # taken over before the first heartbeat
+        ScrapeJob.query.update(dict(worker='other'), synchronize_session=False)
+        db.session.commit()
+
+        with self.assertRaises(LeaseLost):
+            self.loop.run_until_complete(main(
+                self.loop, None, base_url=self.base_url, parse_workers=0, full=True, jobs=jobs, worker='local', lease=1
+            ))
+        self.assertEqual(self.states(), {('cvx', 'trade'): ('running', 1)})
+        self.assertLess(len(self.stub.tickers), 3)
+
+    def test_worker(self):
+        self.assertEqual(ScrapeJob.enqueue(['cvx', 'aapl', 'xom'], ['price', 'trade']), 6)
+        ScrapeJob.enqueue(['ibm'], ['trade'])
+        ScrapeJob.claim('crashed', 1, 60)
+        self.expire()
+
+        work(4, full=True, parse_workers=0, base_url=self.base_url, worker='local')
+
+        # both kinds of the ticker go by one scraper, the job of the crashed worker is taken over
+        self.assertEqual(sorted(self.stub.tickers), sorted(['aapl', 'cvx', 'xom'] * 3 + ['ibm'] * 2))
+        states = self.states()
+        self.assertEqual(states.pop(('aapl', 'price')), ('done', 2))
+        self.assertEqual(set(states.values()), {('done', 1)})
+        self.assertEqual(Trade.query.count(), 36)
+        for ticker_name in ('cvx', 'aapl', 'xom', 'ibm'):
+            self.assertIsNotNone(Ticker.get_trades_mark(ticker_name))
+
+    def test_worker_processes(self):
+        self.stub.delay = 0.2
+        tickers = ['cvx', 'aapl', 'xom', 'ibm', 'msft', 'ge']
+        self.assertEqual(ScrapeJob.enqueue(tickers, ['price', 'trade']), 12)
+        context = multiprocessing.get_context('fork')
+        processes = []
+
+        def start(worker):
+            # the forked workers open their own connections
+            db.session.remove()
+            db.engine.dispose()
+            process = context.Process(target=run_worker, args=(worker, self.base_url, 2))
+            process.start()
+            processes.append(process)
+            return process
+
+        async def wait(condition, timeout=60):
+            started = time.monotonic()
+            while not condition():
+                self.assertLess(time.monotonic() - started, timeout)
+                await asyncio.sleep(0.05)
+
+        try:
+            crashed = start('crashed')
+            self.loop.run_until_complete(wait(lambda: ScrapeJob.query.filter_by(worker='crashed').count() > 0))
+            leases = dict((job.id, job.leased_until) for job in ScrapeJob.query.filter_by(worker='crashed'))
+            crashed.kill()
+            crashed.join()
+
+            workers = [start('first'), start('second')]
+            self.loop.run_until_complete(wait(lambda: not any(process.is_alive() for process in workers)))
+            self.assertEqual([process.exitcode for process in workers], [0, 0])
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.kill()
+
+        # every job is done once, the ones of the killed worker by the second attempt after its lease
+        jobs = ScrapeJob.query.all()
+        self.assertEqual(sorted((job.ticker_name, job.kind) for job in jobs), sorted(
+            (ticker_name, kind) for ticker_name in tickers for kind in ('price', 'trade')
+        ))
+        self.assertEqual(set(job.state for job in jobs), {'done'})
+        self.assertEqual(
+            dict((job.id, job.attempts) for job in jobs if job.attempts > 1), dict.fromkeys(leases, 2)
+        )
+        for job in jobs:
+            if job.id in leases:
+                self.assertGreaterEqual(job.finished_at, leases[job.id])
+
+        # the jobs of the live workers are scraped once, the price page and two pages of trades
+        taken_over = set(job.ticker_name for job in jobs if job.id in leases)
+        for ticker_name in set(tickers) - taken_over:
+            self.assertEqual(self.stub.tickers.count(ticker_name), 3)
+        self.assertEqual(Trade.query.count(), 9 * len(tickers))
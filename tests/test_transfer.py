@@ -0,0 +1,78 @@
+import io
+from datetime import date
+
+from tests.test_config import BaseTestCase
+from project import db
+from project.metrics import metrics
+from project.models import Ticker, PriceHistory, PriceStats, Trade, InsiderActivity
+from project.transfer import export_csv, import_csv
+from scraping import trades_loading
+
+
+class TestTransfer(BaseTestCase):
+    fixtures = ['test_data.json']
+
+    def export(self, kind, copy=None):
+        csv_file = io.StringIO()
+        export_csv(kind, csv_file, copy=copy)
+        return csv_file.getvalue()
+
+    def reimport(self, kind, content, copy=None):
+        """Import the export into the emptied tables"""
+        for model in (PriceStats, InsiderActivity, PriceHistory, Trade):
+            model.query.delete()
+        db.session.commit()
+        return import_csv(kind, io.StringIO(content), copy=copy)
+
+    def load_trades(self):
+        trades_loading('cvx', [
+            (1, 'Smith John', date(2018, 1, 1), 'Sell', 10.25, 100, 1000),
+            (2, 'Müller, "Ann"', date(2018, 1, 2), 'Buy', 11.5, 200, 2000),
+        ])
+
+    def test_prices_round_trip(self):
+        exported = self.export('prices')
+        self.assertEqual(exported, self.export('prices', copy=False))
+        self.assertEqual(exported.splitlines()[:2], [
+            'ticker,date,open,high,low,close,volume',
+            'cvx,2017-12-31,100,121,118,100,9516349',
+        ])
+
+        for copy in (True, False):
+            self.assertEqual(self.reimport('prices', exported, copy=copy), 10)
+            self.assertEqual(self.export('prices'), exported)
+            self.assertEqual(PriceStats.check(Ticker.query.filter_by(name='cvx').one().id), [])
+
+    def test_trades_round_trip(self):
+        self.load_trades()
+        exported = self.export('trades')
+        self.assertEqual(exported, self.export('trades', copy=False))
+
+        for copy in (True, False):
+            self.assertEqual(self.reimport('trades', exported, copy=copy), 2)
+            self.assertEqual(self.export('trades'), exported)
+            self.assertEqual(InsiderActivity.query.count(), 2)
+
+    def test_merge(self):
+        version = Ticker.query.filter_by(name='cvx').one().data_version
+        content = '\n'.join([
+            'ticker,date,open,high,low,close,volume',
+            'cvx,2017-12-31,1.5,2.5,0.5,2.0,10',
+            'cvx,2017-12-31,1.5,2.5,0.5,2.25,20',
+            'xom,2018-01-02,3.0,4.0,2.0,3.5,30',
+        ])
+        for copy in (True, False):
+            self.assertEqual(import_csv('prices', io.StringIO(content), copy=copy), 2)
+
+        # the last row of the same key wins
+        updated = PriceHistory.query.join(Ticker).filter(Ticker.name == 'cvx', PriceHistory.date == date(2017, 12, 31))
+        self.assertEqual((updated.one().close, updated.one().volume), (2.25, 20))
+        self.assertEqual(PriceHistory.query.join(Ticker).filter(Ticker.name == 'xom').count(), 1)
+        self.assertEqual(Ticker.query.filter_by(name='cvx').one().data_version, version + 2)
+        self.assertEqual(metrics.value('db_rows_inserted_total', table='price_history'), 1)
+        # the second import changes nothing
+        self.assertEqual(metrics.value('db_rows_updated_total', table='price_history'), 1)
+
+    def test_wrong_columns(self):
+        with self.assertRaises(ValueError):
+            import_csv('trades', io.StringIO('ticker,date,open,high,low,close,volume\n'))